@@ -0,0 +1,67 @@
+"""
+Bytecode generation and serialization time for generated programs of
+increasing size.
+
+Usage: python benchmarks/compile_scaling.py [sizes...]
+
+Each size is the number of generated statements, the time per opcode should
+stay roughly constant if compilation scales linearly.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from uzac.bytecode import ByteCodeProgram, ByteCodeProgramSerializer
+from uzac.parser import Parser
+from uzac.typer import Typer
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+
+def generate_program(statements: int) -> str:
+    """
+    Returns a program with about _statements_ statements. Constants repeat so
+    that the constant pool of the global chunk stays small.
+    """
+    lines = ["var acc = 0", "var facc = 0.0"]
+    for i in range(statements // 4):
+        lines.append("{")
+        lines.append(f"const a = {i % 100} + acc")
+        lines.append(f"const b = a * {i % 50}.5 + facc")
+        lines.append("acc = acc + a % 7")
+        lines.append("facc = facc + b")
+        lines.append("}")
+    lines.append("println(facc + acc)")
+    return "\n".join(lines)
+
+
+def main(sizes) -> None:
+    print(
+        f"{'statements':>10} {'opcodes':>9} {'bytes':>10} {'codegen (s)':>12}"
+        f" {'serialize (s)':>14} {'us/op':>6}"
+    )
+    for size in sizes:
+        program = Parser(generate_program(size)).parse()
+        diagnostic = Typer(program).typecheck_program()
+        assert diagnostic.error_count == 0, diagnostic.errors
+
+        start = time.perf_counter()
+        bytecode = ByteCodeProgram(program)
+        generated = time.perf_counter()
+        serializer = ByteCodeProgramSerializer(bytecode)
+        code = serializer.get_bytes()
+        serialized = time.perf_counter()
+
+        opcodes = sum(len(chunk.code) for chunk in bytecode.chunks)
+        total = serialized - start
+        print(
+            f"{size:>10} {opcodes:>9} {len(code):>10} {generated - start:>12.3f}"
+            f" {serialized - generated:>14.3f} {total / opcodes * 1e6:>6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,69 @@
+"""
+Most frequent pairs of consecutive opcodes in uza programs, used to choose
+the superinstructions of the peephole optimizer.
+
+Usage: python benchmarks/opcode_pairs.py [-O LEVEL] [--top N] [--executed] files...
+
+Pairs inside loops are weighted by their nesting depth, see
+`uzac.peephole.opcode_pairs`. With --executed the programs are run and the
+pairs are the ones the VM actually executed, see `uzac.profiler.OpStatsReport`.
+Compare -O1 to -O2 to see which sequences the superinstructions already cover.
+"""
+
+import argparse
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from uzac.bytecode import ByteCodeProgram, ByteCodeProgramSerializer
+from uzac.optimizer import OPTIMIZATION_LEVELS, Optimizer
+from uzac.parser import Parser
+from uzac.peephole import PeepholeOptimizer, opcode_pairs
+from uzac.profiler import OpStatsReport
+from uzac.typer import Typer
+from vm.main import op_stats, run_vm
+
+
+def count_file(path: str, level: int, executed: bool) -> Counter:
+    with open(path, "r", encoding="ascii") as file:
+        program = Parser(file.read()).parse()
+    diagnostic = Typer(program).typecheck_program()
+    assert diagnostic.error_count == 0, diagnostic.errors
+    program = Optimizer(program, level).optimize()
+    byte_code = ByteCodeProgram(program)
+    if level >= 2:
+        PeepholeOptimizer(byte_code).optimize()
+    if not executed:
+        return opcode_pairs(byte_code)
+    run_vm(ByteCodeProgramSerializer(byte_code), count_ops=True)
+    report = OpStatsReport(op_stats(), byte_code)
+    return Counter({(first, second): count for first, second, count in report.pairs})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument(
+        "-O", type=int, choices=OPTIMIZATION_LEVELS, default=OPTIMIZATION_LEVELS[-1]
+    )
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument(
+        "--executed",
+        action="store_true",
+        help="run the programs and count the executed pairs",
+    )
+    args = parser.parse_args()
+
+    pairs = Counter()
+    for path in args.files:
+        pairs += count_file(path, args.O, args.executed)
+    total = sum(pairs.values()) or 1
+    print(f"{'first':>18} {'second':>18} {'weight':>10} {'share':>6}")
+    for (first, second), weight in pairs.most_common(args.top):
+        print(f"{first.name:>18} {second.name:>18} {weight:>10} {weight / total:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Cold start of the uza CLI in each of its modes, measured with -X importtime.
+
+Usage: python benchmarks/startup.py [--runs N] [--top N] [--json]
+
+Each mode runs a small program in a fresh interpreter. The table shows the
+best wall time of the runs, the time spent importing modules, the part of it
+spent in the uza modules and whether the parser, the typer and the VM module
+were imported at all. Parsing and typechecking should not import the VM and
+running cached bytecode should import neither the parser nor the typer.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+SOURCE = """\
+func fib(n: int) => int {
+    if n < 2 then return n
+    return fib(n - 1) + fib(n - 2)
+}
+println(fib(15))
+"""
+
+# the cached mode runs after the run mode has filled the cache
+MODES = {
+    "parse": ["-p", "prog.uza"],
+    "typecheck": ["-t", "prog.uza"],
+    "interpret": ["-i", "prog.uza"],
+    "run": ["--no-cache", "prog.uza"],
+    "run cached": ["prog.uza"],
+    "run .uzb": ["prog.uzb"],
+}
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """
+    Returns the self and cumulative import times in microseconds of each
+    module in the -X importtime output _stderr_.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(args: list[str], directory: str, runs: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(ROOT), UZA_CACHE_DIR=directory)
+    command = [sys.executable, "-X", "importtime", "-m", "uzac", *args]
+    best = float("inf")
+    modules = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        res = subprocess.run(
+            command,
+            cwd=directory,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+        )
+        best = min(best, time.perf_counter() - start)
+        assert res.returncode == 0, res.stderr
+        modules = parse_importtime(res.stderr)
+    uza = [name for name in modules if name.split(".")[0] in ("uzac", "vm")]
+    return {
+        "wall_time": best,
+        "import_time": sum(self_us for self_us, _ in modules.values()) / 1e6,
+        "uza_import_time": sum(modules[name][0] for name in uza) / 1e6,
+        "modules": len(modules),
+        "parser": "uzac.parser" in modules,
+        "typer": "uzac.typer" in modules,
+        "vm": "vm.main" in modules,
+        "slowest": sorted(modules, key=lambda name: -modules[name][0]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="slowest imports shown")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        Path(directory, "prog.uza").write_text(SOURCE, encoding="ascii")
+        subprocess.run(
+            [sys.executable, "-m", "uzac", "-c", "prog.uzb", "prog.uza"],
+            cwd=directory,
+            env=dict(os.environ, PYTHONPATH=str(ROOT)),
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            check=True,
+        )
+        for mode, mode_args in MODES.items():
+            results[mode] = measure(mode_args, directory, args.runs)
+
+    if args.json:
+        for result in results.values():
+            result["slowest"] = result["slowest"][: args.top]
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'mode':<11} {'wall (ms)':>10} {'imports (ms)':>13} {'uza (ms)':>9}"
+        f" {'modules':>8}  parser typer vm"
+    )
+    for mode, result in results.items():
+        imported = "  ".join(
+            f"{'yes' if result[name] else 'no':>5}"
+            for name in ("parser", "typer", "vm")
+        )
+        print(
+            f"{mode:<11} {result['wall_time'] * 1e3:>10.1f}"
+            f" {result['import_time'] * 1e3:>13.1f}"
+            f" {result['uza_import_time'] * 1e3:>9.1f} {result['modules']:>8} "
+            f"{imported}"
+        )
+        if args.top:
+            print(f"{'':<11} slowest: {', '.join(result['slowest'][: args.top])}")
+
+
+if __name__ == "__main__":
+    main()
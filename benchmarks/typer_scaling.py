@@ -0,0 +1,57 @@
+"""
+Typechecking time for generated programs of increasing size.
+
+Usage: python benchmarks/typer_scaling.py [sizes...]
+
+Each size is the number of generated expressions, the time per expression
+should stay roughly constant if typechecking scales linearly.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from uzac.parser import Parser
+from uzac.typer import Typer
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+
+def generate_program(expressions: int) -> str:
+    """
+    Returns a program with about _expressions_ inferred expressions, split in
+    blocks so that scopes stay small.
+    """
+    lines = ["var acc = 0", "var facc = 0.0"]
+    for i in range(expressions // 4):
+        lines.append("{")
+        lines.append(f"const a = {i} + acc")
+        lines.append("const b = a * 2.5 + facc")
+        lines.append("acc = acc + a % 7")
+        lines.append("facc = facc + b")
+        lines.append("}")
+    lines.append("println(facc + acc)")
+    return "\n".join(lines)
+
+
+def main(sizes) -> None:
+    print(f"{'expressions':>12} {'parse (s)':>10} {'typecheck (s)':>14} {'us/expr':>8}")
+    for size in sizes:
+        source = generate_program(size)
+        start = time.perf_counter()
+        program = Parser(source).parse()
+        parsed = time.perf_counter()
+        diagnostic = Typer(program).typecheck_program()
+        typed = time.perf_counter()
+        assert diagnostic.error_count == 0, diagnostic.errors
+        typecheck = typed - parsed
+        print(
+            f"{size:>12} {parsed - start:>10.3f} {typecheck:>14.3f}"
+            f" {typecheck / size * 1e6:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
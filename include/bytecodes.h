@@ -1,46 +1,94 @@
 #if !defined(uza_bytecodes_h)
 #define uza_bytecodes_h
 
+// X-macro list of all the opcodes, the order must match uzac/bytecode.py. Used
+// to build the OpCode enum and the interpreter dispatch table.
+#define FOR_EACH_OPCODE(X)                                                     \
+  X(OP_RETURN)                                                                 \
+  X(OP_CALL)                                                                   \
+  X(OP_CALL_NATIVE)                                                            \
+  X(OP_CALL_DIRECT)                                                            \
+  X(OP_TAIL_CALL_DIRECT)                                                       \
+  X(OP_JUMP)                                                                   \
+  X(OP_LOOP)                                                                   \
+  X(OP_POP)                                                                    \
+  X(OP_LFUNC)                                                                  \
+  X(OP_LNIL)                                                                   \
+  X(OP_LCONST)                                                                 \
+  X(OP_DCONST)                                                                 \
+  X(OP_STRCONST)                                                               \
+  X(OP_BOOLTRUE)                                                               \
+  X(OP_BOOLFALSE)                                                              \
+  X(OP_JUMP_IF_FALSE)                                                          \
+  X(OP_JUMP_IF_TRUE)                                                           \
+  X(OP_ADD)                                                                    \
+  X(OP_SUB)                                                                    \
+  X(OP_MUL)                                                                    \
+  X(OP_DIV)                                                                    \
+  X(OP_MOD)                                                                    \
+  X(OP_NEG)                                                                    \
+  X(OP_EQ)                                                                     \
+  X(OP_NE)                                                                     \
+  X(OP_LT)                                                                     \
+  X(OP_LE)                                                                     \
+  X(OP_GT)                                                                     \
+  X(OP_GE)                                                                     \
+  X(OP_NOT)                                                                    \
+  X(OP_TOFLOAT)                                                                \
+  X(OP_TOSTRING)                                                               \
+  X(OP_TOINT)                                                                  \
+  X(OP_IADD)                                                                   \
+  X(OP_ISUB)                                                                   \
+  X(OP_IMUL)                                                                   \
+  X(OP_IDIV)                                                                   \
+  X(OP_INEG)                                                                   \
+  X(OP_FADD)                                                                   \
+  X(OP_FSUB)                                                                   \
+  X(OP_FMUL)                                                                   \
+  X(OP_FDIV)                                                                   \
+  X(OP_FNEG)                                                                   \
+  X(OP_STRCONCAT)                                                              \
+  X(OP_IEQ)                                                                    \
+  X(OP_INE)                                                                    \
+  X(OP_ILT)                                                                    \
+  X(OP_ILE)                                                                    \
+  X(OP_IGT)                                                                    \
+  X(OP_IGE)                                                                    \
+  X(OP_FEQ)                                                                    \
+  X(OP_FNE)                                                                    \
+  X(OP_FLT)                                                                    \
+  X(OP_FLE)                                                                    \
+  X(OP_FGT)                                                                    \
+  X(OP_FGE)                                                                    \
+  X(OP_ITOF)                                                                   \
+  X(OP_FTOI)                                                                   \
+  X(OP_DEFGLOBAL)                                                              \
+  X(OP_GETGLOBAL)                                                              \
+  X(OP_SETGLOBAL)                                                              \
+  X(OP_DEFLOCAL)                                                               \
+  X(OP_GETLOCAL)                                                               \
+  X(OP_SETLOCAL)                                                               \
+  X(OP_IADD_LOCALS)                                                            \
+  X(OP_ISUB_LOCALS)                                                            \
+  X(OP_IMUL_LOCALS)                                                            \
+  X(OP_FADD_LOCALS)                                                            \
+  X(OP_FSUB_LOCALS)                                                            \
+  X(OP_FMUL_LOCALS)                                                            \
+  X(OP_JUMP_UNLESS_IEQ)                                                        \
+  X(OP_JUMP_UNLESS_INE)                                                        \
+  X(OP_JUMP_UNLESS_ILT)                                                        \
+  X(OP_JUMP_UNLESS_ILE)                                                        \
+  X(OP_JUMP_UNLESS_IGT)                                                        \
+  X(OP_JUMP_UNLESS_IGE)                                                        \
+  X(OP_INCLOCAL)                                                               \
+  X(OP_EXITVM)                                                                 \
+  X(OP_WIDE)                                                                   \
+
 typedef enum {
-  OP_RETURN,
-  OP_CALL,
-  OP_CALL_NATIVE,
-  OP_JUMP,
-  OP_LOOP,
-  OP_POP,
-  OP_LFUNC,
-  OP_LNIL,
-  OP_LCONST,
-  OP_DCONST,
-  OP_STRCONST,
-  OP_BOOLTRUE,
-  OP_BOOLFALSE,
-  OP_JUMP_IF_FALSE,
-  OP_JUMP_IF_TRUE,
-  OP_ADD,
-  OP_SUB,
-  OP_MUL,
-  OP_DIV,
-  OP_MOD,
-  OP_NEG,
-  OP_EQ,
-  OP_NE,
-  OP_LT,
-  OP_LE,
-  OP_GT,
-  OP_GE,
-  OP_NOT,
-  OP_TOFLOAT,
-  OP_TOSTRING,
-  OP_TOINT,
-  OP_DEFGLOBAL,
-  OP_GETGLOBAL,
-  OP_SETGLOBAL,
-  OP_DEFLOCAL,
-  OP_GETLOCAL,
-  OP_SETLOCAL,
-  OP_EXITVM,
-  OP_OPCODES_COUNT
+#define OPCODE_ENUM(op) op,
+  FOR_EACH_OPCODE(OPCODE_ENUM)
+#undef OPCODE_ENUM
+      OP_OPCODES_COUNT
 } OpCode;
 
 #endif // uza_bytecodes_h
@@ -7,13 +7,20 @@
 #include "value.h"
 
 typedef struct {
+  size_t index; // position in the program, the global scope is 0
   size_t count;
   size_t local_count;
   ValueArray constants;
   uint16_t *lines;
   uint8_t *code;
+  // ValueType of each parameter of a function, CHUNK_PARAM_NOT_HOST if the
+  // host cannot pass it
+  uint8_t param_count;
+  uint8_t *param_types;
 } Chunk;
 
+#define CHUNK_PARAM_NOT_HOST (0xFF)
+
 #define GET_LINE_AT(chunk_ptr, offset) (chunk_ptr->lines[offset])
 #define GET_CODE_AT(chunk_ptr, offset) (chunk_ptr->code[offset])
 #define GET_CODE_AT_CAST(type, chunk_ptr, offset)                              \
@@ -25,9 +32,10 @@ typedef struct {
     if (chunk->count + sizeof(type) > chunk->capacity) {                       \
       capacity_new = GROW_CAPACITY(chunk->capacity);                           \
       uint8_t *code_new =                                                      \
-          GROW_ARRAY(uint8_t, chunk->code, chunk->capacity, capacity_new);     \
+          GROW_ARRAY(vm, uint8_t, chunk->code, chunk->capacity, capacity_new); \
       uint16_t *lines_new =                                                    \
-          GROW_ARRAY(uint16_t, chunk->lines, chunk->capacity, capacity_new);   \
+          GROW_ARRAY(vm, uint16_t, chunk->lines, chunk->capacity,              \
+                     capacity_new);                                            \
       chunk->code = code_new;                                                  \
       chunk->lines = lines_new;                                                \
       chunk->capacity = capacity_new;                                          \
@@ -38,7 +46,7 @@ typedef struct {
   }
 
 void chunk_init(Chunk *chunk);
-void chunk_free(Chunk *chunk);
-int chunk_const_add(Chunk *chunk, Value constant);
+void chunk_free(VM *vm, Chunk *chunk);
+int chunk_const_add(VM *vm, Chunk *chunk, Value constant);
 
 #endif // uza_chunk_h
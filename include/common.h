@@ -66,4 +66,6 @@ typedef struct {
   uint8_t *bytes;
 } program_bytes_t;
 
+typedef struct VM VM;
+
 #endif // uza_common_h
@@ -7,28 +7,46 @@
 
 // prefer stack string buffer allocations
 #define STRING_STACK_BUFF_LEN 256
+// concatenations at least this long build a rope instead of copying
+#define STRING_ROPE_MIN_LENGTH 64
 
-#define GC_HEAP_GROW_FACTOR 2
 #define ARRAY_GROWTH_FACTOR 2
 #define MIN_ARRAY_CAP 8
 
-#define ALLOCATE(type, count)                                                  \
-  (type *)reallocate(NULL, 0, sizeof(type) * (count))
+#define ALLOCATE(vm, type, count)                                              \
+  (type *)reallocate(vm, NULL, 0, sizeof(type) * (count))
 
-#define FREE_ARRAY(type, pointer, oldCount)                                    \
-  reallocate(pointer, sizeof(type) * (oldCount), 0)
+#define FREE_ARRAY(vm, type, pointer, oldCount)                                \
+  reallocate(vm, pointer, sizeof(type) * (oldCount), 0)
 
 #define GROW_CAPACITY(capacity)                                                \
   (MAX(capacity * ARRAY_GROWTH_FACTOR, MIN_ARRAY_CAP))
 
-#define GROW_ARRAY(type, ptr, old_count, new_count)                            \
-  (type *)reallocate(ptr, sizeof(type) * (old_count),                          \
+#define GROW_ARRAY(vm, type, ptr, old_count, new_count)                        \
+  (type *)reallocate(vm, ptr, sizeof(type) * (old_count),                      \
                      sizeof(type) * (new_count))
 
-void *reallocate(void *ptr, size_t old_size, size_t new_size);
-void markObject(Obj *object);
-void markValue(Value value);
-void collectGarbage(void);
-void sweep(void);
+void *reallocate(VM *vm, void *ptr, size_t old_size, size_t new_size);
+size_t object_free(VM *vm, Obj *obj);
+void markObject(VM *vm, Obj *object);
+void markValue(VM *vm, Value value);
+void collectGarbage(VM *vm);
+void collectYoung(VM *vm);
+void sweep(VM *vm);
+
+void gc_nursery_reserve(VM *vm, size_t size);
+void gc_nursery_link(VM *vm, Obj *object);
+void gc_promote_nursery(VM *vm);
+void gc_remember(VM *vm, Obj *object);
+
+// Write barrier, called after _value_ is stored in _owner_. Minor collections
+// do not trace old objects, an old object that now references a young one is
+// added to the remembered set to be traced as a root.
+static inline void gc_write_barrier(VM *vm, Obj *owner, Value value) {
+  if (owner->is_old && !owner->is_remembered && IS_OBJECT(value) &&
+      !AS_OBJECT(value)->is_old) {
+    gc_remember(vm, owner);
+  }
+}
 
 #endif // uza_memory_h
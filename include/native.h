@@ -16,7 +16,7 @@
 
 #define TABLE_ENTRY(key_string, native_function)
 
-typedef void (*native_function)(void);
+typedef void (*native_function)(VM *vm);
 
 typedef struct {
   const char *const name;
@@ -29,5 +29,7 @@ typedef struct {
   {name, sizeof(name) - 1, (native_function)func_name, arity}
 
 const NativeFunction *const native_functions_get(size_t *out_count);
+// monotonic clock, in nanoseconds
+uint64_t native_clock_ns(void);
 
 #endif
@@ -17,6 +17,8 @@ typedef enum {
 struct Obj {
   ObjectType type;
   bool is_marked;
+  bool is_old;        // promoted out of the nursery
+  bool is_remembered; // old object in the remembered set
   struct Obj *next;
 };
 
@@ -30,12 +32,20 @@ typedef struct {
   ObjectString *name;
 } ObjectFunction;
 
+// Strings from the program are interned, equal strings are the same object.
+// Strings built at runtime by concatenations and conversions are transient:
+// they are not hashed nor interned, and long concatenations are ropes whose
+// characters are only copied once they are read, see object_string_chars.
 struct ObjectString {
   struct Obj obj;
   int length;
   uint32_t hash;
+  bool is_interned;
   ObjectFunction *cached_function; // cache native functions once resolved
-  char chars[];
+  struct ObjectString *left;       // rope children, NULL once flat
+  struct ObjectString *right;
+  char *chars; // NULL for a rope until flattened, data for flat strings
+  char data[];
 };
 
 typedef struct {
@@ -49,17 +59,22 @@ typedef struct {
 #define IS_STRING(value) (IS_OBJECT(value) && (OBJ_TYPE(value) == OBJ_STRING))
 #define IS_LIST(value) (IS_OBJECT(value) && (OBJ_TYPE(value) == OBJ_LIST))
 
-ObjectString *object_string_allocate(Table *strings, const char *chars,
+ObjectString *object_string_allocate(VM *vm, const char *chars,
                                      const int string_length);
+ObjectString *object_string_transient(VM *vm, const char *chars,
+                                      const int string_length);
 void object_string_hash(struct ObjectString *string);
-void object_string_free(struct ObjectString *obj_string);
-struct ObjectString *object_string_concat(Table *strings,
-                                          const struct ObjectString *lhs,
-                                          const struct ObjectString *rhs);
+size_t object_string_free(VM *vm, struct ObjectString *obj_string);
+struct ObjectString *object_string_concat(VM *vm, struct ObjectString *lhs,
+                                          struct ObjectString *rhs);
+const char *object_string_chars(VM *vm, struct ObjectString *string);
+bool object_string_equal(VM *vm, struct ObjectString *lhs,
+                         struct ObjectString *rhs);
 
-ObjectFunction *object_function_allocate(void);
+ObjectFunction *object_function_allocate(VM *vm);
+size_t object_function_free(VM *vm, ObjectFunction *function);
 
-ObjectList *object_list_allocate(void);
-void object_list_free(ObjectList *list);
+ObjectList *object_list_allocate(VM *vm);
+size_t object_list_free(VM *vm, ObjectList *list);
 
 #endif // uza_object_h
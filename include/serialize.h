@@ -16,43 +16,74 @@ TODO:  MAGIC number :)
 3B : 3 version numbers
 4B : chunk count
 
+### STRINGS ###
+4B : number_of_strings, shared by all the chunks
+
+for each STRING
+    8B         : string length
+    (str_len)B : String chars (not null terminated)
+
+### GLOBALS ###
+4B : number_of_global_slots
+
+for each GLOBAL
+    4B : index of the variable name in the program STRINGS
+
 for each CHUNK
     ### CONSTANTS ###
-    1B  : number_of_constants
+    2B  : number_of_constants
 
     for each CONSTANT
         1B: ValueType
         case OBJECT:
-            1B           : ObjectType
-            8B           : string length
-            (str_len)B : String chars (not null terminated)
+            1B : ObjectType
+            4B : index of the string in the program STRINGS
 
         case INT    : 8B
         case DOUBLE : 8B
 
-    1B  : number_of_locals
+    2B  : number_of_locals
 
     ### OPCODES ###
-    2B : bytecode count (number of ops)
-    2B : bytecode length (number of bytes for the code)
+    4B : bytecode count (number of ops)
+    4B : bytecode length (number of bytes for the code)
+    1B : param_count (number of parameters)
+    for each parameter
+        1B : ValueType of the parameter, 0xFF if not passable from the host
 
     for each opcode
+        (1B) : OP_WIDE prefix if an operand does not fit the narrow encoding
         1B   : OpCode
-        (1B) : constant if needed
-        (1B) : local variable index
+        (1B) : constant if needed, 2B if wide
+        (1B) : local variable or global slot index, 2B if wide
+        (1B) : second local index of the *_LOCALS superinstructions, 2B if wide
+        (2B) : jump offset, 4B if wide
+
+        the superinstructions encode their operands in this order: local,
+        second local, constant, jump offset. JUMP_UNLESS_* carry a local, a
+        constant and a jump offset, INCLOCAL a local and a constant.
 
     for i in range( _bytecode count_ ):
         2B   : line number
 
 */
 
+// Interned strings of the program, only used while loading the chunks.
+typedef struct {
+  uint32_t count;
+  ObjectString **strings;
+} StringTable;
+
 // void load_program(FILE* file, VM *vm);
-void load_chunk(size_t chunk_idx, program_bytes_t *program);
-void load_constants(ValueArray *array, program_bytes_t *program,
-                    Table *strings);
-void load_op(size_t chunk_idx, uint16_t line, program_bytes_t *program);
+StringTable load_strings(VM *vm, program_bytes_t *program);
+void load_globals(VM *vm, program_bytes_t *program, StringTable *string_table);
+void load_chunk(VM *vm, size_t chunk_idx, program_bytes_t *program,
+                StringTable *string_table);
+void load_constants(VM *vm, ValueArray *array, program_bytes_t *program,
+                    StringTable *string_table);
+void load_op(VM *vm, size_t chunk_idx, uint16_t line, program_bytes_t *program);
 
 void read_program_version(uint8_t *buff, program_bytes_t *program);
-void read_program(program_bytes_t *program);
+void read_program(VM *vm, program_bytes_t *program);
 
 #endif // uza_serialize_h
@@ -43,19 +43,19 @@ typedef struct {
 //> init-table-h
 void initTable(Table *table);
 //> free-table-h
-void freeTable(Table *table);
+void freeTable(VM *vm, Table *table);
 //< free-table-h
 //> table-get-h
 bool tableGet(Table *table, ObjectString *key, Value *value);
 //< table-get-h
 //> table-set-h
-bool tableSet(Table *table, ObjectString *key, Value value);
+bool tableSet(VM *vm, Table *table, ObjectString *key, Value value);
 //< table-set-h
 //> table-delete-h
 bool tableDelete(Table *table, ObjectString *key);
 //< table-delete-h
 //> table-add-all-h
-void tableAddAll(Table *from, Table *to);
+void tableAddAll(VM *vm, Table *from, Table *to);
 //< table-add-all-h
 //> table-find-string-h
 ObjectString *tableFindString(Table *table, const char *chars, int length,
@@ -66,7 +66,7 @@ ObjectString *tableFindString(Table *table, const char *chars, int length,
 void tableRemoveWhite(Table *table);
 //< Garbage Collection table-remove-white-h
 //> Garbage Collection mark-table-h
-void markTable(Table *table);
+void markTable(VM *vm, Table *table);
 //< Garbage Collection mark-table-h
 
 //< init-table-h
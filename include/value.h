@@ -16,6 +16,81 @@ typedef enum {
   TYPE_OBJ,
 } ValueType;
 
+#ifdef UZA_NAN_BOXING
+// NaN-boxed values: a Value is the 8 bytes of a double. Every other type lives
+// in the payload of a quiet NaN, which no arithmetic produces once NaN results
+// are canonicalized by VAL_FLOAT.
+//
+//   double : any bit pattern without all the QNAN bits set
+//   nil    : QNAN | 1, false : QNAN | 2, true : QNAN | 3
+//   int    : QNAN | TAG_INT | 48 bit two's complement payload
+//   object : SIGN_BIT | QNAN | 48 bit pointer
+//
+// Integers are truncated to 48 bits, arithmetic outside of
+// [-2^47, 2^47 - 1] wraps around.
+#include <string.h>
+
+typedef uint64_t Value;
+
+#define SIGN_BIT ((uint64_t)0x8000000000000000)
+#define QNAN ((uint64_t)0x7ffc000000000000)
+#define TAG_INT ((uint64_t)0x0001000000000000)
+#define TAG_MASK ((uint64_t)0xffff000000000000)
+#define PAYLOAD_MASK ((uint64_t)0x0000ffffffffffff)
+#define CANONICAL_NAN ((uint64_t)0x7ff8000000000000)
+
+#define TAG_NIL 1
+#define TAG_FALSE 2
+#define TAG_TRUE 3
+
+static inline Value value_from_double(double fp) {
+  Value value;
+  if (fp != fp) {
+    return CANONICAL_NAN;
+  }
+  memcpy(&value, &fp, sizeof(double));
+  return value;
+}
+
+static inline double value_to_double(Value value) {
+  double fp;
+  memcpy(&fp, &value, sizeof(double));
+  return fp;
+}
+
+#define VAL_NIL ((Value)(QNAN | TAG_NIL))
+#define VAL_INT(i) ((Value)(QNAN | TAG_INT | ((uint64_t)(i) & PAYLOAD_MASK)))
+#define VAL_FLOAT(f) value_from_double(f)
+#define VAL_BOOL(val) ((Value)(QNAN | ((val) ? TAG_TRUE : TAG_FALSE)))
+#define VAL_OBJ(obj) ((Value)(SIGN_BIT | QNAN | (uint64_t)(uintptr_t)(obj)))
+
+#define IS_INTEGER(value) (((value) & TAG_MASK) == (QNAN | TAG_INT))
+#define IS_DOUBLE(value) (((value) & QNAN) != QNAN)
+#define IS_BOOL(value) (((value) | 1) == (QNAN | TAG_TRUE))
+#define IS_OBJECT(value) (((value) & (QNAN | SIGN_BIT)) == (QNAN | SIGN_BIT))
+#define IS_NIL(value) ((value) == VAL_NIL)
+
+// sign extends the 48 bit payload
+#define AS_INTEGER(value) (((int64_t)((value) << 16)) >> 16)
+#define AS_DOUBLE(value) value_to_double(value)
+#define AS_BOOL(value) ((value) == (QNAN | TAG_TRUE))
+#define AS_OBJECT(value) ((Obj *)(uintptr_t)((value) & ~(SIGN_BIT | QNAN)))
+
+static inline ValueType value_type(Value value) {
+  if (IS_DOUBLE(value))
+    return TYPE_DOUBLE;
+  if (IS_OBJECT(value))
+    return TYPE_OBJ;
+  if (IS_INTEGER(value))
+    return TYPE_LONG;
+  if (IS_NIL(value))
+    return TYPE_NIL;
+  return TYPE_BOOL;
+}
+
+#define VALUE_TYPE(value) value_type(value)
+
+#else
 typedef struct {
   ValueType type;
   union {
@@ -40,45 +115,48 @@ typedef struct {
 
 #define AS_INTEGER(value) ((value).as.integer)
 #define AS_DOUBLE(value) ((value).as.fp)
+#define AS_BOOL(value) ((value).as.boolean)
 #define AS_OBJECT(value) ((Obj *)(value).as.object)
+
+#define VALUE_TYPE(value) ((value).type)
+#endif // UZA_NAN_BOXING
+
 #define AS_STRING(value) ((ObjectString *)AS_OBJECT(value))
 #define AS_FUNCTION(value) ((ObjectFunction *)AS_OBJECT(value))
 #define AS_LIST(value) ((ObjectList *)AS_OBJECT(value))
 
-#define I2D(value)                                                             \
-  do {                                                                         \
-    (value).type = TYPE_DOUBLE;                                                \
-    (value).as.fp = (double)(value).as.integer;                                \
-  } while (false);
+// Numeric value as a double, for mixed int and float operands
+#define AS_NUMBER(value)                                                       \
+  (IS_INTEGER(value) ? (double)AS_INTEGER(value) : AS_DOUBLE(value))
 
 // TODO: change back to DEBUG_PRINT when able to
-#define PRINT_VALUE(value, out)                                                \
+#define PRINT_VALUE(vm, value, out)                                            \
   do {                                                                         \
-    switch ((value).type) {                                                    \
+    switch (VALUE_TYPE(value)) {                                               \
     case TYPE_NIL:                                                             \
       fprintf((out), "nil");                                                   \
       break;                                                                   \
     case TYPE_LONG:                                                            \
-      fprintf((out), "%lld", (value).as.integer);                              \
+      fprintf((out), "%lld", (long long)AS_INTEGER(value));                    \
       break;                                                                   \
     case TYPE_DOUBLE:                                                          \
-      fprintf((out), "%.3lf", (value).as.fp);                                  \
+      fprintf((out), "%.3lf", AS_DOUBLE(value));                               \
       break;                                                                   \
     case TYPE_BOOL: {                                                          \
-      if ((value).as.boolean)                                                  \
+      if (AS_BOOL(value))                                                      \
         fprintf((out), "true");                                                \
       else                                                                     \
         fprintf((out), "false");                                               \
     } break;                                                                   \
     case TYPE_OBJ:                                                             \
       if (AS_OBJECT(value)->type == OBJ_STRING) {                              \
-        fprintf((out), "%s", (AS_STRING((value)))->chars);                     \
+        fprintf((out), "%s", object_string_chars(vm, AS_STRING((value))));     \
       } else if (AS_OBJECT(value)->type == OBJ_FUNCTION) {                     \
         fprintf((out), "func[%s]", AS_FUNCTION(value)->name->chars);           \
       } else if (AS_OBJECT(value)->type == OBJ_FUNCTION_NATIVE) {              \
         fprintf((out), "func[%s]", AS_FUNCTION(value)->name->chars);           \
       } else if (IS_LIST(value)) {                                             \
-        value_array_print(&AS_LIST(value)->list, (out));                       \
+        value_array_print(vm, &AS_LIST(value)->list, (out));                   \
       } else {                                                                 \
         fprintf(stderr, "Could not print object of type %d\n",                 \
                 (AS_OBJECT(value)->type));                                     \
@@ -96,9 +174,10 @@ typedef struct {
   Value *values;
 } ValueArray;
 
-void value_array_print(ValueArray *array, FILE *out);
+bool values_equal(VM *vm, Value a, Value b);
+void value_array_print(VM *vm, ValueArray *array, FILE *out);
 void value_array_init(ValueArray *array);
-void value_array_write(ValueArray *array, Value value);
-void value_array_free(ValueArray *array);
+void value_array_write(VM *vm, ValueArray *array, Value value);
+void value_array_free(VM *vm, ValueArray *array);
 
 #endif // uza_value_h
@@ -9,13 +9,24 @@
 #include <stdio.h>
 
 #define STACK_MAX ((1 << 20) / sizeof(Value)) // 1MiB
-#define FRAMES_MAX (100)
+// Value stack slots left for the temporaries of a frame when it is pushed, so
+// that deep recursion fails on the call rather than on an arbitrary push
+#define FRAME_STACK_RESERVE (256)
+// Call depth limit when run_vm is not given one, the frame stack starts with
+// FRAMES_INITIAL_CAPACITY frames and doubles up to the limit.
+#define FRAMES_DEFAULT_MAX (10000)
+#define FRAMES_INITIAL_CAPACITY (64)
 
-#define GC_DEFAULT_THRESHOLD (1024 * 1024);
+// heap size of the first full collection, and growth of the heap threshold
+// relative to the bytes left live by a full collection
+#define GC_DEFAULT_INITIAL_HEAP (1024 * 1024)
+#define GC_DEFAULT_GROWTH_FACTOR (2.0)
+// bytes allocated in the nursery before a minor collection
+#define GC_NURSERY_SIZE (256 * 1024)
 
 #define CHECK_STACK_OVERFLOW                                                   \
   do {                                                                         \
-    if (vm.stack_top >= &vm.stack[STACK_MAX]) {                                \
+    if (vm->stack_top >= &vm->stack[STACK_MAX]) {                              \
       PRINT_ERR("Stack overflow!\nexiting...\n");                              \
       exit(1);                                                                 \
     }                                                                          \
@@ -28,37 +39,116 @@ typedef struct {
   uint8_t *ip;
 } Frame;
 
+// Collection counts and pause times, in nanoseconds, of a run
 typedef struct {
+  uint64_t minor_collections;
+  uint64_t major_collections;
+  uint64_t minor_pause_ns; // total pause of the minor collections
+  uint64_t major_pause_ns; // total pause of the major collections
+  uint64_t total_pause_ns;
+  uint64_t max_pause_ns;
+  uint64_t objects_promoted;
+  uint64_t objects_freed;
+  uint64_t bytes_freed;
+  uint64_t live_bytes; // allocated bytes after the last collection
+} GCStats;
+
+// Settings of a VM run, zero fields take the defaults
+typedef struct {
+  uint32_t max_frames;
+  size_t gc_initial_heap;
+  double gc_growth_factor;
+} VMOptions;
+
+// Frame stacks sampled every _interval_ instructions by a profiled run. Each
+// sample is its depth followed by the chunk index and the code offset of the
+// running instruction of each frame, from the global frame to the innermost.
+typedef struct {
+  uint32_t interval;
+  uint32_t countdown; // instructions left before the next sample
+  uint32_t *samples;
+  size_t count;
+  size_t capacity;
+} Profile;
+
+// Instructions executed by a counted run, a wide instruction counts as its
+// opcode. A pair is two instructions executed one after the other, including
+// across calls and jumps.
+typedef struct {
+  uint64_t ops[256];
+  uint64_t pairs[256][256];
+  uint64_t *chunks; // instructions executed in each chunk, by chunk index
+  size_t chunk_count;
+  uint8_t previous; // opcode of the last counted instruction
+  bool started;
+} OpStats;
+
+// Argument or result of a call from the host, see vm_call. Strings have the
+// TYPE_OBJ type, lists and functions cannot be passed.
+typedef struct {
+  ValueType type;
+  int64_t integer;
+  double fp;
+  bool boolean;
+  const char *chars;
+  int length;
+} HostValue;
+
+// vm_call status when the function does not exist or the argument or result
+// types are not supported
+#define VM_CALL_INVALID (2)
+
+// vm_call status when an argument does not have the type of its parameter
+#define VM_CALL_TYPE_MISMATCH (3)
+
+// All the state of a running program, VMs share nothing and can run on
+// different threads.
+struct VM {
   // uint8_t version[3];
-  Obj *objects;
+  Obj *objects;       // old generation
+  Obj *young_objects; // nursery, allocated since the last collection
   Chunk **chunks;
   size_t chunk_count;
+  ObjectFunction **functions; // by chunk index, set by OP_LFUNC
   Value stack[STACK_MAX];
   Value *stack_top;
-  uint16_t depth;
-  Frame frame_stacks[FRAMES_MAX];
+  uint32_t depth;
+  Frame *frame_stacks;
+  uint32_t frame_capacity;
+  uint32_t max_frames; // call depth limit, including the global frame
   Table strings;
-  Table globals;
+  Table globals;                // functions, by name
+  Value *global_slots;          // global variables, indexed by slot
+  ObjectString **global_names;  // name of each slot, for diagnostics only
+  uint32_t global_count;
 
   int gray_count;
   int gray_capacity;
   Obj **gray_stack;
+  Obj **remembered; // old objects written a young reference
+  int remembered_count;
+  int remembered_capacity;
   size_t bytesAllocated;
   size_t nextGC;  // allocated bytes threshold for GC to collect
+  size_t gc_initial_heap;
+  double gc_growth_factor;
+  size_t young_bytes; // allocated in the nursery since the last collection
   bool enable_GC; // whether GC should run or not
-} VM;
+  bool gc_minor;  // a minor collection is running
+  GCStats gc_stats;
+  Profile *profile;  // NULL unless profiling
+  OpStats *op_stats; // NULL unless counting the executed instructions
+};
 
-#define PEEK(vm) (*(vm.stack_top - 1))
-#define PEEK_AT(spot) (*(vm.stack_top - 1 - spot))
-#define POP_COUNT(n)                                                           \
+#define PEEK(vm) (*((vm)->stack_top - 1))
+#define PEEK_AT(vm, spot) (*((vm)->stack_top - 1 - spot))
+#define POP_COUNT(vm, n)                                                       \
   do {                                                                         \
     for (size_t i = 0; i < n; i++) {                                           \
-      pop();                                                                   \
+      pop(vm);                                                                 \
     }                                                                          \
   } while (0);
 
-extern VM vm;
-
 static inline
 #if defined(MSVC)
     __forceinline
@@ -66,8 +156,8 @@ static inline
     __attribute__((always_inline))
 #endif
     void
-    push(Value value) {
-  *vm.stack_top++ = value;
+    push(VM *vm, Value value) {
+  *vm->stack_top++ = value;
   CHECK_STACK_OVERFLOW;
 #ifdef DEBUG_TRACE_EXECUTION_STACK
   DEBUG_PRINT("stack push\n");
@@ -81,8 +171,8 @@ static inline
     __attribute__((always_inline))
 #endif
     void
-    stack_top_set(Value *new_stack_top) {
-  vm.stack_top = new_stack_top;
+    stack_top_set(VM *vm, Value *new_stack_top) {
+  vm->stack_top = new_stack_top;
   CHECK_STACK_OVERFLOW;
 #ifdef DEBUG_TRACE_EXECUTION_STACK
   DEBUG_PRINT("stack push\n");
@@ -96,18 +186,20 @@ static inline
     __attribute__((always_inline))
 #endif
     Value
-    pop(void) {
-  vm.stack_top--;
+    pop(VM *vm) {
+  vm->stack_top--;
 #ifdef DEBUG_TRACE_EXECUTION_STACK
   DEBUG_PRINT("stack pop\n");
 #endif // #define DEBUG_TRACE_EXECUTION_STACK
-  return *vm.stack_top;
+  return *vm->stack_top;
 }
 
-void vm_init(program_bytes_t *program);
-void vm_stack_reset(void);
-void vm_free(void);
+VM *vm_new(program_bytes_t *program, const VMOptions *options);
+void vm_stack_reset(VM *vm);
+void vm_free(VM *vm);
 
-int interpret(void);
+int interpret(VM *vm);
+int vm_call(VM *vm, const char *name, int arg_count, const HostValue *args,
+            HostValue *result);
 
 #endif // uza_vm_h
@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def uza_cache_dir(tmp_path, monkeypatch):
+    """
+    Keeps the bytecode cached by the CLI runs of a test in its temporary
+    directory instead of the user cache directory.
+    """
+    monkeypatch.setenv("UZA_CACHE_DIR", str(tmp_path / "uza-cache"))
@@ -0,0 +1,213 @@
+from uzac import __version_tuple__
+from uzac.bytecode import (
+    OPCODE,
+    ByteCodeProgram,
+    ByteCodeProgramSerializer,
+    Chunk,
+    Op,
+)
+from uzac.parser import Parser
+from uzac.typer import Typer
+from uzac.utils import Span
+
+
+def compile_opcodes(source: str, typecheck=True) -> list[OPCODE]:
+    program = Parser(source).parse()
+    if typecheck:
+        assert not Typer(program).typecheck_program().error_count
+    return [op.code for chunk in ByteCodeProgram(program).chunks for op in chunk.code]
+
+
+def test_typed_int_opcodes():
+    source = """
+    func fib(n : int) => int {
+        if n <= 1 then return n
+        return fib(n-1) + fib(n-2)
+    }
+    """
+    codes = compile_opcodes(source)
+    assert OPCODE.ILE in codes
+    assert OPCODE.ISUB in codes
+    assert OPCODE.IADD in codes
+    assert OPCODE.ADD not in codes
+    assert OPCODE.LE not in codes
+
+
+def test_mixed_int_float_converts_int_operand():
+    codes = compile_opcodes("const a = 1 + 2.5\nconst b = 2.5 < 3")
+    assert codes.count(OPCODE.ITOF) == 2
+    assert OPCODE.FADD in codes
+    assert OPCODE.FLT in codes
+    assert codes.index(OPCODE.ITOF) < codes.index(OPCODE.FADD)
+
+
+def test_string_concat_and_conversions():
+    source = """
+    const f = 1.5
+    const s = "a" + f.toString()
+    const i = f.toInt()
+    const g = i.toFloat()
+    const h = g.toFloat()
+    """
+    codes = compile_opcodes(source)
+    assert OPCODE.STRCONCAT in codes
+    assert OPCODE.FTOI in codes
+    assert OPCODE.ITOF in codes
+    assert OPCODE.TOFLOAT not in codes
+
+
+def test_generic_opcodes_without_typechecking():
+    codes = compile_opcodes("const a = 1 + 2", typecheck=False)
+    assert OPCODE.ADD in codes
+    assert OPCODE.IADD not in codes
+
+
+def test_serialize_large_source():
+    lines = ["var acc = 0"]
+    lines += [f"acc = acc + {i % 100} // {'padding' * 4}" for i in range(3000)]
+    source = "\n".join(lines)
+    assert len(source) > 0xFFFF
+    program = Parser(source).parse()
+    assert not program.errors
+    serializer = ByteCodeProgramSerializer(ByteCodeProgram(program))
+    code = serializer.get_bytes()
+    assert code.startswith(bytes(__version_tuple__))
+    assert serializer.written == len(code)
+
+
+def compile_ops(source: str):
+    program = Parser(source).parse()
+    assert not Typer(program).typecheck_program().error_count
+    return ByteCodeProgram(program)
+
+
+def test_small_program_has_no_wide_ops():
+    bytecode = compile_ops("var a = 1\nwhile a < 10 do a += 1")
+    assert not any(op.wide for chunk in bytecode.chunks for op in chunk.code)
+
+
+def test_wide_constants_and_locals():
+    lines = ["func f() => int {"]
+    lines += [f"  var v{i} = {i + 1000}" for i in range(300)]
+    lines += ["  return v299", "}", "println(f())"]
+    bytecode = compile_ops("\n".join(lines))
+    func_chunk = bytecode.chunks[1]
+    assert len(func_chunk.constants) > 0xFF
+    wide = [op for op in func_chunk.code if op.wide]
+    assert any(op.code == OPCODE.LCONST for op in wide)
+    assert any(op.code == OPCODE.DEFLOCAL for op in wide)
+    assert all(op.size == 4 for op in wide)
+    code = ByteCodeProgramSerializer(bytecode).get_bytes()
+    assert bytes([OPCODE.WIDE.value, OPCODE.LCONST.value]) in code
+
+
+def test_wide_jumps_are_relaxed():
+    lines = ["var acc = 0", "var i = 0", "while i < 2 {", "  if i == 0 {"]
+    lines += ["    acc = acc + 1"] * 12000
+    lines += ["  }", "  i += 1", "}"]
+    chunk = compile_ops("\n".join(lines)).chunks[0]
+    starts = [0]
+    for op in chunk.code:
+        starts.append(starts[-1] + op.size)
+    jumps = [(idx, op) for idx, op in enumerate(chunk.code) if op.jump_offset]
+    assert {op.code for _, op in jumps if op.wide} >= {
+        OPCODE.JUMP_IF_FALSE,
+        OPCODE.LOOP,
+    }
+    for idx, op in jumps:
+        if op.code == OPCODE.LOOP:
+            target = starts[idx] - op.jump_offset
+        else:
+            target = starts[idx + 1] + op.jump_offset
+        assert target in starts
+
+
+def test_constants_are_deduplicated_by_type():
+    chunk = Chunk("test")
+    span = Span(0, 0, "")
+    constants = [1, 1.0, 1, 0.0, -0.0, 1.0, "1", 0.0]
+    for constant in constants:
+        chunk.add_op(Op(OPCODE.LCONST, span, constant=constant))
+    indices = [op.constant_index for op in chunk.code]
+    assert indices == [0, 1, 0, 2, 3, 1, 4, 2]
+    assert [type(c) for c in chunk.constants] == [int, float, float, float, str]
+
+
+def test_strings_are_shared_between_chunks():
+    source = """
+    var counter = 0
+    func inc() => void { counter = counter + 1 }
+    func dec() => void { counter = counter - 1 }
+    inc()
+    dec()
+    println(counter)
+    """
+    serializer = ByteCodeProgramSerializer(compile_ops(source))
+    assert list(serializer.strings).count("counter") == 1
+    assert serializer.get_bytes().count(b"counter") == 1
+
+
+def test_globals_are_slot_indexed():
+    source = """
+    const N = 10
+    var total = 0
+    for var i = 0; i < N; i += 1 {
+        total = total + N
+    }
+    println(total)
+    """
+    bytecode = compile_ops(source)
+    assert bytecode.globals == {"N": 0, "total": 1}
+    global_ops = [
+        op
+        for op in bytecode.chunks[0].code
+        if op.code in (OPCODE.DEFGLOBAL, OPCODE.GETGLOBAL, OPCODE.SETGLOBAL)
+    ]
+    assert global_ops
+    assert all(op.constant is None for op in global_ops)
+    assert {op.global_index for op in global_ops} == {0, 1}
+    assert "N" not in bytecode.chunks[0].constants
+
+
+def test_user_function_calls_are_direct():
+    source = """
+    func fib(n : int) => int {
+        if n <= 1 then return n
+        return fib(n-1) + fib(n-2)
+    }
+    println(fib(10))
+    """
+    bytecode = compile_ops(source)
+    calls = [
+        op
+        for chunk in bytecode.chunks
+        for op in chunk.code
+        if op.code in (OPCODE.CALL, OPCODE.CALL_DIRECT)
+    ]
+    assert len(calls) == 3
+    assert all(op.code == OPCODE.CALL_DIRECT for op in calls)
+    assert all(bytecode.chunks[op.function_index].name == "fib" for op in calls)
+    assert "fib" not in bytecode.chunks[1].constants
+
+
+def test_returned_calls_are_tail_calls():
+    source = """
+    func sum(n: int, acc: int) => int {
+        if n == 0 then return acc
+        return sum(n - 1, acc + n)
+    }
+    func depth(n: int) => int {
+        if n == 0 then return 0
+        return 1 + depth(n - 1)
+    }
+    println(sum(10, 0))
+    """
+    bytecode = compile_ops(source)
+    sum_chunk, depth_chunk = bytecode.chunks[1], bytecode.chunks[2]
+    sum_codes = [op.code for op in sum_chunk.code]
+    assert sum_codes.count(OPCODE.TAIL_CALL_DIRECT) == 1
+    assert OPCODE.CALL_DIRECT not in sum_codes
+    depth_codes = [op.code for op in depth_chunk.code]
+    assert OPCODE.TAIL_CALL_DIRECT not in depth_codes
+    global_codes = [op.code for op in bytecode.chunks[0].code]
+    assert OPCODE.TAIL_CALL_DIRECT not in global_codes
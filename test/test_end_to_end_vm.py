@@ -1,11 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import io
+import json
+import re
 from pathlib import Path
 import subprocess
 import pytest
 import sys
 import os
 
+from uzac.driver import Driver
+from uzac.bytecode import OPCODE, ByteCodeProgram, ByteCodeProgramSerializer
+from uzac.cache import CompileCache
+from uzac.optimizer import OPTIMIZATION_LEVELS
+from uzac.parser import Parser
+from uzac.peephole import PeepholeOptimizer
+from uzac.profiler import OpStatsReport, ProfileReport
+from uzac.timings import PipelineTimings
+from uzac.typer import Typer
+from vm.main import (
+    VMError,
+    VMHandle,
+    gc_stats,
+    op_stats,
+    profile_stacks,
+    run_vm,
+)
 from .helper import (
     parse_test_file,
     TESTS_PATH,
@@ -17,10 +37,11 @@ from .helper import (
 )
 
 
+@pytest.mark.parametrize("optimization_level", OPTIMIZATION_LEVELS)
 @pytest.mark.parametrize(
     "description, code, expected_output", parse_test_file(TESTS_PATH)
 )
-def test_end_to_end(description, code, expected_output, capfd):
+def test_end_to_end(description, code, expected_output, optimization_level, capfd):
     bytecode_out = os.path.join(PROJECT_ROOT, "out.uzo")
 
     try:
@@ -28,6 +49,7 @@ def test_end_to_end(description, code, expected_output, capfd):
             [
                 "python",
                 os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+                f"-O{optimization_level}",
                 "-s",
                 code,
             ],
@@ -35,7 +57,7 @@ def test_end_to_end(description, code, expected_output, capfd):
         )
     except Exception as e:
         pytest.fail(
-            f"\nTest: {description}\n"
+            f"\nTest: {description} (-O{optimization_level})\n"
             f"{MAGENTA}Runtime Error: {e}{RESET}\n"
             f"With code:\n{code}\n",
             pytrace=False,
@@ -51,8 +73,553 @@ def test_end_to_end(description, code, expected_output, capfd):
         pass
 
     assert actual_output == expected_output, (
-        f"\nTest: {description}\n"
+        f"\nTest: {description} (-O{optimization_level})\n"
         f"With code:\n----------------------------\n{code}\n----------------------------\n"
         f"Expected Output: {expected_output}\n"
         f"Actual Output: {actual_output}\n"
     )
+
+
+def test_wide_operands(capfd):
+    lines = ["var acc = 0"]
+    lines += [f"acc = acc + {i + 1000}" for i in range(300)]
+    lines += ["func f() => int {"]
+    lines += [f"  var v{i} = {i}" for i in range(300)]
+    # wide superinstructions
+    lines += ["  var n = 0", "  while n < 1000 do n += 7"]
+    lines += ["  return v0 + v299 + n", "}", "println(acc + f())"]
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "-s",
+            "\n".join(lines),
+        ],
+        check=True,
+    )
+    expected = sum(i + 1000 for i in range(300)) + 299 + 1001
+    assert remove_new_lines(capfd.readouterr().out) == str(expected)
+
+
+def test_call_depth_limit(capfd):
+    source = """
+    func depth(n: int) => int {
+        if n == 0 then return 0
+        return 1 + depth(n - 1)
+    }
+    println(depth(40))
+    println(depth(60))
+    """
+    res = subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--max-frames",
+            "50",
+            "-s",
+            source,
+        ],
+    )
+    assert res.returncode != 0
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "40"
+    assert "maximum call depth of 50 exceeded" in captured.err
+
+
+def test_tail_calls_reuse_the_frame(capfd):
+    source = """
+    func sum(n: int, acc: int) => int {
+        if n == 0 then return acc
+        return sum(n - 1, acc + n)
+    }
+    println(sum(100000, 0))
+    """
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--max-frames",
+            "2",
+            "-s",
+            source,
+        ],
+        check=True,
+    )
+    assert remove_new_lines(capfd.readouterr().out) == "5000050000"
+
+
+def test_tail_call_into_many_locals_near_the_stack_limit(capfd):
+    local_lines = "\n".join(f"    var a{i} = {i}" for i in range(400))
+    source = f"""
+func many(n: int) => int {{
+{local_lines}
+    return n + a399
+}}
+func down(n: int) => int {{
+    if n == 0 then return many(0)
+    return down(n - 1) + 1
+}}
+"""
+    program = Parser(source).parse()
+    assert not Typer(program).typecheck_program().error_count
+    code = ByteCodeProgramSerializer(ByteCodeProgram(program)).get_bytes()
+    with VMHandle(code, max_frames=1_000_000) as vm:
+        assert vm.call("down", 10) == 409
+        # the deepest recursion whose tail call into many still fits
+        fits, overflows = 0, 1 << 20
+        while overflows - fits > 1:
+            middle = (fits + overflows) // 2
+            try:
+                assert vm.call("down", middle) == middle + 399
+                fits = middle
+            except VMError:
+                overflows = middle
+        capfd.readouterr()
+        # the frames of down still fit, the tail call is the one refused
+        with pytest.raises(VMError):
+            vm.call("down", overflows)
+        err = capfd.readouterr().err
+        assert "value stack exhausted" in err and err.rstrip().endswith("'many'")
+        assert vm.call("down", 10) == 409
+
+
+def test_nursery_survivors_are_promoted(capfd):
+    source = """
+    const keep = List<string>()
+    for var i = 0; i < 100000; i += 1 {
+        const s = "item " + i.toString()
+        if i % 1000 == 0 then keep.append(s)
+    }
+    var last = ""
+    for var i = 0; i < keep.len(); i += 1 {
+        last = keep.get(i)
+    }
+    println(keep.len())
+    println(last)
+    """
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--gc-stats",
+            "-s",
+            source,
+        ],
+        check=True,
+    )
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "100item 99000"
+    minor = next(
+        line for line in captured.err.splitlines() if "minor collections" in line
+    )
+    assert int(minor.split()[2]) > 0
+    assert "objects promoted" in captured.err
+
+
+def test_gc_pacing_follows_the_initial_heap():
+    source = """
+    const keep = List<List<int>>()
+    for var i = 0; i < 20000; i += 1 {
+        const l = List<int>()
+        l.append(i)
+        if i % 100 == 0 then keep.append(l)
+    }
+    """
+    program = Parser(source).parse()
+    Typer(program).typecheck_program()
+    serializer = ByteCodeProgramSerializer(ByteCodeProgram(program))
+
+    majors = []
+    for initial_heap in (16 * 1024, 64 * 1024 * 1024):
+        assert run_vm(serializer, gc_initial_heap=initial_heap) == 0
+        stats = gc_stats()
+        assert stats.objects_freed > 0
+        assert stats.bytes_freed > 0
+        assert stats.total_pause_ns == stats.minor_pause_ns + stats.major_pause_ns
+        majors.append(stats.major_collections)
+    assert majors[0] > majors[1] == 0
+
+
+def test_programs_run_in_parallel_threads(capfd):
+    def compile_job(n: int) -> ByteCodeProgramSerializer:
+        source = f"""
+        func fib(n: int) => int {{
+            if n < 2 then return n
+            return fib(n - 1) + fib(n - 2)
+        }}
+        var s = ""
+        for var i = 0; i < 2000; i += 1 {{
+            s = toString(i) + s
+        }}
+        print("<" + toString({n}) + ":" + toString(fib({n})) + ">")
+        """
+        program = Parser(source).parse()
+        assert not Typer(program).typecheck_program().error_count
+        return ByteCodeProgramSerializer(ByteCodeProgram(program))
+
+    jobs = [compile_job(n) for n in range(10, 22)]
+
+    def run_job(job):
+        code = run_vm(job, gc_initial_heap=32 * 1024)
+        return code, gc_stats().collections
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(run_job, jobs * 2))
+    assert all(code == 0 and collections > 0 for code, collections in results)
+
+    fib = [0, 1]
+    while len(fib) < 22:
+        fib.append(fib[-1] + fib[-2])
+    printed = re.findall(r"<(\d+):(\d+)>", capfd.readouterr().out)
+    assert sorted((int(n), int(f)) for n, f in printed) == sorted(
+        (n, fib[n]) for n in range(10, 22) for _ in range(2)
+    )
+
+
+HANDLE_SOURCE = """
+var calls = 0
+const prefix = "rule"
+func score(n: int, w: float, gold: bool) => float {
+    calls += 1
+    if gold then return toFloat(n) * w * 2.0
+    return toFloat(n) * w
+}
+func label(tag: string, n: int) => string {
+    return prefix + "-" + tag + "-" + toString(n)
+}
+func calls_count() => int { return calls }
+func is_gold(n: int) => bool { return n > 10 }
+func deep(n: int) => int { return deep(n + 1) + 1 }
+func log() => void { println("logged") }
+println("loaded")
+"""
+
+
+def compile_handle_source() -> bytes:
+    program = Parser(HANDLE_SOURCE).parse()
+    assert not Typer(program).typecheck_program().error_count
+    return ByteCodeProgramSerializer(ByteCodeProgram(program)).get_bytes()
+
+
+def test_vm_handle_calls_functions_many_times(capfd):
+    with VMHandle(compile_handle_source(), gc_initial_heap=16 * 1024) as vm:
+        assert capfd.readouterr().out == "loaded\n"
+        assert vm.call("score", 3, 1.5, True) == 9.0
+        assert vm.call("score", 3, 1.5, False) == 4.5
+        assert vm.call("is_gold", 11) is True
+        assert vm.call("label", "", 0) == "rule--0"
+        for i in range(5000):
+            assert vm.call("label", "a" * (i % 80), i).endswith(f"-{i}")
+        # the globals are kept between calls
+        assert vm.call("calls_count") == 2
+        assert vm.call("log") is None
+        assert capfd.readouterr().out == "logged\n"
+        assert vm.gc_stats().collections > 0
+
+
+def test_vm_handle_survives_failed_calls(capfd):
+    vm = VMHandle(compile_handle_source(), max_frames=100)
+    for name, args in (("missing", ()), ("is_gold", ()), ("deep", (0,))):
+        with pytest.raises(VMError):
+            vm.call(name, *args)
+    with pytest.raises(TypeError):
+        vm.call("is_gold", [1])
+    # arguments are checked against the parameter types from the bytecode
+    for name, args in (
+        ("label", (12345, 1)),
+        ("score", ("x", 1.0, True)),
+        ("score", (3, 1, True)),
+        ("is_gold", (None,)),
+        ("is_gold", (True,)),
+    ):
+        with pytest.raises(TypeError, match=name):
+            vm.call(name, *args)
+    assert vm.call("label", "ok", 1) == "rule-ok-1"
+    assert vm.call("is_gold", 3) is False
+    err = capfd.readouterr().err
+    assert "no function named 'missing'" in err
+    assert "maximum call depth of 100" in err
+    vm.close()
+    with pytest.raises(VMError):
+        vm.call("is_gold", 3)
+
+
+PROFILED_SOURCE = """func count(n: int) => int {
+    var s = 0
+    for var i = 0; i < n; i += 1 {
+        s = s + i
+    }
+    return s
+}
+func twice(n: int) => int {
+    return count(n) + count(n)
+}
+println(twice(20000))
+"""
+
+
+def test_profile_samples_map_to_functions_and_lines():
+    program = Parser(PROFILED_SOURCE).parse()
+    Typer(program).typecheck_program()
+    bytecode = ByteCodeProgram(program)
+    assert run_vm(ByteCodeProgramSerializer(bytecode), profile_interval=100) == 0
+    report = ProfileReport(bytecode, profile_stacks(), 100)
+    assert len(report.stacks) > 100
+    assert all(
+        [name for name, _ in stack] == ["<main>", "twice", "count"]
+        for stack in report.stacks
+        if stack[-1][0] == "count"
+    )
+    name, self_count, total_count = report.hot_functions()[0]
+    assert name == "count"
+    assert self_count == total_count > 0.9 * len(report.stacks)
+    assert {line for line, _, _ in report.hot_lines()[:2]} == {3, 4}
+    assert "<main>:11;twice:9;count:4 " in report.collapsed()
+    # unprofiled runs do not sample
+    assert run_vm(ByteCodeProgramSerializer(bytecode)) == 0
+    assert profile_stacks() == []
+
+
+def test_profile_cli_output(tmp_path, capfd):
+    output = tmp_path / "out.collapsed"
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--profile",
+            "--profile-interval",
+            "500",
+            "--profile-output",
+            str(output),
+            "-s",
+            PROFILED_SOURCE,
+        ],
+        check=True,
+    )
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "399980000"
+    assert "one every 500 instructions" in captured.err
+    assert "s = s + i  (count)" in captured.err
+    stacks = output.read_text().splitlines()
+    assert stacks and all(line.startswith("<main>:11;twice:9;") for line in stacks)
+
+
+def test_op_stats_count_the_executed_instructions():
+    program = Parser(PROFILED_SOURCE).parse()
+    Typer(program).typecheck_program()
+    bytecode = ByteCodeProgram(program)
+    PeepholeOptimizer(bytecode).optimize()
+    assert run_vm(ByteCodeProgramSerializer(bytecode), count_ops=True) == 0
+    report = OpStatsReport(op_stats(), bytecode)
+    ops = dict(report.ops)
+    assert ops[OPCODE.INCLOCAL] == 2 * 20000
+    assert ops[OPCODE.CALL_DIRECT] == 3
+    assert ops[OPCODE.EXITVM] == 1
+    assert sum(count for _, _, count in report.pairs) == report.instructions - 1
+    functions = dict(report.functions)
+    assert report.functions[0][0] == "count"
+    assert sum(functions.values()) == report.instructions
+    stats = report.to_dict()
+    assert stats["ops"][0]["count"] >= stats["ops"][-1]["count"]
+    assert json.loads(json.dumps(stats)) == stats
+    # uncounted runs do not count
+    assert run_vm(ByteCodeProgramSerializer(bytecode)) == 0
+    assert op_stats() is None
+
+
+def test_op_stats_cli_json(capfd):
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--op-stats",
+            "--op-stats-format",
+            "json",
+            "-s",
+            PROFILED_SOURCE,
+        ],
+        check=True,
+    )
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "399980000"
+    stats = json.loads(captured.err)
+    assert stats["functions"][0]["function"] == "count"
+    assert {"first", "second", "count"} == set(stats["pairs"][0])
+
+
+def test_op_stats_cli_before_the_file(tmp_path, capfd):
+    source = tmp_path / "prog.uza"
+    source.write_text(PROFILED_SOURCE)
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--op-stats",
+            str(source),
+        ],
+        check=True,
+    )
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "399980000"
+    assert "instructions executed" in captured.err
+    assert "count" in captured.err
+
+
+def test_timings_measure_each_phase(capfd):
+    timings = PipelineTimings()
+    res = Driver.run_with_config(
+        Driver.Configuration.INTERPRET_BYTECODE, PROFILED_SOURCE, timings=timings
+    )
+    assert res == 0
+    assert remove_new_lines(capfd.readouterr().out) == "399980000"
+    assert [phase.name for phase in timings.phases] == [
+        "parse",
+        "typecheck",
+        "optimize",
+        "compile",
+        "peephole",
+        "serialize",
+        "vm",
+    ]
+    assert all(phase.wall_time >= 0 and phase.cpu_time >= 0 for phase in timings.phases)
+    assert timings.phases[0].peak_memory > 0
+    counts = timings.counts
+    assert counts["tokens"] > counts["ast_nodes"] > 0
+    assert counts["constraints"] > 0 and counts["substitutions"] > 0
+    assert counts["chunks"] == 3
+    assert counts["bytecode_bytes"] > counts["ops"] > 0
+    stats = timings.to_dict()
+    assert json.loads(timings.to_json()) == stats
+    assert stats["total_wall_time"] == pytest.approx(
+        sum(phase["wall_time"] for phase in stats["phases"])
+    )
+
+
+def test_timings_cli_json(capfd):
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--timings",
+            "--timings-format",
+            "json",
+            "-t",
+            "-s",
+            PROFILED_SOURCE,
+        ],
+        check=True,
+    )
+    stats = json.loads(capfd.readouterr().err)
+    assert [phase["name"] for phase in stats["phases"]] == ["parse", "typecheck"]
+    assert set(stats["counts"]) == {
+        "tokens",
+        "ast_nodes",
+        "constraints",
+        "substitutions",
+    }
+
+
+def test_compile_cache_skips_the_compiler(tmp_path, capfd):
+    cache = CompileCache(str(tmp_path))
+    phases = []
+    for optimization_level in (2, 2, 1):
+        timings = PipelineTimings(trace_memory=False)
+        res = Driver.run_with_config(
+            Driver.Configuration.INTERPRET_BYTECODE,
+            PROFILED_SOURCE,
+            optimization_level=optimization_level,
+            timings=timings,
+            cache=cache,
+        )
+        assert res == 0
+        assert remove_new_lines(capfd.readouterr().out) == "399980000"
+        phases.append([phase.name for phase in timings.phases])
+    assert "compile" in phases[0] and "compile" in phases[2]
+    assert phases[1] == ["vm"]
+    assert len(cache.entries()) == 2
+    # no temporary file is left behind by the atomic writes
+    entries = {os.path.basename(path) for path, _, _ in cache.entries()}
+    assert set(os.listdir(tmp_path)) == entries
+
+
+def test_compile_cache_evicts_least_recently_used(tmp_path):
+    cache = CompileCache(str(tmp_path), max_size=25)
+    keys = [cache.key(f"println({i})") for i in range(3)]
+    assert len(set(keys)) == 3
+    cache.put(keys[0], b"0" * 10)
+    cache.put(keys[1], b"1" * 10)
+    os.utime(cache.entries()[0][0], ns=(0, 0))
+    os.utime(cache.entries()[1][0], ns=(1, 1))
+    assert cache.get(keys[0]) == b"0" * 10
+    cache.put(keys[2], b"2" * 10)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == b"0" * 10
+    assert cache.get(keys[2]) == b"2" * 10
+    assert cache.key("println(0)", (1,)) != keys[0]
+
+
+def test_compile_cache_cli_opt_out(tmp_path, capfd):
+    env = dict(os.environ, UZA_CACHE_DIR=str(tmp_path / "cache"))
+    uza = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza")
+    for flags in (["--no-cache"], [], []):
+        subprocess.run(
+            ["python", uza, *flags, "-s", 'println("cached")'], check=True, env=env
+        )
+        assert remove_new_lines(capfd.readouterr().out) == "cached"
+        if flags:
+            assert not (tmp_path / "cache").exists()
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+
+def test_cli_modes_import_only_what_they_use(tmp_path):
+    source = tmp_path / "prog.uza"
+    source.write_text('println("lazy")')
+    root = os.path.dirname(os.path.dirname(__file__))
+    script = (
+        "import json, sys\n"
+        "from uzac.cli import main\n"
+        "main(sys.argv[1:])\n"
+        "vm = sys.modules.get('vm.main')\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+        "print(vm is not None and vm._library.cache_info().currsize > 0)\n"
+    )
+
+    def imported(*args):
+        res = subprocess.run(
+            ["python", "-c", script, *args],
+            cwd=tmp_path,
+            env=dict(os.environ, PYTHONPATH=root, UZA_CACHE_DIR=str(tmp_path)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        *_, modules, vm_loaded = res.stdout.splitlines()
+        return json.loads(modules), vm_loaded == "True"
+
+    for flag in ("-p", "-t"):
+        modules, vm_loaded = imported(flag, str(source))
+        assert "vm.main" not in modules and not vm_loaded
+    modules, vm_loaded = imported(str(source))
+    assert "uzac.typer" in modules and vm_loaded
+    # the first run filled the cache
+    modules, vm_loaded = imported(str(source))
+    assert vm_loaded
+    assert not {"uzac.parser", "uzac.typer", "uzac.bytecode"} & set(modules)
+
+
+def test_timings_cli_before_the_file(tmp_path, capfd):
+    source = tmp_path / "prog.uza"
+    source.write_text(PROFILED_SOURCE)
+    subprocess.run(
+        [
+            "python",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "uza"),
+            "--timings",
+            str(source),
+        ],
+        check=True,
+    )
+    captured = capfd.readouterr()
+    assert remove_new_lines(captured.out) == "399980000"
+    assert "wall (ms)" in captured.err
+    assert re.search(r"^vm\s", captured.err, re.M)
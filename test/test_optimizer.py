@@ -0,0 +1,91 @@
+from uzac.ast import IfElse, InfixApplication, Literal, NoOp
+from uzac.bytecode import OPCODE, ByteCodeProgram
+from uzac.optimizer import Optimizer
+from uzac.parser import Parser
+from uzac.typer import Typer
+
+
+def optimize(source: str, level=1):
+    program = Parser(source).parse()
+    assert not Typer(program).typecheck_program().error_count
+    return Optimizer(program, level).optimize().syntax_tree.lines
+
+
+def folded_value(source: str):
+    (line,) = optimize(f"const x = {source}")
+    assert isinstance(line.value, Literal), line.value
+    return line.value.value
+
+
+def test_fold_arithmetic_like_the_vm():
+    assert folded_value("2 * 3 + 1") == 7
+    assert folded_value("7 / -2") == -3
+    assert folded_value("-7 % 3") == -1
+    assert folded_value("1 + 2.5") == 3.5
+    assert folded_value("1 < 2.5 and 3 >= 3") is True
+    assert folded_value('"ab" + "cd" == "abcd"') is True
+
+
+def test_fold_conversions():
+    assert folded_value("toString(42)") == "42"
+    assert folded_value("toString(1.5)") == "1.500000"
+    assert folded_value('"2.5".toFloat()') == 2.5
+    assert folded_value("2.9.toInt()") == 2
+    assert folded_value("(-2.9).toInt()") == -2
+
+
+def test_fold_keeps_runtime_errors_and_overflow():
+    (line,) = optimize("const x = 1 / 0")
+    assert isinstance(line.value, InfixApplication)
+    (line,) = optimize("const x = 9223372036854775807 + 1")
+    assert isinstance(line.value, InfixApplication)
+
+
+def test_folded_literal_keeps_span():
+    (line,) = optimize("const x = 2 * 3 + 1")
+    assert line.value.span.get_source() == "2 * 3 + 1"
+
+
+def test_algebraic_simplifications():
+    source = """
+    var i = 3
+    var f = 1.5
+    const a = i * 1
+    const b = 0 + i
+    const c = f * 1
+    const d = f + 0
+    const e = i * 1.0
+    const g = not not (i > 2)
+    """
+    lines = optimize(source)
+    values = {line.identifier: line.value for line in lines[2:]}
+    assert values["a"].name == "i"
+    assert values["b"].name == "i"
+    assert values["c"].name == "f"
+    assert isinstance(values["d"], InfixApplication)  # -0.0 + 0 is 0.0
+    assert isinstance(values["e"], InfixApplication)  # int to float
+    assert isinstance(values["g"], InfixApplication)
+
+
+def test_prune_constant_branches():
+    source = """
+    if 1 < 2 then println("yes") else println("no")
+    if false { println("never") }
+    """
+    yes, never = optimize(source)
+    assert yes.args[0].value == "yes"
+    assert isinstance(never, NoOp)
+
+
+def test_level_zero_is_untouched():
+    (line,) = optimize("if 1 < 2 then println(2 * 3)", level=0)
+    assert isinstance(line, IfElse)
+
+
+def test_unused_folded_value_is_not_pushed():
+    program = Parser("println(1)\n1 + 2").parse()
+    assert not Typer(program).typecheck_program().error_count
+    Optimizer(program).optimize()
+    codes = [op.code for op in ByteCodeProgram(program).chunks[0].code]
+    assert OPCODE.IADD not in codes
+    assert codes.count(OPCODE.LCONST) == 1
@@ -0,0 +1,167 @@
+from uzac.bytecode import OPCODE, ByteCodeProgram, Chunk, Op
+from uzac.parser import Parser
+from uzac.peephole import PeepholeOptimizer
+from uzac.typer import Typer
+from uzac.utils import Span
+
+SPAN = Span(0, 0, "test")
+
+
+def compile_program(source: str) -> ByteCodeProgram:
+    program = Parser(source).parse()
+    assert not Typer(program).typecheck_program().error_count
+    return ByteCodeProgram(program)
+
+
+def optimize_chunk(chunk: Chunk) -> PeepholeOptimizer:
+    program = compile_program("")
+    program.chunks = [chunk]
+    peephole = PeepholeOptimizer(program)
+    peephole.optimize()
+    return peephole
+
+
+def codes(chunk: Chunk) -> list[OPCODE]:
+    return [op.code for op in chunk.code]
+
+
+def test_push_pop_pairs_are_removed():
+    chunk = Chunk("test")
+    for op in (
+        Op(OPCODE.LCONST, SPAN, constant=1),
+        Op(OPCODE.POP, SPAN),
+        Op(OPCODE.BOOLTRUE, SPAN),
+        Op(OPCODE.POP, SPAN),
+        Op(OPCODE.EXITVM, SPAN),
+    ):
+        chunk.add_op(op)
+    peephole = optimize_chunk(chunk)
+    assert codes(chunk) == [OPCODE.EXITVM]
+    assert peephole.stats["push/pop removal"].ops_removed == 4
+    assert peephole.stats["push/pop removal"].bytes_saved == 5
+
+
+def test_jumps_are_threaded():
+    chunk = Chunk("test")
+    for op in (
+        Op(OPCODE.BOOLTRUE, SPAN),
+        Op(OPCODE.JUMP_IF_FALSE, SPAN, jump_offset=2),
+        Op(OPCODE.POP, SPAN),
+        Op(OPCODE.EXITVM, SPAN),
+        Op(OPCODE.JUMP, SPAN, jump_offset=1),
+        Op(OPCODE.LNIL, SPAN),
+        Op(OPCODE.POP, SPAN),
+        Op(OPCODE.EXITVM, SPAN),
+    ):
+        chunk.add_op(op)
+    assert chunk.jump_targets() == {1: 4, 4: 6}
+    optimize_chunk(chunk)
+    # the jump is unreachable once threaded
+    assert codes(chunk) == [
+        OPCODE.BOOLTRUE,
+        OPCODE.JUMP_IF_FALSE,
+        OPCODE.POP,
+        OPCODE.EXITVM,
+        OPCODE.POP,
+        OPCODE.EXITVM,
+    ]
+    assert chunk.jump_targets() == {1: 4}
+
+
+def test_not_and_jump_if_false_become_jump_if_true():
+    program = compile_program(
+        "var a = 1\nif not (a == 1) then println(a) else println(0)"
+    )
+    PeepholeOptimizer(program).optimize()
+    main = codes(program.chunks[0])
+    assert OPCODE.NOT not in main
+    assert OPCODE.JUMP_IF_TRUE in main
+    assert OPCODE.JUMP_IF_FALSE not in main
+
+
+def test_not_is_kept_when_the_condition_is_a_value():
+    program = compile_program("var a = true\nconst b = (not a) and a")
+    PeepholeOptimizer(program).optimize()
+    main = codes(program.chunks[0])
+    assert main.index(OPCODE.NOT) + 1 == main.index(OPCODE.JUMP_IF_FALSE)
+
+
+def test_dead_code_after_return_is_removed():
+    program = compile_program(
+        """
+        func f(n: int) => int {
+            return n
+            println("unreachable")
+        }
+        """
+    )
+    peephole = PeepholeOptimizer(program)
+    peephole.optimize()
+    func = next(chunk for chunk in program.chunks if chunk.name == "f")
+    assert codes(func) == [OPCODE.GETLOCAL, OPCODE.RETURN]
+    assert peephole.stats["dead code"].ops_removed > 0
+
+
+def test_loop_jumps_are_retargeted():
+    source = """
+    var i = 0
+    while i < 10 {
+        i += 1
+        if i == 5 then continue
+        println(i)
+    }
+    """
+    program = compile_program(source)
+    before = codes(program.chunks[0])
+    PeepholeOptimizer(program).optimize()
+    chunk = program.chunks[0]
+    targets = chunk.jump_targets()
+    for idx, target in targets.items():
+        op = chunk.code[idx]
+        assert (target <= idx) == (op.code == OPCODE.LOOP)
+        assert target <= len(chunk.code)
+    assert len(chunk.code) <= len(before)
+
+
+def test_superinstructions_are_selected():
+    source = """
+    func f(n: int) => int {
+        var i = 0
+        var s = 0
+        while i < 10 {
+            s = s + i
+            i += 1
+        }
+        return s
+    }
+    """
+    program = compile_program(source)
+    peephole = PeepholeOptimizer(program)
+    peephole.optimize()
+    func = codes(program.chunks[1])
+    assert OPCODE.JUMP_UNLESS_ILT in func
+    assert OPCODE.IADD_LOCALS in func
+    assert OPCODE.INCLOCAL in func
+    # the loop condition is never pushed
+    assert OPCODE.POP not in func
+    assert OPCODE.JUMP_IF_FALSE not in func
+    assert peephole.stats["superinstructions"].ops_removed > 0
+
+
+def test_superinstructions_need_a_single_entry():
+    chunk = Chunk("test")
+    # a jump lands on the LCONST, GETLOCAL + LCONST + IADD cannot be fused
+    for op in (
+        Op(OPCODE.BOOLTRUE, SPAN),
+        Op(OPCODE.JUMP_IF_FALSE, SPAN, jump_offset=3),
+        Op(OPCODE.POP, SPAN),
+        Op(OPCODE.GETLOCAL, SPAN, local_index=0),
+        Op(OPCODE.JUMP, SPAN, jump_offset=0),
+        Op(OPCODE.LCONST, SPAN, constant=1),
+        Op(OPCODE.IADD, SPAN),
+        Op(OPCODE.SETLOCAL, SPAN, local_index=0),
+        Op(OPCODE.EXITVM, SPAN),
+    ):
+        chunk.add_op(op)
+    optimize_chunk(chunk)
+    assert OPCODE.INCLOCAL not in codes(chunk)
@@ -1,8 +1,9 @@
 import pytest
 from uzac.driver import Driver
-from uzac.typer import Typer
+from uzac.typer import Substitution, SymbolicType, Typer
+from uzac.type import type_float, type_int
 from uzac.parser import Parser
-from uzac.utils import UzaSyntaxError, UzaTypeError
+from uzac.utils import Span, UzaSyntaxError, UzaTypeError
 
 
 def test_add_int_float():
@@ -180,3 +181,41 @@ def test_redef():
     """
     diag = Driver.run_with_config(Driver.Configuration.TYPECHECK, source)
     assert diag > 0
+
+
+def test_large_program_typechecks():
+    lines = ["var acc = 0", "var facc = 0.0"]
+    for i in range(1000):
+        lines.append(f"const a{i} = {i} + acc")
+        lines.append(f"acc = acc + a{i} % 7")
+        lines.append(f"facc = facc + a{i} * 2.5")
+    lines.append("println(facc + acc)")
+    typer = Typer(Parser("\n".join(lines)).parse())
+    typer_res = typer.typecheck_program()
+    assert not typer_res.error_count
+
+
+def test_overload_return_type_must_match():
+    source = """
+    const foo : int = 1.5 + 2
+    """
+    typer = Typer(Parser(source).parse())
+    typer_res = typer.typecheck_program()
+    assert typer_res.error_count > 0
+
+
+def test_substitution_is_persistent():
+    span = Span(0, 0, "")
+    a, b, c = (SymbolicType(name, span) for name in "abc")
+    base = Substitution({})
+    chain = base + (a, b) + (b, c)
+    with_int = chain + (c, type_int)
+    with_float = chain + (c, type_float)
+
+    assert with_int.find(a) == type_int
+    assert with_float.find(a) == type_float
+    assert chain.find(a) == c
+    assert base.find(a) == a
+    assert with_int.get_type_of(a) == type_int  # path compressed
+    assert chain.get_type_of(a) == c
+    assert with_float.bind(a, type_int) is None
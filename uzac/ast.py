@@ -59,6 +59,27 @@ class Literal(Node):
                 self.value = float(self.token.repr)
         self.span = self.token.span
 
+    @classmethod
+    def from_value(cls, value: bool | str | int | float | None, span: Span) -> Literal:
+        """
+        Returns the Literal the parser would build for _value_, spanning _span_.
+        Used for values computed at compile time, e.g. folded constants.
+        """
+        if value is True:
+            kind, source = token_true, "true"
+        elif value is False:
+            kind, source = token_false, "false"
+        elif value is None:
+            kind, source = token_nil, "nil"
+        elif isinstance(value, str):
+            escaped = value.encode("unicode_escape").decode("ascii")
+            kind, source = token_string, f'"{escaped}"'
+        else:
+            kind, source = token_number, repr(value)
+        literal = cls(Token(kind, Span(0, len(source), source)))
+        literal.span = span
+        return literal
+
     def visit(self, that):
         return that.visit_literal(self)
 
@@ -87,6 +108,10 @@ class Identifier(Node):
 
         assert hasattr(self, "token")
 
+    def __hash__(self) -> int:
+        # identifiers are used as symbol table keys
+        return hash(self.name)
+
     def visit(self, that):
         return that.visit_identifier(self)
 
@@ -118,6 +143,9 @@ class Application(Node):
     pop_value: bool = field(init=False, default=False)
     "Wether the vm should pop the return value off the stack (if unused)"
 
+    arg_types: Optional[list[Type]] = field(init=False, default=None, compare=False)
+    "Argument types resolved by the typer, used to emit type specialized opcodes"
+
     def __init__(self, func_id: Identifier, *args, generic_arg: Type = None) -> None:
         self.func_id = func_id
         self.args = list(args)
@@ -146,6 +174,9 @@ class InfixApplication(Node):
     pop_value: bool = field(init=False, default=False)
     "Wether the vm should pop the return value off the stack (if unused)"
 
+    arg_types: Optional[list[Type]] = field(init=False, default=None, compare=False)
+    "Argument types resolved by the typer, used to emit type specialized opcodes"
+
     def __post_init__(self) -> None:
         self.span = self.lhs.span + self.rhs.span
 
@@ -167,6 +198,9 @@ class PrefixApplication(Node):
     pop_value: bool = field(init=False, default=False)
     "Wether the vm should pop the return value off the stack (if unused)"
 
+    arg_types: Optional[list[Type]] = field(init=False, default=None, compare=False)
+    "Argument types resolved by the typer, used to emit type specialized opcodes"
+
     def __post_init__(self) -> None:
         self.span = self.func_id.span + self.expr.span
 
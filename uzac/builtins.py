@@ -1,5 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
+from functools import cached_property
 from operator import (
     add,
     and_,
@@ -19,7 +20,7 @@ from operator import (
 import random
 import sys
 import time
-from typing import Callable, List, Optional
+from typing import Callable, List, Optional, Union
 from uzac.type import (
     ArrowType,
     GenericType,
@@ -53,12 +54,15 @@ def get_builtin(identifier: Identifier) -> Optional[BuiltIn]:
 class BuiltIn:
     """
     A BuiltIn is a function that is part of the standard library.
+
+    The signatures of the standard library are built the first time the typer
+    or the compiler looks at them, not when the module is imported. _signatures_
+    is either the list of signatures or a function returning it.
     """
 
     identifier: str
     interpret: Callable[..., Value]  # tree walk interpretation in python
-    type_signatures: List[ArrowType]  # len == 1 if no overloads
-    arity: int = field(init=False)
+    signatures: Union[List[ArrowType], Callable[[], List[ArrowType]]]
     is_op_code: bool = field(
         default=False
     )  # if true, emits specific opcode instead of CALL_NATIVE
@@ -67,7 +71,16 @@ class BuiltIn:
     def __post_init__(self):
         # adds itself to the dict that holds all the builtins
         _builtins[self.identifier] = self
-        object.__setattr__(self, "arity", len(self.type_signatures[0].param_types))
+
+    @cached_property
+    def type_signatures(self) -> List[ArrowType]:  # len == 1 if no overloads
+        if callable(self.signatures):
+            return self.signatures()
+        return self.signatures
+
+    @property
+    def arity(self) -> int:
+        return len(self.type_signatures[0].param_types)
 
     def __str__(self) -> str:
         return f"BuiltIn({self.identifier}, {self.type_signatures})"
@@ -75,15 +88,24 @@ class BuiltIn:
 
 # ARITHMETIC FUNCTIONS
 
-__bi_arith_types = [
-    ArrowType([type_int, type_int], type_int),
-    ArrowType([type_float, type_float], type_float),
-    ArrowType([type_int, type_float], type_float),
-    ArrowType([type_float, type_int], type_float),
-]
-__bi_string_concat = ArrowType([type_string, type_string], type_string)
 
-bi_add = BuiltIn("+", add, [*__bi_arith_types, __bi_string_concat])
+def __bi_arith_types() -> List[ArrowType]:
+    return [
+        ArrowType([type_int, type_int], type_int),
+        ArrowType([type_float, type_float], type_float),
+        ArrowType([type_int, type_float], type_float),
+        ArrowType([type_float, type_int], type_float),
+    ]
+
+
+bi_add = BuiltIn(
+    "+",
+    add,
+    lambda: [
+        *__bi_arith_types(),
+        ArrowType([type_string, type_string], type_string),
+    ],
+)
 
 
 def __sub_or_neg(*args):
@@ -92,19 +114,21 @@ def __sub_or_neg(*args):
     return args[0] - args[1]
 
 
-__identity_int_float_types = [
-    ArrowType([type_int], type_int),
-    ArrowType([type_float], type_float),
-]
+def __identity_int_float_types() -> List[ArrowType]:
+    return [
+        ArrowType([type_int], type_int),
+        ArrowType([type_float], type_float),
+    ]
+
 
 bi_sub = BuiltIn(
     "-",
     __sub_or_neg,
-    __bi_arith_types + __identity_int_float_types,
+    lambda: __bi_arith_types() + __identity_int_float_types(),
 )
 bi_mul = BuiltIn("*", mul, __bi_arith_types)
 bi_div = BuiltIn("/", truediv, __bi_arith_types)
-bi_mod = BuiltIn("%", mod, [ArrowType([type_int, type_int], type_int)])
+bi_mod = BuiltIn("%", mod, lambda: [ArrowType([type_int, type_int], type_int)])
 bi_pow = BuiltIn("**", pow, __bi_arith_types)
 bi_max = BuiltIn("max", max, __bi_arith_types)
 bi_min = BuiltIn("min", min, __bi_arith_types)
@@ -127,18 +151,22 @@ def __lower_str_bool(func, **kwargs):
     return decorated
 
 
-__bi_print_types = [
-    ArrowType([type_string], type_void),
-    ArrowType([type_int], type_void),
-    ArrowType([type_float], type_void),
-    ArrowType([type_list], type_void),
-    ArrowType([type_bool], type_void),
-    ArrowType([type_void], type_void),
-]
+def __bi_print_types() -> List[ArrowType]:
+    return [
+        ArrowType([type_string], type_void),
+        ArrowType([type_int], type_void),
+        ArrowType([type_float], type_void),
+        ArrowType([type_list], type_void),
+        ArrowType([type_bool], type_void),
+        ArrowType([type_void], type_void),
+    ]
+
 
 bi_print = BuiltIn("print", __lower_str_bool(print, end=""), __bi_print_types)
 bi_println = BuiltIn("println", __lower_str_bool(print), __bi_print_types)
-bi_flush = BuiltIn("flush", lambda: sys.stdout.flush(), [ArrowType([], type_void)])
+bi_flush = BuiltIn(
+    "flush", lambda: sys.stdout.flush(), lambda: [ArrowType([], type_void)]
+)
 
 
 def __read_file(file_name):
@@ -146,22 +174,30 @@ def __read_file(file_name):
         return file.read()
 
 
-bi_readAll = BuiltIn("readAll", __read_file, [ArrowType([type_string], type_string)])
+bi_readAll = BuiltIn(
+    "readAll", __read_file, lambda: [ArrowType([type_string], type_string)]
+)
 
 # BOOLEAN STUFF
 
-__bool_func_types = [
-    ArrowType([type_bool, type_bool], type_bool),
-    ArrowType([type_int, type_int], type_bool),
-    ArrowType([type_string, type_string], type_bool),
-    ArrowType([type_float, type_float], type_bool),
-]
-__bool_cmp_overloads = [
-    ArrowType([type_int, type_int], type_bool),
-    ArrowType([type_float, type_float], type_bool),
-    ArrowType([type_int, type_float], type_bool),
-    ArrowType([type_float, type_int], type_bool),
-]
+
+def __bool_func_types() -> List[ArrowType]:
+    return [
+        ArrowType([type_bool, type_bool], type_bool),
+        ArrowType([type_int, type_int], type_bool),
+        ArrowType([type_string, type_string], type_bool),
+        ArrowType([type_float, type_float], type_bool),
+    ]
+
+
+def __bool_cmp_overloads() -> List[ArrowType]:
+    return [
+        ArrowType([type_int, type_int], type_bool),
+        ArrowType([type_float, type_float], type_bool),
+        ArrowType([type_int, type_float], type_bool),
+        ArrowType([type_float, type_int], type_bool),
+    ]
+
 
 bi_and = BuiltIn("and", and_, __bool_func_types)
 bi_or = BuiltIn("or", or_, __bool_func_types)
@@ -172,7 +208,7 @@ bi_le = BuiltIn("<=", le, __bool_cmp_overloads)
 bi_gt = BuiltIn(">", gt, __bool_cmp_overloads)
 bi_ge = BuiltIn(">=", ge, __bool_cmp_overloads)
 
-bi_not = BuiltIn("not", not_, [ArrowType([type_bool], type_bool)])
+bi_not = BuiltIn("not", not_, lambda: [ArrowType([type_bool], type_bool)])
 
 # TYPE CONVERSION FUNCTIONS
 
@@ -190,7 +226,7 @@ def __uza_to_int(arg):
 bi_to_int = BuiltIn(
     "toInt",
     __uza_to_int,
-    [
+    lambda: [
         ArrowType([type_float], type_int),
         ArrowType([type_string], type_int),
         ArrowType([type_int], type_int),
@@ -201,7 +237,7 @@ bi_to_int = BuiltIn(
 bi_to_float = BuiltIn(
     "toFloat",
     float,
-    [
+    lambda: [
         ArrowType([type_float], type_float),
         ArrowType([type_int], type_float),
         ArrowType([type_string], type_float),
@@ -212,7 +248,7 @@ bi_to_float = BuiltIn(
 bi_to_string = BuiltIn(
     "toString",
     str,
-    [
+    lambda: [
         ArrowType([type_int], type_string),
         ArrowType([type_float], type_string),
         ArrowType([type_string], type_string),
@@ -224,7 +260,7 @@ bi_to_string = BuiltIn(
 bi_new_list = BuiltIn(
     "List",
     list,
-    [
+    lambda: [
         ArrowType([], GenericType(type_list_class, NonInferableType())),
     ],
     type_not_inferrable=True,
@@ -232,7 +268,7 @@ bi_new_list = BuiltIn(
 bi_len = BuiltIn(
     "len",
     len,
-    [
+    lambda: [
         ArrowType([type_string], type_int),
         ArrowType([type_list], type_int),
     ],
@@ -240,14 +276,14 @@ bi_len = BuiltIn(
 bi_append = BuiltIn(
     "append",
     list.append,
-    [
+    lambda: [
         ArrowType([type_list, type_generic_meta], type_void),
     ],
 )
 bi_get = BuiltIn(
     "get",
     lambda l, i: l[i],
-    [
+    lambda: [
         ArrowType([type_list, type_int], type_generic_meta),
         ArrowType([type_string, type_int], type_string),
     ],
@@ -261,7 +297,7 @@ def __interpreter_set(value, idx, val):
 bi_get = BuiltIn(
     "set",
     __interpreter_set,
-    [
+    lambda: [
         ArrowType([type_list, type_int, type_generic_meta], type_void),
     ],
 )
@@ -269,7 +305,7 @@ bi_get = BuiltIn(
 bi_substring = BuiltIn(
     "substring",
     lambda l, start, end: l[start:end],
-    [
+    lambda: [
         ArrowType([type_string, type_int, type_int], type_string),
     ],
 )
@@ -277,7 +313,7 @@ bi_substring = BuiltIn(
 bi_sort = BuiltIn(
     "sort",
     lambda l, rev: l.sort(reverse=rev),
-    [
+    lambda: [
         ArrowType([type_list_int, type_bool], type_void),
         ArrowType([type_list_float, type_bool], type_void),
     ],
@@ -296,7 +332,7 @@ bi_sort = BuiltIn(
 bi_time_ns = BuiltIn(
     "timeNs",
     time.perf_counter_ns,
-    [
+    lambda: [
         ArrowType([], type_int),
     ],
 )
@@ -304,7 +340,7 @@ bi_time_ns = BuiltIn(
 bi_time_ms = BuiltIn(
     "timeMs",
     lambda: time.perf_counter_ns() // 1_000_000,
-    [
+    lambda: [
         ArrowType([], type_int),
     ],
 )
@@ -312,7 +348,7 @@ bi_time_ms = BuiltIn(
 bi_rand_int = BuiltIn(
     "randInt",
     lambda n: random.randint(0, n),
-    [
+    lambda: [
         ArrowType([type_int], type_int),
     ],
 )
@@ -320,7 +356,7 @@ bi_rand_int = BuiltIn(
 bi_sleep = BuiltIn(
     "sleep",
     lambda m: time.sleep(m),
-    [
+    lambda: [
         ArrowType([type_int], type_void),
     ],
 )
@@ -35,6 +35,7 @@ from uzac.ast import (
     WhileLoop,
 )
 from uzac.token import token_true
+from uzac.type import Type, type_bool, type_float, type_int, type_string, type_void
 from uzac.utils import Span
 from uzac.interpreter import (
     bi_add,
@@ -65,6 +66,8 @@ class OPCODE(Enum):
     RETURN = 0
     CALL = auto()
     CALL_NATIVE = auto()
+    CALL_DIRECT = auto()
+    TAIL_CALL_DIRECT = auto()
     JUMP = auto()
     LOOP = auto()
 
@@ -103,6 +106,37 @@ class OPCODE(Enum):
     TOSTRING = auto()
     TOINT = auto()
 
+    # typed arithmetic, emitted when the typer resolved the operand types
+    IADD = auto()
+    ISUB = auto()
+    IMUL = auto()
+    IDIV = auto()
+    INEG = auto()
+    FADD = auto()
+    FSUB = auto()
+    FMUL = auto()
+    FDIV = auto()
+    FNEG = auto()
+    STRCONCAT = auto()
+
+    # typed compare
+    IEQ = auto()
+    INE = auto()
+    ILT = auto()
+    ILE = auto()
+    IGT = auto()
+    IGE = auto()
+    FEQ = auto()
+    FNE = auto()
+    FLT = auto()
+    FLE = auto()
+    FGT = auto()
+    FGE = auto()
+
+    # typed conversion
+    ITOF = auto()
+    FTOI = auto()
+
     # variables
     DEFGLOBAL = auto()
     GETGLOBAL = auto()
@@ -111,8 +145,44 @@ class OPCODE(Enum):
     GETLOCAL = auto()
     SETLOCAL = auto()
 
+    # superinstructions, selected by the peephole optimizer
+    # push locals[a] <op> locals[b]
+    IADD_LOCALS = auto()
+    ISUB_LOCALS = auto()
+    IMUL_LOCALS = auto()
+    FADD_LOCALS = auto()
+    FSUB_LOCALS = auto()
+    FMUL_LOCALS = auto()
+    # jump forward unless locals[a] <op> constants[k], nothing is pushed
+    JUMP_UNLESS_IEQ = auto()
+    JUMP_UNLESS_INE = auto()
+    JUMP_UNLESS_ILT = auto()
+    JUMP_UNLESS_ILE = auto()
+    JUMP_UNLESS_IGT = auto()
+    JUMP_UNLESS_IGE = auto()
+    # locals[a] += constants[k]
+    INCLOCAL = auto()
+
     EXITVM = auto()
 
+    # operand prefix
+    WIDE = auto()
+
+
+# generic opcode -> (int opcode, float opcode), for operations with typed variants
+TYPED_OPCODES = {
+    OPCODE.ADD: (OPCODE.IADD, OPCODE.FADD),
+    OPCODE.SUB: (OPCODE.ISUB, OPCODE.FSUB),
+    OPCODE.MUL: (OPCODE.IMUL, OPCODE.FMUL),
+    OPCODE.DIV: (OPCODE.IDIV, OPCODE.FDIV),
+    OPCODE.NEG: (OPCODE.INEG, OPCODE.FNEG),
+    OPCODE.EQ: (OPCODE.IEQ, OPCODE.FEQ),
+    OPCODE.NE: (OPCODE.INE, OPCODE.FNE),
+    OPCODE.LT: (OPCODE.ILT, OPCODE.FLT),
+    OPCODE.LE: (OPCODE.ILE, OPCODE.FLE),
+    OPCODE.GT: (OPCODE.IGT, OPCODE.FGT),
+    OPCODE.GE: (OPCODE.IGE, OPCODE.FGE),
+}
 
 Const = float | int | bool
 VALUE_TYPES = {
@@ -128,6 +198,9 @@ OBJECT_TYPES = {
     str: 0,
 }
 
+NARROW_OPERAND_MAX = 0xFF
+NARROW_JUMP_MAX = 0xFFFF
+
 
 @dataclass
 class Op:
@@ -136,30 +209,71 @@ class Op:
     constant: Optional[int | float | str | bool] = field(default=None)
     constant_index: Optional[int] = field(default=None)
     local_index: Optional[int] = field(default=None)
+    second_local_index: Optional[int] = field(default=None)
     outer_local_index: Optional[int] = field(default=None)
     jump_offset: Optional[int] = field(default=None)
+    global_index: Optional[int] = field(default=None)
+    function_index: Optional[int] = field(default=None)
     size: int = field(init=False)
+    wide: bool = field(init=False, default=False)
+    "Whether the op is prefixed with OPCODE.WIDE, doubling its operand size"
 
     def size_in_bytes(self) -> int:
         """
         Returns the size of the opcode in bytes when turned into binary. It
         does not count the bytes writen for the lines (as these stores aside
         from the bytecode array).
+        Wide ops have a 1 byte prefix, 2 byte constant and local operands and
+        4 byte jump offsets.
         !MODIFY serialize.h too when this is changed.
         """
+        operand_size = 2 if self.wide else 1
         size = 1  # code
-        if self.constant is not None:
-            size += 1
-        if self.local_index is not None:
+        if self.wide:
             size += 1
+        operand_count = len(self.index_operands())
+        if self.constant is not None and self.constant_index is None:
+            operand_count += 1  # the index is assigned by Chunk.add_op
+        size += operand_count * operand_size
         if self.outer_local_index is not None:
             size += 1
         if self.jump_offset is not None:
-            size += 2
+            size += 2 * operand_size
         return size
 
-    def __post_init__(self):
+    def index_operands(self) -> list[int]:
+        """
+        Returns the local, constant, global and function index operands in
+        the order they are encoded. Only superinstructions have more than one.
+        """
+        return [
+            index
+            for index in (
+                self.local_index,
+                self.second_local_index,
+                self.constant_index,
+                self.global_index,
+                self.function_index,
+            )
+            if index is not None
+        ]
+
+    def update_size(self) -> int:
+        """
+        Widens the op if one of its operands does not fit the narrow encoding
+        and returns its size. Ops are never narrowed back so that the jump
+        relaxation in `Chunk.relax_jumps` terminates.
+        """
+        if not self.wide:
+            self.wide = (
+                any(index > NARROW_OPERAND_MAX for index in self.index_operands())
+                or (self.jump_offset or 0) > NARROW_JUMP_MAX
+            )
         self.size = self.size_in_bytes()
+        return self.size
+
+    def __post_init__(self):
+        self.update_size()
 
 
 class Chunk:
@@ -173,6 +287,9 @@ class Chunk:
     code: list[Op]
     constants: list[Const]
     locals_count: Optional[int]
+    param_types: list[Type]
+    "The parameter types of a function chunk, checked by calls from the host"
+    __constant_slots: dict[tuple[type, Const], int]
 
     def __init__(self, name: str, code: Optional[list[Op]] = None) -> None:
         self.name = name
@@ -181,16 +298,24 @@ class Chunk:
         else:
             self.code = []
         self.constants = []
+        self.param_types = []
+        self.__constant_slots = {}
 
     def __register_constant(self, constant: str | int | float | str) -> int:
         """
         Registers a constant and return its index in the constant pool.
+
+        Constants are only shared if their types match, typed opcodes do not
+        check value tags so `1` and `1.0` must not share the same slot. Floats
+        are keyed by their exact representation so that `0.0` and `-0.0`
+        stay distinct.
         """
-        idx = 0
-        try:
-            idx = self.constants.index(constant)
-        except ValueError:
+        const_type = type(constant)
+        key = (const_type, constant.hex() if const_type is float else constant)
+        idx = self.__constant_slots.get(key)
+        if idx is None:
             idx = len(self.constants)
+            self.__constant_slots[key] = idx
             self.constants.append(constant)
         return idx
 
@@ -203,12 +328,75 @@ class Chunk:
         if op.constant is not None:
             idx = self.__register_constant(op.constant)
             op.constant_index = idx
+            op.update_size()
             self.code.append(op)
         else:
             self.code.append(op)
 
         return op.size
 
+    def __op_starts(self) -> list[int]:
+        """
+        Returns the byte offset of each op, followed by the size of the code.
+        """
+        starts = [0]
+        for op in self.code:
+            starts.append(starts[-1] + op.size)
+        return starts
+
+    def jump_targets(self) -> dict[int, int]:
+        """
+        Returns the index of the op each jump lands on, by index of the jump.
+        The index of a jump to the end of the chunk is `len(self.code)`.
+        Forward jumps are relative to the end of the jump op, OPCODE.LOOP to
+        its start.
+        """
+        starts = self.__op_starts()
+        op_at = {start: idx for idx, start in enumerate(starts)}
+        targets = {}
+        for idx, op in enumerate(self.code):
+            if op.jump_offset is None:
+                continue
+            if op.code == OPCODE.LOOP:
+                targets[idx] = op_at[starts[idx] - op.jump_offset]
+            else:
+                targets[idx] = op_at[starts[idx + 1] + op.jump_offset]
+        return targets
+
+    def retarget_jumps(self, targets: dict[int, int]) -> None:
+        """
+        Sets the jump offsets so that each jump lands on its target op, given
+        by index of the jump as returned by `jump_targets`.
+
+        Jumps whose offset does not fit in 16 bits are widened. Widening a
+        jump moves the code after it, so the offsets are recomputed until no
+        other jump needs to be widened.
+        """
+        starts = self.__op_starts()
+        widened = True
+        while widened:
+            widened = False
+            for idx, target in targets.items():
+                op = self.code[idx]
+                if op.code == OPCODE.LOOP:
+                    op.jump_offset = starts[idx] - starts[target]
+                else:
+                    op.jump_offset = starts[target] - starts[idx + 1]
+                was_wide = op.wide
+                op.update_size()
+                widened = widened or op.wide != was_wide
+            if widened:
+                starts = self.__op_starts()
+
+    def relax_jumps(self) -> None:
+        """
+        Widens the jumps whose offset does not fit in 16 bits. The codegen
+        computes jump offsets assuming every jump is narrow.
+        """
+        targets = self.jump_targets()
+        if targets:
+            self.retarget_jumps(targets)
+
     def __repr__(self) -> str:
         return f"Chunk({self.name}, {repr(self.code)})"
 
@@ -395,6 +583,9 @@ class ByteCodeProgram(UzaASTVisitor):
 
     program: Program
     chunks: List[Chunk]
+    globals: dict[str, int]
+    "Slot of each global variable, the VM only uses the names for diagnostics"
+    __functions: dict[str, int]
     __chunk: Chunk
     __local_vars: ByteCodeLocals
     __written: int
@@ -405,8 +596,12 @@ class ByteCodeProgram(UzaASTVisitor):
         self.__chunk = Chunk("<main>")
         self.chunks = list()
         self.chunks.append(self.__chunk)
+        self.globals = {}
+        self.__functions = {}
         self.__local_vars = ByteCodeLocals()
         self.__build_chunk()
+        for chunk in self.chunks:
+            chunk.relax_jumps()
 
     def emit_op(self, op: Op) -> int:
         self.__chunk.add_op(op)
@@ -416,6 +611,39 @@ class ByteCodeProgram(UzaASTVisitor):
     def emit_pop(self, span: Span):
         self.emit_op(Op(OPCODE.POP, span))
 
+    def __global_slot(self, name: str) -> int:
+        """
+        Returns the slot of the global variable _name_. Functions can refer to
+        globals defined after them, so slots are assigned on first use.
+        """
+        return self.globals.setdefault(name, len(self.globals))
+
+    @staticmethod
+    def __arg_types(application: App) -> Optional[list[Type]]:
+        """
+        Returns the argument types of _application_ if the typer resolved them
+        all to int, float or string. Returns None otherwise, in which case the
+        generic opcodes are emitted and the VM dispatches on the value tags.
+        """
+        arg_types = application.arg_types
+        if arg_types is None:
+            return None
+        for type_ in arg_types:
+            if type_ not in (type_int, type_float, type_string):
+                return None
+        return arg_types
+
+    def __typed_opcode(self, opc: OPCODE, arg_types: list[Type]) -> OPCODE:
+        """
+        Returns the int or float variant of _opc_ for operands of _arg_types_.
+        Mixed int and float operands select the float variant, the int operand
+        is then converted with ITOF by the caller.
+        """
+        int_opc, float_opc = TYPED_OPCODES[opc]
+        if type_float in arg_types:
+            return float_opc
+        return int_opc
+
     def visit_no_op(self, _):
         pass
 
@@ -462,8 +690,8 @@ class ByteCodeProgram(UzaASTVisitor):
             # skip over the new jump at the end of truthy case if pred == false
             skip_truthy.jump_offset = self.__written - skip_truthy_point
 
-            falsy.visit(self)
             self.emit_op(pop_pred)
+            falsy.visit(self)
             jump_false_op.jump_offset = self.__written - skip_falsy_point
         else:
             skip_pop = Op(
@@ -479,7 +707,8 @@ class ByteCodeProgram(UzaASTVisitor):
         name = identifier.name
         local_maybe = self.__local_vars.get(name)
         if local_maybe is None:
-            self.emit_op(Op(OPCODE.GETGLOBAL, identifier.span, constant=name))
+            slot = self.__global_slot(name)
+            self.emit_op(Op(OPCODE.GETGLOBAL, identifier.span, global_index=slot))
         else:
             frame_idx, idx = local_maybe
             if frame_idx != 0:
@@ -492,8 +721,12 @@ class ByteCodeProgram(UzaASTVisitor):
         with self.__local_vars.new_frame(Frame(func.identifier.name, [])):
             chunk_save = self.__chunk
             chunk_new = Chunk(func.identifier.name)
+            chunk_new.param_types = list(func.type_signature.param_types)
 
             self.chunks.append(chunk_new)
+            chunk_idx = len(self.chunks) - 1
+            # registered before the body so that recursive calls are direct
+            self.__functions[func.identifier.name] = chunk_idx
             self.__chunk = chunk_new
             for idx, param in enumerate(func.param_names):
                 self.__local_vars.define(param.name)
@@ -534,7 +767,6 @@ class ByteCodeProgram(UzaASTVisitor):
                     span=func.identifier.span,
                 )
             )
-            chunk_idx = len(self.chunks) - 1
             self.emit_op(Op(OPCODE.LFUNC, constant=chunk_idx, span=func.span))
             chunk_new.locals_count = self.__local_vars.get_num_locals()
 
@@ -543,9 +775,8 @@ class ByteCodeProgram(UzaASTVisitor):
         name = var_def.identifier
         idx = self.__local_vars.define(name)
         if idx is None:
-            self.emit_op(
-                Op(OPCODE.DEFGLOBAL, var_def.span, constant=var_def.identifier)
-            )
+            slot = self.__global_slot(name)
+            self.emit_op(Op(OPCODE.DEFGLOBAL, var_def.span, global_index=slot))
         else:
             self.emit_op(Op(OPCODE.DEFLOCAL, var_def.span, local_index=idx))
 
@@ -555,9 +786,8 @@ class ByteCodeProgram(UzaASTVisitor):
 
         local_maybe = self.__local_vars.get(name)
         if local_maybe is None:
-            self.emit_op(
-                Op(OPCODE.SETGLOBAL, var_redef.span, constant=name),
-            )
+            slot = self.__global_slot(name)
+            self.emit_op(Op(OPCODE.SETGLOBAL, var_redef.span, global_index=slot))
         else:
             frame_idx, idx = local_maybe
             if frame_idx != 0:
@@ -570,19 +800,21 @@ class ByteCodeProgram(UzaASTVisitor):
 
         bi = get_builtin(application.func_id)
         if bi and bi.is_op_code:
-            if bi == bi_to_float:
-                opcode = OPCODE.TOFLOAT
-            if bi == bi_to_string:
-                opcode = OPCODE.TOSTRING
-            if bi == bi_to_int:
-                opcode = OPCODE.TOINT
-            self.emit_op(Op(opcode, span=application.span))
+            opcode = self.__conversion_opcode(bi, application)
+            if opcode is not None:
+                self.emit_op(Op(opcode, span=application.span))
         elif bi:
             opcode = OPCODE.CALL_NATIVE
             self.emit_op(
                 Op(opcode, constant=application.func_id.name, span=application.span)
             )
+        elif application.func_id.name in self.__functions:
+            chunk_idx = self.__functions[application.func_id.name]
+            self.emit_op(
+                Op(OPCODE.CALL_DIRECT, span=application.span, function_index=chunk_idx)
+            )
         else:
+            # not a known function, resolved by name at runtime
             opcode = OPCODE.LCONST
             self.emit_op(
                 Op(opcode, constant=application.func_id.name, span=application.span)
@@ -592,11 +824,51 @@ class ByteCodeProgram(UzaASTVisitor):
         if application.pop_value:
             self.emit_pop(application.span)
 
+    def __conversion_opcode(self, bi, application: Application) -> Optional[OPCODE]:
+        """
+        Returns the opcode for the toFloat/toString/toInt conversion builtin
+        _bi_. Returns None if the argument already has the target type.
+        """
+        arg_types = self.__arg_types(application)
+        arg_type = arg_types[0] if arg_types is not None else None
+        if bi == bi_to_float:
+            if arg_type == type_float:
+                return None
+            if arg_type == type_int:
+                return OPCODE.ITOF
+            return OPCODE.TOFLOAT
+        if bi == bi_to_int:
+            if arg_type == type_int:
+                return None
+            if arg_type == type_float:
+                return OPCODE.FTOI
+            return OPCODE.TOINT
+        if bi == bi_to_string:
+            if arg_type == type_string:
+                return None
+            return OPCODE.TOSTRING
+        raise NotImplementedError(f"no opcode for builtin {bi}")
+
     def visit_method_app(self, method: MethodApplication):
         method.method.visit(self)
 
     def visit_return(self, ret: Return):
-        ret.value.visit(self)
+        value = ret.value
+        if (
+            self.__chunk is not self.chunks[0]
+            and isinstance(value, Application)
+            and not get_builtin(value.func_id)
+            and value.func_id.name in self.__functions
+        ):
+            # the callee reuses the frame and returns to our caller
+            for arg in value.args:
+                arg.visit(self)
+            chunk_idx = self.__functions[value.func_id.name]
+            self.emit_op(
+                Op(OPCODE.TAIL_CALL_DIRECT, span=ret.span, function_index=chunk_idx)
+            )
+            return
+        value.visit(self)
         self.emit_op(Op(OPCODE.RETURN, span=ret.span))
 
     def visit_break(self, that: Break):
@@ -635,7 +907,11 @@ class ByteCodeProgram(UzaASTVisitor):
         if application.func_id.name == "not":
             self.emit_op(Op(OPCODE.NOT, application.span))
         elif application.func_id.name == "-":
-            self.emit_op(Op(OPCODE.NEG, application.span))
+            opc = OPCODE.NEG
+            arg_types = self.__arg_types(application)
+            if arg_types is not None:
+                opc = self.__typed_opcode(opc, arg_types)
+            self.emit_op(Op(opc, application.span))
         else:
             raise Exception(f"Can't handle : {application}")
 
@@ -674,8 +950,29 @@ class ByteCodeProgram(UzaASTVisitor):
         else:
             raise NotImplementedError(f"vm can't do {function} yet")
 
+        arg_types = self.__arg_types(application)
+        if arg_types is None or opc == OPCODE.MOD:
+            application.lhs.visit(self)
+            application.rhs.visit(self)
+            self.emit_op(Op(opc, application.span))
+            return
+
+        lhs_type, rhs_type = arg_types
+        if lhs_type == type_string or rhs_type == type_string:
+            if opc == OPCODE.ADD:
+                opc = OPCODE.STRCONCAT
+            application.lhs.visit(self)
+            application.rhs.visit(self)
+            self.emit_op(Op(opc, application.span))
+            return
+
+        opc = self.__typed_opcode(opc, arg_types)
         application.lhs.visit(self)
+        if lhs_type == type_int and rhs_type == type_float:
+            self.emit_op(Op(OPCODE.ITOF, application.lhs.span))
         application.rhs.visit(self)
+        if lhs_type == type_float and rhs_type == type_int:
+            self.emit_op(Op(OPCODE.ITOF, application.rhs.span))
         self.emit_op(Op(opc, application.span))
 
     def __build_lines(self, lines: list[Node]):
@@ -779,103 +1076,157 @@ class ByteCodeProgramSerializer:
     this approach is that the program is stored in memory in full instead of
     writing it as the codegen emits the opcodes. But it also simplifies the file
     handling and the piping of byte code without passing through disk.
+
+    The program is written to a single growable bytearray with precompiled
+    struct packers, each chunk's code and line arrays are emitted in one go.
     """
 
-    bytes_: bytes
+    U8 = struct.Struct("<B")
+    U16 = struct.Struct("<H")
+    U32 = struct.Struct("<I")
+    # value type, object type and index in the program string table
+    STRING_CONSTANT = struct.Struct("<BBI")
+    STRING_LENGTH = struct.Struct("<q")
+    INT_CONSTANT = struct.Struct("<Bq")
+    FLOAT_CONSTANT = struct.Struct("<Bd")
+    # local count, number of opcodes and size of the code in bytes
+    CHUNK_HEADER = struct.Struct("<HII")
+    LINE_MAX = 0xFFFF
+    # value type of each parameter type the host can pass, the others are
+    # written as PARAM_NOT_HOST and cannot be passed from the host
+    PARAM_TYPES = {
+        type_void: VALUE_TYPES[None],
+        type_int: VALUE_TYPES[int],
+        type_bool: VALUE_TYPES[bool],
+        type_float: VALUE_TYPES[float],
+        type_string: VALUE_TYPES[dict],
+    }
+    PARAM_NOT_HOST = 0xFF
+
+    bytes_: bytearray
     written: int
     program: ByteCodeProgram
+    strings: dict[str, int]
+    "The string table shared by all chunks, maps each string to its index"
 
     def __init__(self, program: ByteCodeProgram) -> None:
         self.program = program
-        self.written = 0
-        self.bytes_ = b""
+        self.bytes_ = bytearray()
+        self.strings = {}
         self.__serialize()
-
-    def __write(self, buff):
-        """
-        Appends to the bytes buffer for the program.
-        """
-        wrote = len(buff)
-        self.written += wrote
-        self.bytes_ += buff
-        return wrote
+        self.written = len(self.bytes_)
 
     def __write_constants(self, chunk: Chunk):
         """
-        Write the constant pool to self.file.
+        Write the constant pool.
         """
+        out = self.bytes_
         constants = chunk.constants
-        self.__write((len(constants)).to_bytes(1, BYTE_ORDER))
+        out += self.U16.pack(len(constants))
         for constant in constants:
             const_type = type(constant)
             if const_type == str:
-                self.__write(struct.pack("<B", VALUE_TYPES.get(dict)))
-                self.__write(OBJECT_TYPES.get(str).to_bytes(1, BYTE_ORDER))
-                length_pack = struct.pack("<q", len(constant))
-                self.__write(length_pack)
-                packed = struct.pack(f"{len(constant)}s", bytes(constant, "ascii"))
-                self.__write(packed)
-                continue
-
-            fmt = ""
-
-            self.__write(struct.pack("<B", VALUE_TYPES.get(const_type)))
-            if const_type == int:
-                fmt = "<q"
+                out += self.STRING_CONSTANT.pack(
+                    VALUE_TYPES[dict], OBJECT_TYPES[str], self.strings[constant]
+                )
+            elif const_type == int:
+                out += self.INT_CONSTANT.pack(VALUE_TYPES[int], constant)
             elif const_type == float:
-                fmt = "<d"
-            packed = struct.pack(fmt, constant)
-            self.__write(packed)
+                out += self.FLOAT_CONSTANT.pack(VALUE_TYPES[float], constant)
+            else:
+                raise TypeError(f"cannot serialize constant {constant!r}")
+
+    def __write_strings(self):
+        """
+        Write the string table. Identifiers and literals used in several
+        chunks are only stored, and interned by the VM, once.
+        """
+        strings = self.strings
+        for chunk in self.program.chunks:
+            for constant in chunk.constants:
+                if type(constant) == str and constant not in strings:
+                    strings[constant] = len(strings)
+        for name in self.program.globals:
+            if name not in strings:
+                strings[name] = len(strings)
+
+        out = self.bytes_
+        out += self.U32.pack(len(strings))
+        for string in strings:
+            encoded = bytes(string, "ascii")
+            out += self.STRING_LENGTH.pack(len(encoded))
+            out += encoded
+
+    def __write_globals(self):
+        """
+        Write the name of each global slot, in slot order.
+        """
+        out = self.bytes_
+        out += self.U32.pack(len(self.program.globals))
+        for name in self.program.globals:
+            out += self.U32.pack(self.strings[name])
 
     def __write_version(self):
-        for num in __version_tuple__:
-            self.__write(num.to_bytes(1, BYTE_ORDER))
+        self.bytes_ += bytes(__version_tuple__)
 
-    def __write_span(self, span: Span):
-        span_pack = struct.pack("<H", span.start)
-        return self.__write(span_pack)
+    @classmethod
+    def __encode_code(cls, code: list[Op]) -> bytearray:
+        """
+        Returns the bytes of the opcodes of a chunk.
+        """
+        encoded = bytearray()
+        pack_u16 = cls.U16.pack
+        pack_u32 = cls.U32.pack
+        wide_prefix = OPCODE.WIDE.value
+        for opcode in code:
+            start = len(encoded)
+            if opcode.wide:
+                encoded.append(wide_prefix)
+                encoded.append(opcode.code.value)
+                for index in opcode.index_operands():
+                    encoded += pack_u16(index)
+                if opcode.jump_offset is not None:
+                    encoded += pack_u32(opcode.jump_offset)
+            else:
+                encoded.append(opcode.code.value)
+                encoded += bytes(opcode.index_operands())
+                if opcode.jump_offset is not None:
+                    assert opcode.jump_offset >= 0
+                    encoded += pack_u16(opcode.jump_offset)
+
+            assert len(encoded) - start == opcode.size, (
+                f"For {opcode=}\n exepected it to be {opcode.size} in size but wrote {len(encoded) - start} instead"
+            )
+        return encoded
 
     def __write_chunk(self, chunk: Chunk):
         self.__write_constants(chunk)
 
-        self.__write(chunk.locals_count.to_bytes(1, BYTE_ORDER))
-
-        bytecode_count = struct.pack("<I", len(chunk.code))
-        self.__write(bytecode_count)
-        bytecode_len = struct.pack("<I", sum(op.size for op in chunk.code))
-        self.__write(bytecode_len)
-
-        code = chunk.code
-        written = 0
-        for opcode in code:
-            written += self.__write(opcode.code.value.to_bytes(1, BYTE_ORDER))
-            if opcode.constant_index is not None:
-                written += self.__write(opcode.constant_index.to_bytes(1, BYTE_ORDER))
-            elif opcode.local_index is not None:
-                written += self.__write(opcode.local_index.to_bytes(1, BYTE_ORDER))
-            elif opcode.jump_offset is not None:
-                assert opcode.jump_offset >= 0
-                offset_bytes = struct.pack("<H", opcode.jump_offset)
-                written += self.__write(offset_bytes)
-
-            assert written == opcode.size, (
-                f"For {opcode=}\n exepected it to be {opcode.size} in size but wrote {written} instead"
-            )
-            written = 0
-
-        for opcode in code:
-            self.__write_span(opcode.span)
+        code = self.__encode_code(chunk.code)
+        self.bytes_ += self.CHUNK_HEADER.pack(
+            chunk.locals_count, len(chunk.code), len(code)
+        )
+        self.bytes_ += self.U8.pack(len(chunk.param_types))
+        self.bytes_ += bytes(
+            self.PARAM_TYPES.get(param_type, self.PARAM_NOT_HOST)
+            for param_type in chunk.param_types
+        )
+        self.bytes_ += code
+        # the VM stores the span start of each opcode on 16 bits
+        lines = (min(op.span.start, self.LINE_MAX) for op in chunk.code)
+        self.bytes_ += struct.pack(f"<{len(chunk.code)}H", *lines)
 
     def __serialize(self):
         self.__write_version()
         chunks = self.program.chunks
-        chunk_count = struct.pack("<I", len(chunks))
-        self.__write(chunk_count)
+        self.bytes_ += self.U32.pack(len(chunks))
+        self.__write_strings()
+        self.__write_globals()
         for chunk in chunks:
             self.__write_chunk(chunk)
 
-    def get_bytes(self):
+    def get_bytes(self) -> bytes:
         """
         Returns the serialized bytes for the bytecode program.
         """
-        return self.bytes_
+        return bytes(self.bytes_)
@@ -0,0 +1,156 @@
+"""
+This cache module stores the bytecode compiled from uza sources on disk, so
+that running an unchanged source skips parsing, typechecking and compiling.
+
+Entries are keyed by a hash of the source, the compiler version, the files of
+the compiler and the compilation flags. They are written atomically, so that
+concurrent runs never read a partial entry, and the least recently used ones
+are evicted once the cache grows above its maximum size.
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+from typing import Hashable, Optional
+
+import uzac
+
+CACHE_DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+"bytes of bytecode kept in the cache before evicting entries"
+
+CACHE_SUFFIX = ".uzb"
+
+
+def default_cache_dir() -> str:
+    """
+    Returns $UZA_CACHE_DIR, or the uza directory of the user cache directory.
+    """
+    directory = os.environ.get("UZA_CACHE_DIR")
+    if directory:
+        return directory
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "uza")
+
+
+def _compiler_fingerprint() -> bytes:
+    """
+    Returns the names, sizes and modification times of the compiler modules,
+    so that entries compiled before a change to the compiler are not reused
+    when the version stays the same.
+    """
+    package = os.path.dirname(uzac.__file__)
+    fingerprint = []
+    for name in sorted(os.listdir(package)):
+        if name.endswith(".py"):
+            stat = os.stat(os.path.join(package, name))
+            fingerprint.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return ";".join(fingerprint).encode()
+
+
+class CompileCache:
+    """
+    A directory of serialized programs. Reading or writing the cache never
+    fails a run: an unreadable entry is a miss and a failed write is ignored.
+
+        cache = CompileCache()
+        key = cache.key(source, (optimization_level,))
+        code = cache.get(key)
+        if code is None:
+            code = compile(source)
+            cache.put(key, code)
+    """
+
+    directory: str
+    max_size: int
+
+    def __init__(
+        self, directory: Optional[str] = None, max_size: int = CACHE_DEFAULT_MAX_SIZE
+    ) -> None:
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        self.__fingerprint: Optional[bytes] = None
+
+    def key(self, source: str, flags: tuple[Hashable, ...] = ()) -> str:
+        """
+        Returns the key of _source_ compiled with _flags_.
+        """
+        if self.__fingerprint is None:
+            self.__fingerprint = _compiler_fingerprint()
+        digest = hashlib.sha256()
+        digest.update(repr((uzac.__version_tuple__, flags)).encode())
+        digest.update(self.__fingerprint)
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the bytecode stored under _key_, or None. A hit marks the entry
+        as recently used.
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as file:
+                code = file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return code
+
+    def put(self, key: str, code: bytes) -> None:
+        """
+        Stores _code_ under _key_, then evicts the least recently used entries
+        until the cache fits in its maximum size.
+        """
+        import tempfile
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(code)
+                os.replace(temp_path, self.__path(key))
+            except OSError:
+                os.unlink(temp_path)
+                raise
+            self.evict()
+        except OSError:
+            pass
+
+    def entries(self) -> list[tuple[str, int, int]]:
+        """
+        Returns (path, size, last use time) of the entries, least recently
+        used first.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in its
+        maximum size.
+        """
+        entries = self.entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for path, entry_size, _ in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= entry_size
@@ -1,19 +1,15 @@
 import argparse
-from pprint import pprint
 import pathlib
 from sys import stderr, stdin
 import sys  # sys.exit conflict with exit?
 from typing import Sequence
 
 from uzac.driver import Driver
-from uzac.utils import ANSIColor, in_color
+from uzac.utils import OPTIMIZATION_LEVELS, ANSIColor, in_color
 
-from uzac.typer import Typer, TyperDiagnostic
-from uzac.bytecode import ByteCodeProgram, ByteCodeProgramSerializer
-from uzac.parser import Parser
-from uzac.interpreter import Interpreter
-
-from vm.main import run_vm
+from uzac.cache import CompileCache
+from uzac.profiler import PROFILE_DEFAULT_INTERVAL
+from uzac.timings import PipelineTimings
 
 FILE_SUFFIX = ".uzb"
 
@@ -75,6 +71,94 @@ def main(argv: Sequence[str] = None) -> int:
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="show verbose output"
     )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        type=int,
+        choices=OPTIMIZATION_LEVELS,
+        default=OPTIMIZATION_LEVELS[-1],
+        metavar="LEVEL",
+        help="Optimization level of the bytecode compiler, 0 disables all "
+        "optimizations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Maximum call depth of the VM, deeper calls stop the program with "
+        "a stack overflow error (default: 10000)",
+    )
+    parser.add_argument(
+        "--gc-initial-heap",
+        type=int,
+        default=0,
+        metavar="BYTES",
+        help="Heap size of the first full garbage collection (default: 1MiB)",
+    )
+    parser.add_argument(
+        "--gc-growth-factor",
+        type=float,
+        default=0.0,
+        metavar="F",
+        help="Run the next full garbage collection once the heap reaches F "
+        "times the live bytes of the last one, must be above 1 (default: 2.0)",
+    )
+    parser.add_argument(
+        "--gc-stats",
+        action="store_true",
+        help="Print the garbage collections and their pause times after the VM run",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample the call stack of the VM run and print the hottest "
+        "functions and lines",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=int,
+        default=PROFILE_DEFAULT_INTERVAL,
+        metavar="N",
+        help="Instructions run between two samples of --profile (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        metavar="FILE",
+        help="Write the --profile stacks to FILE in the collapsed format of "
+        "flame graph tools instead of stderr",
+    )
+    parser.add_argument(
+        "--op-stats",
+        action="store_true",
+        help="Count the instructions executed by the VM run and print the most "
+        "executed opcodes, opcode pairs and functions",
+    )
+    parser.add_argument(
+        "--op-stats-format",
+        choices=("text", "json"),
+        default="text",
+        help="Print --op-stats as text or json (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the wall time, CPU time and peak memory of each compiler "
+        "phase and of the VM run",
+    )
+    parser.add_argument(
+        "--timings-format",
+        choices=("text", "json"),
+        default="text",
+        help="Print --timings as text or json (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always compile the source instead of running the bytecode cached "
+        "by a previous run, in $UZA_CACHE_DIR (default: ~/.cache/uza)",
+    )
 
     if argv is not None:
         args = parser.parse_args(args=argv)
@@ -82,6 +166,14 @@ def main(argv: Sequence[str] = None) -> int:
         args = parser.parse_args()
 
     verbose = args.verbose
+    if args.max_frames < 0:
+        parser.error("--max-frames must not be negative")
+    if args.gc_initial_heap < 0:
+        parser.error("--gc-initial-heap must not be negative")
+    if args.gc_growth_factor and args.gc_growth_factor <= 1:
+        parser.error("--gc-growth-factor must be above 1")
+    if args.profile_interval <= 0:
+        parser.error("--profile-interval must be positive")
 
     piped_input = None
     # argv is used for testing, do not read stdin then
@@ -160,14 +252,32 @@ def main(argv: Sequence[str] = None) -> int:
 
     skip_tc = True if args.notypechecking else False
 
-    return Driver.run_with_config(
+    timings = PipelineTimings() if args.timings else None
+    res = Driver.run_with_config(
         config,
         source,
         code,
         output_file=out,
         verbose=verbose,
         omit_typechecking=skip_tc,
+        optimization_level=args.optimize,
+        max_frames=args.max_frames,
+        gc_initial_heap=args.gc_initial_heap,
+        gc_growth_factor=args.gc_growth_factor,
+        show_gc_stats=args.gc_stats,
+        profile_interval=args.profile_interval if args.profile else 0,
+        profile_output=args.profile_output,
+        op_stats_format=args.op_stats_format if args.op_stats else None,
+        timings=timings,
+        cache=None if args.no_cache else CompileCache(),
     )
+    if timings is not None:
+        if args.timings_format == "json":
+            print(timings.to_json(), file=sys.stderr)
+        else:
+            print(in_color("### timings ###", ANSIColor.YELLOW), file=sys.stderr)
+            print(timings.table(), end="", file=sys.stderr)
+    return res
 
 
 if __name__ == "__main__":
@@ -1,13 +1,22 @@
+from __future__ import annotations
+from contextlib import AbstractContextManager, nullcontext
 from enum import Enum, auto
+import json
 from pprint import pprint
 import sys
-from uzac.ast import Program
-from uzac.bytecode import ByteCodeProgram, ByteCodeProgramSerializer
-from uzac.interpreter import Interpreter
-from uzac.parser import Parser
-from uzac.typer import Typer, TyperDiagnostic
+from typing import TYPE_CHECKING
+from uzac.profiler import OpStatsReport, ProfileReport
+from uzac.timings import PipelineTimings, count_nodes
 from uzac.utils import ANSIColor, UzaException, in_color
-from vm.main import run_vm, run_vm_code
+
+# the compiler phases and the VM library are imported by the configurations
+# that use them, running cached bytecode imports neither the parser nor the
+# typer and parsing or typechecking does not load the VM
+if TYPE_CHECKING:
+    from uzac.ast import Program
+    from uzac.bytecode import ByteCodeProgramSerializer
+    from uzac.cache import CompileCache
+    from uzac.typer import TyperDiagnostic
 
 
 class Driver:
@@ -26,26 +35,89 @@ class Driver:
         output_file: str | None = None,
         verbose=False,
         omit_typechecking=False,
+        optimization_level=2,
+        max_frames=0,
+        gc_initial_heap=0,
+        gc_growth_factor=0.0,
+        show_gc_stats=False,
+        profile_interval=0,
+        profile_output: str | None = None,
+        op_stats_format: str | None = None,
+        timings: PipelineTimings | None = None,
+        cache: CompileCache | None = None,
         err=sys.stderr,
     ) -> int:
+        """
+        Runs _config_ on the _source_, or runs the _byte_code_ if it is given.
+        The phases are measured in _timings_ if it is given. Runs of the
+        bytecode are compiled once and then loaded from the _cache_ if it is
+        given, unless they are verbose, profiled or counted.
+
+        Returns:
+            int: the return code of the VM, or the number of errors
+        """
         try:
+            cache_key = None
+            if (
+                cache is not None
+                and byte_code is None
+                and config == Driver.Configuration.INTERPRET_BYTECODE
+                and not (verbose or profile_interval or op_stats_format)
+            ):
+                cache_key = cache.key(source, (optimization_level, omit_typechecking))
+                byte_code = cache.get(cache_key)
+
             if byte_code != None:
-                return run_vm_code(byte_code)
+                if profile_interval:
+                    print(
+                        "Error: profiling needs the source to map the samples to",
+                        file=err,
+                    )
+                    return 1
+                from vm.main import op_stats, run_vm_code
+
+                with Driver.__phase(timings, "vm"):
+                    res = run_vm_code(
+                        byte_code,
+                        max_frames,
+                        gc_initial_heap,
+                        gc_growth_factor,
+                        count_ops=op_stats_format is not None,
+                    )
+                if timings is not None:
+                    timings.count("bytecode_bytes", len(byte_code))
+                if show_gc_stats:
+                    Driver.__print_gc_stats(err)
+                if op_stats_format is not None:
+                    report = OpStatsReport(op_stats())
+                    Driver.__print_op_stats(report, op_stats_format, err)
+                return res
 
-            prog = Driver.__parse(source=source, verbose=verbose, err=err)
+            prog = Driver.__parse(
+                source=source, verbose=verbose, timings=timings, err=err
+            )
             if config == Driver.Configuration.PARSE or prog.errors > 0:
                 return prog.errors
 
             if not omit_typechecking:
-                diag = Driver.__typecheck(prog, verbose=verbose, err=err)
+                diag = Driver.__typecheck(
+                    prog, verbose=verbose, timings=timings, err=err
+                )
 
             if config == Driver.Configuration.TYPECHECK or diag.error_count > 0:
                 return diag.error_count
 
             if config == Driver.Configuration.INTERPRET:
-                return Driver.__interpret(prog, verbose=verbose, err=err)
+                with Driver.__phase(timings, "interpret"):
+                    return Driver.__interpret(prog, verbose=verbose, err=err)
 
-            byte_code_serializer = Driver.__compile(prog, verbose=verbose, err=err)
+            from uzac.optimizer import Optimizer
+
+            with Driver.__phase(timings, "optimize"):
+                prog = Optimizer(prog, optimization_level).optimize()
+            byte_code_serializer = Driver.__compile(
+                prog, optimization_level, verbose=verbose, timings=timings, err=err
+            )
             if config == Driver.Configuration.COMPILE:
                 try:
                     assert output_file
@@ -58,7 +130,31 @@ class Driver:
                 return 0
 
             if config == Driver.Configuration.INTERPRET_BYTECODE:
-                return Driver.__interpret_bytecode(byte_code_serializer)
+                if cache_key is not None:
+                    cache.put(cache_key, byte_code_serializer.get_bytes())
+                from vm.main import op_stats, profile_stacks, run_vm
+
+                with Driver.__phase(timings, "vm"):
+                    res = run_vm(
+                        byte_code_serializer,
+                        max_frames,
+                        gc_initial_heap,
+                        gc_growth_factor,
+                        profile_interval,
+                        count_ops=op_stats_format is not None,
+                    )
+                if show_gc_stats:
+                    Driver.__print_gc_stats(err)
+                if op_stats_format is not None:
+                    report = OpStatsReport(op_stats(), byte_code_serializer.program)
+                    Driver.__print_op_stats(report, op_stats_format, err)
+                if profile_interval:
+                    report = ProfileReport(
+                        byte_code_serializer.program, profile_stacks(), profile_interval
+                    )
+                    if not Driver.__print_profile(report, profile_output, err):
+                        return 1
+                return res
 
         except UzaException as e:
             print(e.get_error_message(), file=err)
@@ -66,8 +162,21 @@ class Driver:
         return 1
 
     @staticmethod
-    def __parse(source, verbose=False, err=sys.stderr) -> Program:
-        program = Parser(source).parse()
+    def __phase(timings: PipelineTimings | None, name: str) -> AbstractContextManager:
+        if timings is None:
+            return nullcontext()
+        return timings.phase(name)
+
+    @staticmethod
+    def __parse(source, verbose=False, timings=None, err=sys.stderr) -> Program:
+        from uzac.parser import Parser
+
+        with Driver.__phase(timings, "parse"):
+            parser = Parser(source)
+            program = parser.parse()
+        if timings is not None:
+            timings.count("tokens", parser.token_count)
+            timings.count("ast_nodes", count_nodes(program.syntax_tree))
         if verbose:
             print(in_color("\n### ast ###\n", ANSIColor.YELLOW), file=err)
             for _, node in enumerate(program.syntax_tree.lines):
@@ -82,8 +191,17 @@ class Driver:
         return program
 
     @staticmethod
-    def __typecheck(program: Program, verbose=False, err=sys.stderr) -> TyperDiagnostic:
-        typer_res: TyperDiagnostic = Typer(program).typecheck_program()
+    def __typecheck(
+        program: Program, verbose=False, timings=None, err=sys.stderr
+    ) -> TyperDiagnostic:
+        from uzac.typer import Typer
+
+        with Driver.__phase(timings, "typecheck"):
+            typer = Typer(program)
+            typer_res: TyperDiagnostic = typer.typecheck_program()
+        if timings is not None:
+            timings.count("constraints", len(typer.constaints))
+            timings.count("substitutions", typer_res.substitution.binding_count())
         if verbose:
             print(in_color("\n### inferred types ###", ANSIColor.YELLOW), file=err)
 
@@ -97,6 +215,8 @@ class Driver:
 
     @staticmethod
     def __interpret(program: Program, verbose=False, err=sys.stderr) -> int:
+        from uzac.interpreter import Interpreter
+
         out = Interpreter(program).evaluate()
         if out and isinstance(out, int):
             return out
@@ -104,9 +224,31 @@ class Driver:
 
     @staticmethod
     def __compile(
-        program: Program, verbose=False, err=sys.stderr
+        program: Program,
+        optimization_level: int,
+        verbose=False,
+        timings=None,
+        err=sys.stderr,
     ) -> ByteCodeProgramSerializer:
-        serializer = ByteCodeProgramSerializer(ByteCodeProgram(program))
+        from uzac.bytecode import ByteCodeProgram, ByteCodeProgramSerializer
+        from uzac.peephole import PeepholeOptimizer
+
+        with Driver.__phase(timings, "compile"):
+            byte_code = ByteCodeProgram(program)
+        if optimization_level >= 2:
+            with Driver.__phase(timings, "peephole"):
+                peephole = PeepholeOptimizer(byte_code)
+                peephole.optimize()
+            if verbose:
+                print(in_color("### peephole passes ###", ANSIColor.YELLOW), file=err)
+                for name, stats in peephole.stats.items():
+                    print(f"{name}: {stats}", file=err)
+        with Driver.__phase(timings, "serialize"):
+            serializer = ByteCodeProgramSerializer(byte_code)
+        if timings is not None:
+            timings.count("chunks", len(byte_code.chunks))
+            timings.count("ops", sum(len(chunk.code) for chunk in byte_code.chunks))
+            timings.count("bytecode_bytes", len(serializer.get_bytes()))
         if verbose:
             print(in_color("### generated constants ###)", ANSIColor.YELLOW), file=err)
             for chunk in serializer.program.chunks:
@@ -120,5 +262,38 @@ class Driver:
         return serializer
 
     @staticmethod
-    def __interpret_bytecode(program: ByteCodeProgramSerializer) -> int:
-        return run_vm(program)
+    def __print_profile(
+        report: ProfileReport, output_file: str | None, err=sys.stderr
+    ) -> bool:
+        """
+        Writes the collapsed stacks of _report_ to _output_file_, or _err_ if
+        it is None, and prints the hottest functions and lines on _err_.
+        """
+        if output_file:
+            try:
+                with open(output_file, "w", encoding="ascii") as file:
+                    file.write(report.collapsed())
+            except OSError as e:
+                print(f"Error: {e.strerror}", file=err)
+                return False
+        else:
+            print(in_color("### collapsed stacks ###", ANSIColor.YELLOW), file=err)
+            print(report.collapsed(), end="", file=err)
+        print(in_color("### profile ###", ANSIColor.YELLOW), file=err)
+        print(report.table(), end="", file=err)
+        return True
+
+    @staticmethod
+    def __print_op_stats(report: OpStatsReport, format: str, err=sys.stderr) -> None:
+        if format == "json":
+            print(json.dumps(report.to_dict(), indent=2), file=err)
+            return
+        print(in_color("### op stats ###", ANSIColor.YELLOW), file=err)
+        print(report.table(), end="", file=err)
+
+    @staticmethod
+    def __print_gc_stats(err=sys.stderr) -> None:
+        from vm.main import gc_stats
+
+        print(in_color("### gc stats ###", ANSIColor.YELLOW), file=err)
+        print(gc_stats(), file=err)
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import math
+import operator
+import re
+from typing import Optional
+
+from uzac.ast import (
+    Application,
+    Block,
+    Break,
+    Continue,
+    ExpressionList,
+    ForLoop,
+    Function,
+    Identifier,
+    IfElse,
+    InfixApplication,
+    Literal,
+    MethodApplication,
+    NoOp,
+    Node,
+    PrefixApplication,
+    Program,
+    Range,
+    Return,
+    UzaASTVisitor,
+    VarDef,
+    VarRedef,
+    WhileLoop,
+)
+from uzac.builtins import (
+    bi_add,
+    bi_and,
+    bi_div,
+    bi_eq,
+    bi_ge,
+    bi_gt,
+    bi_le,
+    bi_lt,
+    bi_mod,
+    bi_mul,
+    bi_ne,
+    bi_not,
+    bi_or,
+    bi_sub,
+    bi_to_float,
+    bi_to_int,
+    bi_to_string,
+    get_builtin,
+)
+from uzac.type import type_float, type_int
+from uzac.utils import OPTIMIZATION_LEVELS
+
+
+INT_MIN = -(2**63)
+INT_MAX = 2**63 - 1
+
+# strings that strtod and atoll (used by the VM) parse like Python does
+_FLOAT_STRING = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+_INT_STRING = re.compile(r"[+-]?\d+")
+
+_COMPARISONS = {
+    bi_lt.identifier: operator.lt,
+    bi_le.identifier: operator.le,
+    bi_gt.identifier: operator.gt,
+    bi_ge.identifier: operator.ge,
+}
+
+
+def _is_number(value) -> bool:
+    return type(value) in (int, float)
+
+
+def _c_int_div(lhs: int, rhs: int) -> int:
+    """
+    Integer division truncated towards zero, like C.
+    """
+    quotient = abs(lhs) // abs(rhs)
+    return quotient if (lhs < 0) == (rhs < 0) else -quotient
+
+
+class Optimizer(UzaASTVisitor):
+    """
+    Rewrites the typechecked AST before the bytecode is emitted.
+
+    Each visit returns the node that replaces the visited node, which is
+    usually the node itself with its children rewritten. Literal arithmetic,
+    comparisons, string concatenations and conversions are folded to a
+    Literal with the span of the folded expression. Constant folding follows
+    the VM semantics (truncated int division, 64 bit ints, "%f" float
+    strings) and leaves anything it cannot compute exactly, such as a
+    division by zero, to the runtime.
+    """
+
+    program: Program
+    level: int
+
+    def __init__(self, program: Program, level: int = 1) -> None:
+        if level not in OPTIMIZATION_LEVELS:
+            raise ValueError(f"unknown optimization level {level}")
+        self.program = program
+        self.level = level
+
+    def optimize(self) -> Program:
+        """
+        Optimizes the program in place and returns it.
+        """
+        if self.level > 0:
+            self.program.syntax_tree = self.program.syntax_tree.visit(self)
+        return self.program
+
+    def __visit_maybe(self, node: Optional[Node]) -> Optional[Node]:
+        if node is None:
+            return None
+        return node.visit(self)
+
+    @staticmethod
+    def __replace(node: Node, replacement: Node) -> Node:
+        """
+        Returns the _replacement_ for _node_ while keeping its unused value
+        popped. Literals and identifiers have no side effects so an unused one
+        is dropped.
+        """
+        if not getattr(node, "pop_value", False):
+            return replacement
+        if hasattr(replacement, "pop_value"):
+            replacement.pop_value = True
+            return replacement
+        return NoOp(node.span)
+
+    def __fold(self, node: Node, value) -> Node:
+        if type(value) is int and not INT_MIN <= value <= INT_MAX:
+            return node
+        return self.__replace(node, Literal.from_value(value, node.span))
+
+    def visit_no_op(self, no_op: NoOp):
+        return no_op
+
+    def visit_literal(self, literal: Literal):
+        return literal
+
+    def visit_identifier(self, identifier: Identifier):
+        return identifier
+
+    def visit_break(self, that: Break):
+        return that
+
+    def visit_continue(self, that: Continue):
+        return that
+
+    def visit_return(self, ret: Return):
+        ret.value = ret.value.visit(self)
+        return ret
+
+    def visit_function(self, func: Function):
+        func.body = func.body.visit(self)
+        return func
+
+    def visit_var_def(self, var_def: VarDef):
+        var_def.value = var_def.value.visit(self)
+        return var_def
+
+    def visit_var_redef(self, redef: VarRedef):
+        redef.value = redef.value.visit(self)
+        return redef
+
+    def visit_expression_list(self, expr_list: ExpressionList):
+        expr_list.lines = [line.visit(self) for line in expr_list.lines]
+        return expr_list
+
+    def visit_block(self, scope: Block):
+        scope.lines = [line.visit(self) for line in scope.lines]
+        return scope
+
+    def visit_while_loop(self, wl: WhileLoop):
+        wl.cond = wl.cond.visit(self)
+        wl.loop = wl.loop.visit(self)
+        return wl
+
+    def visit_for_loop(self, fl: ForLoop):
+        fl.init = self.__visit_maybe(fl.init)
+        fl.cond = self.__visit_maybe(fl.cond)
+        fl.incr = self.__visit_maybe(fl.incr)
+        fl.interior = fl.interior.visit(self)
+        return fl
+
+    def visit_range(self, range: Range):
+        range.node = range.node.visit(self)
+        range.start = self.__visit_maybe(range.start)
+        range.end = self.__visit_maybe(range.end)
+        return range
+
+    def visit_if_else(self, if_else: IfElse):
+        if_else.predicate = if_else.predicate.visit(self)
+        if_else.truthy_case = if_else.truthy_case.visit(self)
+        if_else.falsy_case = self.__visit_maybe(if_else.falsy_case)
+
+        predicate = if_else.predicate
+        if not isinstance(predicate, Literal) or type(predicate.value) is not bool:
+            return if_else
+        taken = if_else.truthy_case if predicate.value else if_else.falsy_case
+        if taken is None:
+            return NoOp(if_else.span)
+        if isinstance(taken, VarDef):
+            # a single definition after `then` is scoped to the if statement
+            return if_else
+        return taken
+
+    def visit_method_app(self, method: MethodApplication):
+        folded = method.method.visit(self)
+        if folded is not method.method:
+            return self.__replace(method, folded)
+        method.accessed = method.method.args[0]
+        return method
+
+    def visit_application(self, app: Application):
+        app.args = [arg.visit(self) for arg in app.args]
+        if len(app.args) != 1 or not isinstance(app.args[0], Literal):
+            return app
+
+        value = app.args[0].value
+        builtin = get_builtin(app.func_id)
+        if builtin == bi_to_string:
+            if type(value) is str or type(value) is int:
+                return self.__fold(app, str(value))
+            if type(value) is float and math.isfinite(value):
+                return self.__fold(app, f"{value:f}")
+        elif builtin == bi_to_float:
+            if _is_number(value):
+                return self.__fold(app, float(value))
+            if type(value) is str and _FLOAT_STRING.fullmatch(value):
+                folded = float(value)
+                if math.isfinite(folded):
+                    return self.__fold(app, folded)
+        elif builtin == bi_to_int:
+            if type(value) is int:
+                return self.__fold(app, value)
+            if type(value) is float and math.isfinite(value):
+                return self.__fold(app, int(value))
+            if type(value) is str and _INT_STRING.fullmatch(value):
+                return self.__fold(app, int(value))
+        return app
+
+    def visit_prefix_application(self, prefix: PrefixApplication):
+        prefix.expr = prefix.expr.visit(self)
+        expr = prefix.expr
+        builtin = get_builtin(prefix.func_id)
+        if builtin == bi_not:
+            if isinstance(expr, Literal) and type(expr.value) is bool:
+                return self.__fold(prefix, not expr.value)
+            if (
+                isinstance(expr, PrefixApplication)
+                and get_builtin(expr.func_id) == bi_not
+            ):
+                return self.__replace(prefix, expr.expr)
+        elif builtin == bi_sub:
+            if isinstance(expr, Literal) and _is_number(expr.value):
+                return self.__fold(prefix, -expr.value)
+        return prefix
+
+    def visit_infix_application(self, infix: InfixApplication):
+        infix.lhs = infix.lhs.visit(self)
+        infix.rhs = infix.rhs.visit(self)
+        builtin = get_builtin(infix.func_id)
+        lhs, rhs = infix.lhs, infix.rhs
+        if isinstance(lhs, Literal) and isinstance(rhs, Literal):
+            value = self.__fold_values(builtin, lhs.value, rhs.value)
+            if value is not None:
+                return self.__fold(infix, value)
+            return infix
+        return self.__simplify(infix, builtin)
+
+    @staticmethod
+    def __fold_values(builtin, lhs, rhs):
+        """
+        Returns the value of _builtin_ applied to the literals, or None if it
+        is left to the runtime.
+        """
+        if builtin in (bi_and, bi_or):
+            if type(lhs) is bool and type(rhs) is bool:
+                return (lhs and rhs) if builtin == bi_and else (lhs or rhs)
+            return None
+        if builtin in (bi_eq, bi_ne):
+            if type(lhs) is not type(rhs) or lhs is None:
+                return None
+            return (lhs == rhs) == (builtin == bi_eq)
+        if builtin == bi_add and type(lhs) is str and type(rhs) is str:
+            return lhs + rhs
+        if not _is_number(lhs) or not _is_number(rhs):
+            return None
+
+        if type(lhs) is int and type(rhs) is int:
+            if builtin == bi_add:
+                return lhs + rhs
+            if builtin == bi_sub:
+                return lhs - rhs
+            if builtin == bi_mul:
+                return lhs * rhs
+            if builtin == bi_div and rhs != 0:
+                return _c_int_div(lhs, rhs)
+            if builtin == bi_mod and rhs != 0:
+                return lhs - rhs * _c_int_div(lhs, rhs)
+            if builtin.identifier in _COMPARISONS:
+                return _COMPARISONS[builtin.identifier](lhs, rhs)
+            return None
+
+        # mixed operands are converted with ITOF
+        lhs, rhs = float(lhs), float(rhs)
+        if builtin == bi_add:
+            return lhs + rhs
+        if builtin == bi_sub:
+            return lhs - rhs
+        if builtin == bi_mul:
+            return lhs * rhs
+        if builtin == bi_div and rhs != 0.0:
+            return lhs / rhs
+        if builtin.identifier in _COMPARISONS:
+            return _COMPARISONS[builtin.identifier](lhs, rhs)
+        return None
+
+    def __simplify(self, infix: InfixApplication, builtin) -> Node:
+        """
+        Simplifies `x * 1`, `1 * x` and, for ints, `x + 0` and `0 + x`. The
+        result must have the type of x, an int multiplied by 1.0 is a float.
+        Float `x + 0` is kept since `-0.0 + 0` is `0.0`.
+        """
+        arg_types = infix.arg_types
+        if arg_types is None:
+            return infix
+        result_type = type_float if type_float in arg_types else type_int
+        for operand, other, other_type in (
+            (infix.lhs, infix.rhs, arg_types[1]),
+            (infix.rhs, infix.lhs, arg_types[0]),
+        ):
+            if not isinstance(operand, Literal) or not _is_number(operand.value):
+                continue
+            if other_type != result_type:
+                continue
+            if builtin == bi_mul and operand.value == 1:
+                return self.__replace(infix, other)
+            if builtin == bi_add and operand.value == 0 and result_type == type_int:
+                return self.__replace(infix, other)
+        return infix
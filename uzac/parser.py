@@ -263,8 +263,12 @@ class Parser:
     A parser parses it source code into a uza `Program`.
     """
 
+    token_count: int
+    "number of tokens scanned from the source"
+
     def __init__(self, source: str):
         self.__tokens = deque(Scanner(source))  # TODO: use the iter directly
+        self.token_count = len(self.__tokens)
         self.__source = source
         self.__errors = 0
 
@@ -0,0 +1,384 @@
+"""
+This peephole module rewrites the bytecode of each chunk before it is
+serialized.
+
+The passes work on op indices: the jumps are resolved to the index of the op
+they land on, the passes rewrite the code and the targets together, and the
+jump offsets are recomputed once all passes are done.
+"""
+
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable
+
+from uzac.bytecode import OPCODE, ByteCodeProgram, Chunk, Op
+
+CONDITIONAL_JUMPS = (OPCODE.JUMP_IF_FALSE, OPCODE.JUMP_IF_TRUE)
+UNCONDITIONAL_JUMPS = (OPCODE.JUMP, OPCODE.LOOP)
+"OPCODE.JUMP and OPCODE.LOOP are turned into each other by the jump direction"
+NO_FALLTHROUGH = (
+    OPCODE.RETURN,
+    OPCODE.TAIL_CALL_DIRECT,
+    OPCODE.EXITVM,
+) + UNCONDITIONAL_JUMPS
+PURE_PUSHES = (
+    OPCODE.LNIL,
+    OPCODE.LCONST,
+    OPCODE.DCONST,
+    OPCODE.STRCONST,
+    OPCODE.BOOLTRUE,
+    OPCODE.BOOLFALSE,
+    OPCODE.GETLOCAL,
+    OPCODE.GETGLOBAL,
+)
+LOCALS_OPCODES = {
+    OPCODE.IADD: OPCODE.IADD_LOCALS,
+    OPCODE.ISUB: OPCODE.ISUB_LOCALS,
+    OPCODE.IMUL: OPCODE.IMUL_LOCALS,
+    OPCODE.FADD: OPCODE.FADD_LOCALS,
+    OPCODE.FSUB: OPCODE.FSUB_LOCALS,
+    OPCODE.FMUL: OPCODE.FMUL_LOCALS,
+}
+"GETLOCAL a, GETLOCAL b, <op> superinstructions"
+COMPARE_JUMP_OPCODES = {
+    OPCODE.IEQ: OPCODE.JUMP_UNLESS_IEQ,
+    OPCODE.INE: OPCODE.JUMP_UNLESS_INE,
+    OPCODE.ILT: OPCODE.JUMP_UNLESS_ILT,
+    OPCODE.ILE: OPCODE.JUMP_UNLESS_ILE,
+    OPCODE.IGT: OPCODE.JUMP_UNLESS_IGT,
+    OPCODE.IGE: OPCODE.JUMP_UNLESS_IGE,
+}
+"GETLOCAL a, LCONST k, <op>, JUMP_IF_FALSE superinstructions"
+NEGATED_JUMPS = {
+    OPCODE.JUMP_IF_FALSE: OPCODE.JUMP_IF_TRUE,
+    OPCODE.JUMP_IF_TRUE: OPCODE.JUMP_IF_FALSE,
+}
+
+
+@dataclass
+class PassStats:
+    ops_removed: int = field(default=0)
+    bytes_saved: int = field(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.ops_removed} ops removed, {self.bytes_saved} bytes saved"
+
+
+class _ChunkCode:
+    """
+    The code of a chunk with its jumps resolved to op indices.
+    """
+
+    chunk: Chunk
+    code: list[Op]
+    targets: dict[int, int]
+
+    def __init__(self, chunk: Chunk) -> None:
+        self.chunk = chunk
+        self.code = list(chunk.code)
+        self.targets = chunk.jump_targets()
+
+    def jump_target_set(self) -> set[int]:
+        return set(self.targets.values())
+
+    def final_target(self, idx: int) -> int:
+        """
+        Returns where a jump to _idx_ ends up once the chain of unconditional
+        jumps starting at _idx_ is followed.
+        """
+        seen = set()
+        while (
+            idx < len(self.code)
+            and self.code[idx].code in UNCONDITIONAL_JUMPS
+            and idx not in seen
+        ):
+            seen.add(idx)
+            idx = self.targets[idx]
+        return idx
+
+    def remove(self, removed: set[int], stats: PassStats) -> None:
+        """
+        Removes the ops at the _removed_ indices. The jumps to a removed op
+        land on the next op that is kept.
+        """
+        if not removed:
+            return
+        new_index = []
+        kept = 0
+        for idx in range(len(self.code) + 1):
+            new_index.append(kept)
+            if idx not in removed:
+                kept += 1
+
+        for idx in removed:
+            stats.ops_removed += 1
+            stats.bytes_saved += self.code[idx].size
+        self.targets = {
+            new_index[jump]: new_index[target]
+            for jump, target in self.targets.items()
+            if jump not in removed
+        }
+        self.code = [op for idx, op in enumerate(self.code) if idx not in removed]
+
+    def write_back(self) -> None:
+        """
+        Writes the code to the chunk and recomputes the jump offsets.
+        """
+        for idx, target in self.targets.items():
+            op = self.code[idx]
+            if op.code in UNCONDITIONAL_JUMPS:
+                op.code = OPCODE.LOOP if target <= idx else OPCODE.JUMP
+            # widening is sticky, the offsets may have shrunk
+            op.jump_offset = 0
+            op.wide = False
+            op.update_size()
+        self.chunk.code = self.code
+        self.chunk.retarget_jumps(self.targets)
+
+
+class PeepholeOptimizer:
+    """
+    Rewrites the bytecode of a ByteCodeProgram in place.
+
+    The passes are run in order until none of them changes the code:
+    - jump threading: a jump to an unconditional jump lands on the final
+      target, a jump to the next op is removed
+    - push/pop removal: a constant or variable push directly popped is removed
+    - NOT + JUMP_IF_FALSE is turned into JUMP_IF_TRUE (and vice versa) when
+      both paths discard the condition
+    - dead code after returns, EXITVM and unconditional jumps is removed up to
+      the next jump target
+
+    The hottest sequences are then fused into superinstructions, see
+    `LOCALS_OPCODES`, `COMPARE_JUMP_OPCODES` and OPCODE.INCLOCAL.
+
+    Conditional jumps are only threaded forward since the VM only has a
+    forward encoding for them.
+    """
+
+    program: ByteCodeProgram
+    stats: dict[str, PassStats]
+    "The statistics of each pass, summed over all chunks and iterations"
+
+    def __init__(self, program: ByteCodeProgram) -> None:
+        self.program = program
+        self.stats = {name: PassStats() for name in self.__passes()}
+        self.stats["superinstructions"] = PassStats()
+
+    def __passes(self) -> dict[str, Callable[[_ChunkCode, PassStats], bool]]:
+        return {
+            "jump threading": self.__thread_jumps,
+            "push/pop removal": self.__remove_push_pop,
+            "negated jumps": self.__negate_jumps,
+            "dead code": self.__remove_dead_code,
+        }
+
+    def optimize(self) -> ByteCodeProgram:
+        """
+        Optimizes the chunks in place and returns the program.
+        """
+        passes = self.__passes()
+        for chunk in self.program.chunks:
+            code = _ChunkCode(chunk)
+            changed = True
+            while changed:
+                changed = False
+                for name, run_pass in passes.items():
+                    if run_pass(code, self.stats[name]):
+                        changed = True
+            self.__select_superinstructions(code, self.stats["superinstructions"])
+            code.write_back()
+        return self.program
+
+    @staticmethod
+    def __thread_jumps(code: _ChunkCode, stats: PassStats) -> bool:
+        changed = False
+        for idx, target in code.targets.items():
+            final = code.final_target(target)
+            if final == target:
+                continue
+            if code.code[idx].code in CONDITIONAL_JUMPS and final <= idx:
+                continue
+            code.targets[idx] = final
+            changed = True
+
+        removed = {idx for idx, target in code.targets.items() if target == idx + 1}
+        code.remove(removed, stats)
+        return changed or bool(removed)
+
+    @staticmethod
+    def __remove_push_pop(code: _ChunkCode, stats: PassStats) -> bool:
+        landed_on = code.jump_target_set()
+        removed = set()
+        for idx in range(len(code.code) - 1):
+            if idx in removed or idx + 1 in landed_on:
+                continue
+            if (
+                code.code[idx].code in PURE_PUSHES
+                and code.code[idx + 1].code == OPCODE.POP
+            ):
+                removed.update((idx, idx + 1))
+        code.remove(removed, stats)
+        return bool(removed)
+
+    @staticmethod
+    def __condition_is_popped(code: _ChunkCode, jump_idx: int) -> bool:
+        """
+        Returns whether the condition kept on the stack by the conditional jump
+        is popped right away on both paths, as for if statements and loops.
+        `and` and `or` keep it as their value.
+        """
+        target = code.targets[jump_idx]
+        return (
+            code.code[jump_idx + 1].code == OPCODE.POP
+            and target < len(code.code)
+            and code.code[target].code == OPCODE.POP
+        )
+
+    @staticmethod
+    def __negate_jumps(code: _ChunkCode, stats: PassStats) -> bool:
+        """
+        Jumps to the NOT land on the negated jump, which is equivalent.
+        """
+        landed_on = code.jump_target_set()
+        removed = set()
+        for idx in range(len(code.code) - 2):
+            jump_idx = idx + 1
+            jump = code.code[jump_idx]
+            if (
+                code.code[idx].code != OPCODE.NOT
+                or jump.code not in CONDITIONAL_JUMPS
+                or jump_idx in landed_on
+                or not PeepholeOptimizer.__condition_is_popped(code, jump_idx)
+            ):
+                continue
+            jump.code = NEGATED_JUMPS[jump.code]
+            removed.add(idx)
+        code.remove(removed, stats)
+        return bool(removed)
+
+    @staticmethod
+    def __remove_dead_code(code: _ChunkCode, stats: PassStats) -> bool:
+        landed_on = code.jump_target_set()
+        removed = set()
+        reachable = True
+        for idx, op in enumerate(code.code):
+            if idx in landed_on:
+                reachable = True
+            if not reachable:
+                removed.add(idx)
+            elif op.code in NO_FALLTHROUGH:
+                reachable = False
+        code.remove(removed, stats)
+        return bool(removed)
+
+    @staticmethod
+    def __select_superinstructions(code: _ChunkCode, stats: PassStats) -> bool:
+        """
+        Fuses the ops of the hottest sequences. Only the first op of a
+        sequence may be a jump target, jumps to it land on the superinstruction.
+
+        The compare and branch superinstructions do not push the condition, so
+        the pops of the condition on both paths are removed as well. The pop at
+        the jump target must only be reachable by the jump.
+        """
+        ops = code.code
+        landed_on = Counter(code.targets.values())
+        removed = set()
+
+        def lands_inside(start: int, end: int) -> bool:
+            return any(idx in landed_on for idx in range(start, end))
+
+        idx = 0
+        while idx < len(ops):
+            if idx in removed or ops[idx].code != OPCODE.GETLOCAL:
+                idx += 1
+                continue
+            local = ops[idx].local_index
+            codes = [op.code for op in ops[idx + 1 : idx + 5]]
+            fused, consumed = None, 0
+            if (
+                codes[:3] == [OPCODE.LCONST, OPCODE.IADD, OPCODE.SETLOCAL]
+                and ops[idx + 3].local_index == local
+                and not lands_inside(idx + 1, idx + 4)
+            ):
+                fused = Op(
+                    OPCODE.INCLOCAL,
+                    ops[idx + 2].span,
+                    local_index=local,
+                    constant_index=ops[idx + 1].constant_index,
+                )
+                consumed = 4
+            elif (
+                len(codes) == 4
+                and codes[0] == OPCODE.LCONST
+                and codes[1] in COMPARE_JUMP_OPCODES
+                and codes[2:] == [OPCODE.JUMP_IF_FALSE, OPCODE.POP]
+                and not lands_inside(idx + 1, idx + 5)
+            ):
+                target = code.targets[idx + 3]
+                if (
+                    target > idx + 4
+                    and target < len(ops)
+                    and ops[target].code == OPCODE.POP
+                    and landed_on[target] == 1
+                    and ops[target - 1].code in NO_FALLTHROUGH
+                ):
+                    fused = Op(
+                        COMPARE_JUMP_OPCODES[codes[1]],
+                        ops[idx + 2].span,
+                        local_index=local,
+                        constant_index=ops[idx + 1].constant_index,
+                        jump_offset=0,
+                    )
+                    consumed = 5
+                    code.targets[idx] = code.targets.pop(idx + 3)
+                    removed.add(target)
+            elif (
+                len(codes) >= 2
+                and codes[0] == OPCODE.GETLOCAL
+                and codes[1] in LOCALS_OPCODES
+                and not lands_inside(idx + 1, idx + 3)
+            ):
+                fused = Op(
+                    LOCALS_OPCODES[codes[1]],
+                    ops[idx + 2].span,
+                    local_index=local,
+                    second_local_index=ops[idx + 1].local_index,
+                )
+                consumed = 3
+
+            if fused is None:
+                idx += 1
+                continue
+            stats.bytes_saved += ops[idx].size - fused.size
+            ops[idx] = fused
+            removed.update(range(idx + 1, idx + consumed))
+            idx += consumed
+        code.remove(removed, stats)
+        return bool(removed)
+
+
+def opcode_pairs(program: ByteCodeProgram, loop_weight: int = 10) -> Counter:
+    """
+    Returns how often each pair of consecutive opcodes appears in the program.
+
+    A pair inside a loop counts _loop_weight_ times more than the same pair
+    outside of it, for each level of nesting, as an estimate of how often it
+    is executed. Pairs are not counted across ops that do not fall through.
+    """
+    pairs = Counter()
+    for chunk in program.chunks:
+        code = chunk.code
+        depth = [0] * len(code)
+        for jump, target in chunk.jump_targets().items():
+            if code[jump].code == OPCODE.LOOP:
+                for idx in range(target, jump + 1):
+                    depth[idx] += 1
+        for idx in range(len(code) - 1):
+            if code[idx].code in NO_FALLTHROUGH:
+                continue
+            pair = (code[idx].code, code[idx + 1].code)
+            pairs[pair] += loop_weight ** min(depth[idx], depth[idx + 1])
+    return pairs
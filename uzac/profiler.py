@@ -0,0 +1,209 @@
+"""
+This profiler module maps the frame stacks sampled by a profiled VM run back to
+the functions and source lines of the program, and reports the instructions
+executed by a counted run.
+
+The VM records the chunk index and the code offset of the running instruction
+of each frame. The offset is resolved to the op it falls in, and the op to the
+start of its span, which is what the chunk lines table of the VM stores.
+"""
+
+from __future__ import annotations
+from bisect import bisect_right
+from collections import Counter
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from uzac.bytecode import OPCODE, ByteCodeProgram
+    from vm.main import OpStats
+
+PROFILE_DEFAULT_INTERVAL = 1000
+"instructions between two samples of the frame stack"
+
+
+class ProfileReport:
+    """
+    Sampled frame stacks of a run, as collapsed stacks for flame graphs and as
+    tables of the hottest functions and lines.
+
+    A frame is named after its function and the line it runs, `fib:3`. The
+    self samples of a function or a line are the ones where it was running,
+    the total samples the ones where it was on the stack.
+    """
+
+    program: ByteCodeProgram
+    interval: int
+    stacks: list[tuple[tuple[str, int], ...]]
+
+    def __init__(
+        self,
+        program: ByteCodeProgram,
+        stacks: list[tuple[tuple[int, int], ...]],
+        interval: int = PROFILE_DEFAULT_INTERVAL,
+    ) -> None:
+        self.program = program
+        self.interval = interval
+        self.__op_offsets = [self.__offsets(chunk) for chunk in program.chunks]
+        self.__lines: dict[tuple[int, int], int] = {}
+        self.__source = ""
+        self.stacks = [
+            tuple(self.__frame(chunk, offset) for chunk, offset in stack)
+            for stack in stacks
+        ]
+
+    @staticmethod
+    def __offsets(chunk) -> list[int]:
+        offsets = []
+        offset = 0
+        for op in chunk.code:
+            offsets.append(offset)
+            offset += op.size
+        return offsets
+
+    def __frame(self, chunk_idx: int, offset: int) -> tuple[str, int]:
+        """
+        Returns the function name and the source line of the instruction at
+        _offset_ in the chunk _chunk_idx_.
+        """
+        chunk = self.program.chunks[chunk_idx]
+        op_idx = bisect_right(self.__op_offsets[chunk_idx], offset) - 1
+        line = self.__lines.get((chunk_idx, op_idx))
+        if line is None:
+            span = chunk.code[op_idx].span
+            self.__source = span.source
+            line = span.source.count("\n", 0, span.start) + 1
+            self.__lines[(chunk_idx, op_idx)] = line
+        return chunk.name, line
+
+    def collapsed(self) -> str:
+        """
+        Returns the stacks in the collapsed format of flamegraph.pl, one line
+        per distinct stack with its number of samples.
+        """
+        counts = Counter(
+            ";".join(f"{name}:{line}" for name, line in stack) for stack in self.stacks
+        )
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+    def hot_functions(self) -> list[tuple[str, int, int]]:
+        """
+        Returns (name, self samples, total samples) of the sampled functions,
+        hottest first.
+        """
+        self_counts = Counter(stack[-1][0] for stack in self.stacks if stack)
+        total_counts = Counter(
+            name for stack in self.stacks for name in {name for name, _ in stack}
+        )
+        rows = [
+            (name, self_counts[name], total) for name, total in total_counts.items()
+        ]
+        return sorted(rows, key=lambda row: (-row[1], -row[2], row[0]))
+
+    def hot_lines(self) -> list[tuple[int, str, int]]:
+        """
+        Returns (line, function name, self samples) of the sampled lines,
+        hottest first.
+        """
+        counts = Counter(stack[-1] for stack in self.stacks if stack)
+        return sorted(
+            ((line, name, count) for (name, line), count in counts.items()),
+            key=lambda row: (-row[2], row[0]),
+        )
+
+    def table(self, top: int = 10) -> str:
+        """
+        Returns the _top_ hottest functions and lines as text tables.
+        """
+        total = len(self.stacks)
+        if total == 0:
+            return "no samples, the run is shorter than the sampling interval\n"
+        source_lines = self.__source.splitlines()
+
+        def percent(count: int) -> str:
+            return f"{100 * count / total:6.1f}%"
+
+        out = f"{total} samples, one every {self.interval} instructions\n"
+        out += f"\n{'self':>7} {'total':>7}  function\n"
+        for name, self_count, total_count in self.hot_functions()[:top]:
+            out += f"{percent(self_count)} {percent(total_count)}  {name}\n"
+        out += f"\n{'self':>7} {'line':>7}  source\n"
+        for line, name, count in self.hot_lines()[:top]:
+            source = source_lines[line - 1].strip()
+            out += f"{percent(count)} {line:>7}  {source}  ({name})\n"
+        return out
+
+
+class OpStatsReport:
+    """
+    Instructions executed by a counted run: the executions of each opcode, of
+    each pair of opcodes executed one after the other and the instructions
+    executed in each function. Without the _program_ of the run, functions
+    are named after their chunk index.
+    """
+
+    ops: list[tuple[OPCODE, int]]
+    pairs: list[tuple[OPCODE, OPCODE, int]]
+    functions: list[tuple[str, int]]
+
+    def __init__(self, stats: OpStats, program: Optional[ByteCodeProgram] = None):
+        from uzac.bytecode import OPCODE
+
+        self.ops = sorted(
+            ((OPCODE(op), count) for op, count in stats.ops().items()),
+            key=lambda row: (-row[1], row[0].name),
+        )
+        self.pairs = sorted(
+            (
+                (OPCODE(first), OPCODE(second), count)
+                for (first, second), count in stats.pairs().items()
+            ),
+            key=lambda row: (-row[2], row[0].name, row[1].name),
+        )
+        if program is not None:
+            names = [chunk.name for chunk in program.chunks]
+        else:
+            names = [f"chunk {idx}" for idx in range(len(stats.chunk_counts))]
+        self.functions = sorted(
+            ((name, count) for name, count in zip(names, stats.chunk_counts) if count),
+            key=lambda row: (-row[1], row[0]),
+        )
+
+    @property
+    def instructions(self) -> int:
+        return sum(count for _, count in self.ops)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the counts, most executed first, as a JSON serializable dict.
+        """
+        return {
+            "instructions": self.instructions,
+            "ops": [{"op": op.name, "count": count} for op, count in self.ops],
+            "pairs": [
+                {"first": first.name, "second": second.name, "count": count}
+                for first, second, count in self.pairs
+            ],
+            "functions": [
+                {"function": name, "count": count} for name, count in self.functions
+            ],
+        }
+
+    def table(self, top: int = 20) -> str:
+        """
+        Returns the _top_ most executed opcodes, pairs and functions as text
+        tables.
+        """
+        total = self.instructions or 1
+        pairs_total = sum(count for _, _, count in self.pairs) or 1
+        out = f"{self.instructions} instructions executed\n"
+        out += f"\n{'count':>12} {'share':>6}  op\n"
+        for op, count in self.ops[:top]:
+            out += f"{count:>12} {count / total:>6.1%}  {op.name}\n"
+        out += f"\n{'count':>12} {'share':>6}  pair\n"
+        for first, second, count in self.pairs[:top]:
+            pair = f"{first.name} {second.name}"
+            out += f"{count:>12} {count / pairs_total:>6.1%}  {pair}\n"
+        out += f"\n{'count':>12} {'share':>6}  function\n"
+        for name, count in self.functions[:top]:
+            out += f"{count:>12} {count / total:>6.1%}  {name}\n"
+        return out
@@ -0,0 +1,151 @@
+"""
+This timings module measures the phases of the compiler pipeline and the VM
+run: wall time, CPU time and the peak of the memory traced by tracemalloc, along
+with the size of what each phase produced.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, is_dataclass
+import json
+import time
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from uzac.ast import Node
+
+
+@dataclass
+class PhaseTiming:
+    """
+    Measures of one phase. _peak_memory_ is the peak in bytes of the memory
+    allocated by Python during the phase, on top of what was allocated before
+    it. Allocations of the C VM are not traced.
+    """
+
+    name: str
+    wall_time: float
+    cpu_time: float
+    peak_memory: int
+
+
+class PipelineTimings:
+    """
+    Timings of the phases of a run, in the order they ran, and counts of the
+    tokens, nodes, constraints, ops and bytes they produced.
+
+        timings = PipelineTimings()
+        with timings.phase("parse"):
+            program = parser.parse()
+        timings.count("tokens", parser.token_count)
+
+    Tracing the memory slows the phases down, _trace_memory_ turns it off for
+    more accurate times.
+    """
+
+    phases: list[PhaseTiming]
+    counts: dict[str, int]
+    trace_memory: bool
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.phases = []
+        self.counts = {}
+        self.trace_memory = trace_memory
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Measures the body of the with statement as the phase _name_.
+        """
+        import tracemalloc
+
+        started_tracing = False
+        memory = 0
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = 0
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - memory
+                if started_tracing:
+                    tracemalloc.stop()
+            self.phases.append(PhaseTiming(name, wall, cpu, peak))
+
+    def count(self, name: str, value: int) -> None:
+        self.counts[name] = value
+
+    def to_dict(self) -> dict:
+        """
+        Returns the timings as a JSON serializable dict, times are in seconds.
+        """
+        return {
+            "phases": [
+                {
+                    "name": phase.name,
+                    "wall_time": phase.wall_time,
+                    "cpu_time": phase.cpu_time,
+                    "peak_memory": phase.peak_memory,
+                }
+                for phase in self.phases
+            ],
+            "total_wall_time": sum(phase.wall_time for phase in self.phases),
+            "total_cpu_time": sum(phase.cpu_time for phase in self.phases),
+            "counts": dict(self.counts),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def table(self) -> str:
+        """
+        Returns the phases and the counts as text tables.
+        """
+        out = f"{'phase':<10} {'wall (ms)':>10} {'cpu (ms)':>10} {'peak (KiB)':>11}\n"
+        for phase in self.phases:
+            out += (
+                f"{phase.name:<10} {phase.wall_time * 1e3:>10.3f}"
+                f" {phase.cpu_time * 1e3:>10.3f} {phase.peak_memory / 1024:>11.1f}\n"
+            )
+        total = self.to_dict()
+        out += (
+            f"{'total':<10} {total['total_wall_time'] * 1e3:>10.3f}"
+            f" {total['total_cpu_time'] * 1e3:>10.3f}\n"
+        )
+        if self.counts:
+            out += "\n"
+            width = max(len(name) for name in self.counts)
+            for name, value in self.counts.items():
+                out += f"{name:<{width}} {value:>10}\n"
+        return out
+
+
+def count_nodes(node: Node) -> int:
+    """
+    Returns the number of nodes in the tree rooted at _node_, each node is
+    counted once even if it is referenced twice.
+    """
+    from uzac.ast import Node
+
+    seen = set()
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        if not is_dataclass(current):
+            continue
+        for field in fields(current):
+            value = getattr(current, field.name, None)
+            children = value if isinstance(value, (list, tuple)) else (value,)
+            stack.extend(child for child in children if isinstance(child, Node))
+    return len(seen)
@@ -1,7 +1,8 @@
 from abc import ABC
+from collections import deque
 from dataclasses import dataclass, field
 import sys
-from typing import Iterator, List
+from typing import Iterable, Iterator, List
 from itertools import count, permutations
 
 from uzac.type import *
@@ -26,17 +27,33 @@ from uzac.ast import (
     WhileLoop,
 )
 from uzac.interpreter import *
-from uzac.utils import UzaException, UzaTypeError, in_bold, in_color, ANSIColor
+from uzac.utils import (
+    PersistentDict,
+    UzaException,
+    UzaTypeError,
+    in_bold,
+    in_color,
+    ANSIColor,
+)
 from uzac.builtins import get_builtin
 
 
-@dataclass
 class Substitution:
     """
     A substitution is a map from symbolic types to real types.
+
+    Substitutions are persistent, adding a binding returns a new Substitution
+    in O(1) and leaves this one valid, so the solver can go back to an older
+    substitution without copying.
     """
 
-    __substitutions: dict["SymbolicType", Type]
+    __substitutions: PersistentDict
+
+    def __init__(self, substitutions: dict["SymbolicType", Type] | PersistentDict):
+        if isinstance(substitutions, PersistentDict):
+            self.__substitutions = substitutions
+        else:
+            self.__substitutions = PersistentDict(substitutions)
 
     def get_type_of(self, t: "SymbolicType") -> Optional[Type]:
         """
@@ -45,27 +62,78 @@ class Substitution:
         """
         return self.__substitutions.get(t)
 
+    def binding_count(self) -> int:
+        """
+        Returns the number of symbolic types bound by this substitution.
+        """
+        return len(self.__substitutions)
+
     def pretty_string(self) -> str:
-        if len(self.__substitutions) == 0:
+        substitutions = self.__substitutions.items()
+        if len(substitutions) == 0:
             return ""
         out = ""
-        exprs = [expr.span.get_source() for expr in self.__substitutions]
+        exprs = [expr.span.get_source() for expr, _ in substitutions]
         max_expr_len = max(len(s) for s in exprs)
-        for idx, k in enumerate(self.__substitutions):
+        for idx, (k, _) in enumerate(substitutions):
             yellow_type = in_color(str(k.resolve_type(self)), ANSIColor.YELLOW)
             out += f"{exprs[idx]:<{max_expr_len}} := {yellow_type}\n"
         return out
 
+    def find(self, t: Type) -> Type:
+        """
+        Returns the representative of _t_: the first type in the chain of
+        substitutions starting at _t_ that is either concrete or unbound.
+
+        The chain is compressed so that every link points directly to the
+        representative. This does not change what any type resolves to, so it
+        is done in place on this Substitution.
+        """
+        substitutions = self.__substitutions
+        path = []
+        while t.is_symbolic():
+            bound = substitutions.get(t)
+            if bound is None:
+                break
+            path.append(t)
+            t = bound
+
+        if len(path) > 1:
+            for link in path[:-1]:
+                substitutions = substitutions.set(link, t)
+            self.__substitutions = substitutions
+        return t
+
+    def bind(self, a: Type, b: Type) -> Optional["Substitution"]:
+        """
+        Unifies _a_ and _b_ by linking the representative of the symbolic side
+        to the other one, union-find style. Returns the new Substitution, or
+        None if both representatives are different concrete types.
+        """
+        rep_a = self.find(a)
+        rep_b = self.find(b)
+        if rep_a == rep_b:
+            return self
+        if rep_a.is_symbolic():
+            return self + (rep_a, rep_b)
+        if rep_b.is_symbolic():
+            return self + (rep_b, rep_a)
+        return None
+
     def __add__(self, that: object):
         """
         Takes in either a tuple pair or a Substitution and return a new
-        Subsitution.
+        Subsitution. Existing bindings are kept.
         """
         if isinstance(that, tuple) and len(that) == 2:
-            new_dict = {that[0]: that[1], **self.__substitutions}
-            return Substitution(new_dict)
+            if that[0] in self.__substitutions:
+                return self
+            return Substitution(self.__substitutions.set(that[0], that[1]))
         if isinstance(that, Substitution):
-            return Substitution(self.__substitutions | that.__substitutions)
+            substitutions = self.__substitutions
+            for k, v in that.__substitutions.items():
+                substitutions = substitutions.set(k, v)
+            return Substitution(substitutions)
         raise NotImplementedError(f"Can't add {self.__class__} and {that.__class__}")
 
 
@@ -85,12 +153,7 @@ class SymbolicType(Type):
         return True
 
     def resolve_type(self, substitution: Substitution) -> Type:
-        t = substitution.get_type_of(self)
-        if t is None:
-            return self
-        if t.is_symbolic():
-            return t.resolve_type(substitution)
-        return t
+        return substitution.find(self)
 
     def __str__(self) -> str:
         return f"{self.__class__}({self.identifier})"
@@ -182,7 +245,7 @@ class IsType(Constraint):
                     return Constraint.SOLVE_FAIL
                 return IsType(self.span, param, b.param_type).solve(sub)
             case SymbolicType():
-                return False, [Substitution({a: b})]
+                return False, [sub.bind(a, b)]
             case _:
                 return Constraint.SOLVE_FAIL
 
@@ -195,7 +258,7 @@ class IsType(Constraint):
         if type_a == type_b:
             return Constraint.SOLVE_SUCCEED
         if type_a.is_symbolic() or type_b.is_symbolic():
-            return False, [substitution + (self.a, self.b)]
+            return False, [substitution.bind(type_a, type_b)]
         return Constraint.SOLVE_FAIL
 
     def errors(self) -> List[UzaException]:
@@ -237,7 +300,8 @@ class IsSubType(Constraint):
         for possible_type in types_b:
             if type_a == possible_type:
                 return Constraint.SOLVE_SUCCEED
-        return False, (substitution + (self.a, t) for t in types_b)
+        options = (substitution.bind(type_a, t) for t in types_b)
+        return False, [option for option in options if option is not None]
 
     def errors(self) -> List[UzaException]:
         type_a = self.a.resolve_type(self.substitution)
@@ -296,7 +360,7 @@ class Applies(Constraint):
                 )
                 return Constraint.SOLVE_FAIL
             if t1.is_symbolic():
-                sub += (a, b)
+                sub = sub.bind(a, b)
 
         return True, sub
 
@@ -337,12 +401,16 @@ class Applies(Constraint):
                     self._errs.append(err)
                     fatal = True
                     continue
-                option = option + (a, b)
+                option = option.bind(type_a, type_b)
 
         if self.b.return_type.is_generic_arg():
             generic_args[self.ret_type] = True
         elif self.ret_type.is_symbolic():
-            option += (self.ret_type, self.b.return_type)
+            # the return type might already be constrained if this overload was
+            # deferred, in which case it has to match
+            option = option.bind(self.ret_type, self.b.return_type)
+            if option is None:
+                return Constraint.SOLVE_FAIL
 
         generic_ok, generic_sub = self.__solve_generic_args(generic_args, option)
 
@@ -441,6 +509,8 @@ class Typer(UzaASTVisitor):
         self.substitution = Substitution({})
         self.__errors: list[UzaTypeError] = []
         self.__warnings: list[str] = []
+        # builtin applications whose argument types are resolved after solving
+        self.__typed_apps: list[App] = []
 
     def __create_new_symbol(self, span: Span):
         """
@@ -511,9 +581,12 @@ class Typer(UzaASTVisitor):
         return f_signature.return_type, False
 
     def visit_builtin(
-        self, bi: BuiltIn, *arguments: Node, span: Span
+        self, bi: BuiltIn, *arguments: Node, span: Span, app: Optional[App] = None
     ) -> tuple[Type, NodeAlwaysReturns]:
         arg_types = [arg.visit(self)[0] for arg in arguments]
+        if app is not None:
+            app.arg_types = arg_types
+            self.__typed_apps.append(app)
         signatures = bi.type_signatures
 
         span_zero = None
@@ -561,13 +634,15 @@ class Typer(UzaASTVisitor):
         func_id = infix.func_id
         builtin = get_builtin(func_id)
         assert builtin
-        return self.visit_builtin(builtin, infix.lhs, infix.rhs, span=infix.span)
+        return self.visit_builtin(
+            builtin, infix.lhs, infix.rhs, span=infix.span, app=infix
+        )
 
     def visit_prefix_application(self, prefix: PrefixApplication) -> Type:
         func_id = prefix.func_id
         builtin = get_builtin(func_id)
         assert builtin
-        return self.visit_builtin(builtin, prefix.expr, span=prefix.span)
+        return self.visit_builtin(builtin, prefix.expr, span=prefix.span, app=prefix)
 
     def visit_method_app(self, method: MethodApplication):
         method.method.pop_value = method.pop_value
@@ -617,7 +692,7 @@ class Typer(UzaASTVisitor):
                     builtin = self.__set_generic_arg(builtin, app.generic_arg)
                 else:
                     raise UzaTypeError(app.span, "Cannot infer generic type")
-            return self.visit_builtin(builtin, *app.args, span=app.span)
+            return self.visit_builtin(builtin, *app.args, span=app.span, app=app)
         func: Function = self.__functions.get(func_id)
         func_type = func.type_signature
         arg_count = len(app.args)
@@ -719,42 +794,72 @@ class Typer(UzaASTVisitor):
             fl.interior.visit(self)
             return type_void, False
 
-    def __check_with_sub(
-        self, constaints: list[Constraint], substitution: Substitution
-    ) -> tuple[int, List[UzaTypeError], Substitution]:
+    def __propagate(
+        self, constaints: Iterable[Constraint], substitution: Substitution
+    ) -> tuple[Optional[Constraint], Substitution, list[Constraint]]:
         """
-        Recursively try to unify the constraints with the given substitution for
-        symbolic types.
+        Solves the constraints with a worklist, committing every constraint that
+        holds or has a single possible substitution. Constraints with several
+        options (overloads with unknown argument types) are deferred and
+        retried until no more progress is made.
 
-        One way to think of this algorithm is that is tries solving constraints
-        and inferring types but backtracks (via recursion) when the current
-        inferred types are not working, i.e. the substitution does not unify
-        the constraints.
+        Returns the first constraint that fails (None if none do), the
+        substitution and the constraints that are still ambiguous.
         """
-        err = 0
-        errors = []
-        options = []
-        idx = 0
-        for idx, constraint in enumerate(constaints):
+        worklist = deque(constaints)
+        deferred: list[Constraint] = []
+        progress = False
+        while worklist:
+            constraint = worklist.popleft()
             solved, options = constraint.solve(substitution)
             match solved, options:
                 case False, None:
-                    return 1, constraint.errors(), substitution
+                    return constraint, substitution, deferred
                 case False, options_list:
-                    for option in options_list:
-                        err, errors, new_map = self.__check_with_sub(
-                            constaints[idx + 1 :], option
-                        )
-                        if not err:
-                            return 0, [], new_map
-                    break
+                    options_list = list(options_list)
+                    if len(options_list) == 0:
+                        return constraint, substitution, deferred
+                    if len(options_list) == 1:
+                        substitution = options_list[0]
+                        progress = True
+                    else:
+                        deferred.append(constraint)
                 case True, sub:
                     if sub:
                         assert isinstance(sub, Substitution), (
                             f"is not {Substitution.__name__}: {sub}"
                         )
                         substitution = sub
+                    progress = True
+
+            if not worklist and deferred and progress:
+                worklist.extend(deferred)
+                deferred = []
+                progress = False
 
+        return None, substitution, deferred
+
+    def __solve(
+        self, constaints: Iterable[Constraint], substitution: Substitution
+    ) -> tuple[int, List[UzaTypeError], Substitution]:
+        """
+        Unifies the constraints, see `__propagate`. If some overloads are still
+        ambiguous once everything else is solved, their options are tried in
+        order, so only those constraints are ever backtracked over.
+        """
+        failed, substitution, deferred = self.__propagate(constaints, substitution)
+        if failed is not None:
+            return 1, failed.errors(), substitution
+        if not deferred:
+            return 0, [], substitution
+
+        ambiguous, rest = deferred[0], deferred[1:]
+        _, options = ambiguous.solve(substitution)
+        err, errors = 0, []
+        for option in options:
+            err, errors, new_sub = self.__solve(rest, option)
+            if not err:
+                return 0, [], new_sub
         return err, errors, substitution
 
     def __check_lines(self, lines: List[Node]) -> tuple[int, str, str]:
@@ -769,6 +874,15 @@ class Typer(UzaASTVisitor):
 
         return type_void, any(node_returns)
 
+    def __resolve_app_types(self, substitution: Substitution) -> None:
+        """
+        Replaces the symbolic argument types recorded on builtin applications
+        with the types they unify to. The bytecode compiler uses these to emit
+        type specialized opcodes.
+        """
+        for app in self.__typed_apps:
+            app.arg_types = [t.resolve_type(substitution) for t in app.arg_types]
+
     def typecheck_program(self) -> TyperDiagnostic:
         """
         Types checks an uza program.
@@ -781,10 +895,13 @@ class Typer(UzaASTVisitor):
             A TyperDiagnostic
         """
         self.program.syntax_tree.visit(self)
-        error_count, errors, substitution = self.__check_with_sub(
+        error_count, errors, substitution = self.__solve(
             self.constaints, self.substitution
         )
 
+        if error_count == 0:
+            self.__resolve_app_types(substitution)
+
         error_count += len(self.__errors)
         errors += self.__errors
         warn_str = "\n".join(self.__warnings)
@@ -3,7 +3,7 @@ from collections import deque
 from dataclasses import dataclass
 from enum import Enum
 import sys
-from typing import List, Optional, TypeVar
+from typing import Hashable, List, Optional, TypeVar
 
 
 class ANSIColor(Enum):
@@ -37,6 +37,12 @@ class ANSIColor(Enum):
 
 _is_terminal = sys.stderr.isatty()
 
+OPTIMIZATION_LEVELS = (0, 1, 2)
+"""
+-O0 compiles the AST as is, -O1 folds constants and prunes constant branches,
+-O2 also runs the peephole optimizer on the bytecode
+"""
+
 
 def in_bold(string: str) -> str:
     if _is_terminal:
@@ -132,6 +138,73 @@ class Span:
 T = TypeVar("T")
 
 
+_MISSING = object()
+
+
+class PersistentDict:
+    """
+    A persistent dict where every version shares a single underlying dict.
+
+    The shared dict always holds the contents of one version, the root, and
+    every other version is a diff pointing towards it. Accessing a version
+    reroots the structure to it by replaying the diffs in between (Baker's
+    trick). Extending the latest version is O(1) and going back to an older
+    one costs the number of bindings added since, without ever copying.
+    """
+
+    __slots__ = ("__data",)
+
+    def __init__(self, initial: Optional[dict] = None) -> None:
+        # the dict if this version is the root, else (key, value, next_version)
+        self.__data = dict(initial) if initial else {}
+
+    def __reroot(self) -> dict:
+        if type(self.__data) is dict:
+            return self.__data
+
+        path = []
+        node = self
+        while type(node.__data) is not dict:
+            path.append(node)
+            node = node.__data[2]
+        data = node.__data
+        for version in reversed(path):
+            key, value, newer = version.__data
+            old = data.get(key, _MISSING)
+            if value is _MISSING:
+                del data[key]
+            else:
+                data[key] = value
+            newer.__data = (key, old, version)
+            version.__data = data
+        return data
+
+    def get(self, key, default=None):
+        return self.__reroot().get(key, default)
+
+    def set(self, key, value) -> PersistentDict:
+        """
+        Returns a new version with _key_ bound to _value_, this version is left
+        unchanged.
+        """
+        data = self.__reroot()
+        old = data.get(key, _MISSING)
+        data[key] = value
+        new_version = PersistentDict()
+        new_version.__data = data
+        self.__data = (key, old, new_version)
+        return new_version
+
+    def items(self) -> list[tuple]:
+        return list(self.__reroot().items())
+
+    def __contains__(self, key) -> bool:
+        return key in self.__reroot()
+
+    def __len__(self) -> int:
+        return len(self.__reroot())
+
+
 @dataclass
 class Symbol:
     """
@@ -145,61 +218,62 @@ class Symbol:
 class SymbolTable:
     """
     Symbol table that keeps track of the defined symbols for each stack frame.
+
+    Each name maps to the stack of its bindings, innermost last. Each frame
+    maps the names it defines to their symbol, which doubles as the undo log
+    when the frame is popped. Lookups, definitions and reassignments are O(1).
     """
 
-    # List of frames, each frame contains list of symbols
-    __frames: List[List[Symbol]]
+    # name -> bindings of that name in the enclosing frames, innermost last
+    __bindings: dict[Hashable, List[Symbol]]
+    # symbols defined in each frame
+    __frames: List[dict[Hashable, Symbol]]
 
     def __init__(self, frames: List[List[Symbol]] | None = None) -> None:
-        if not frames:
-            self.__frames: List[List[Symbol]] = [[]]
-        else:
-            self.__frames = frames
-
-    def __get_locals(self) -> List[Symbol]:
-        return self.__frames[-1]
+        self.__bindings = {}
+        self.__frames = []
+        for frame in frames or [[]]:
+            self.new_frame()
+            for symbol in frame:
+                self.define(symbol.key, symbol.val)
 
     def new_frame(self) -> SymbolTable:
-        self.__frames.append([])
+        self.__frames.append({})
         return self
 
     def pop_frame(self) -> SymbolTable:
-        self.__frames = self.__frames[:-1]
+        frame = self.__frames.pop()
+        for name in frame:
+            bindings = self.__bindings[name]
+            bindings.pop()
+            if not bindings:
+                del self.__bindings[name]
 
     def define(self, variable_name: str, value: T, false_if_defined=False) -> bool:
-        frame_locals = self.__get_locals()
-        for symbol in frame_locals:
-            if symbol.key == variable_name:
-                if false_if_defined:
-                    return False
-                symbol.val = value
-                return True
-
-        frame_locals.append(Symbol(variable_name, value))
+        frame_locals = self.__frames[-1]
+        symbol = frame_locals.get(variable_name)
+        if symbol is not None:
+            if false_if_defined:
+                return False
+            symbol.val = value
+            return True
+
+        symbol = Symbol(variable_name, value)
+        frame_locals[variable_name] = symbol
+        self.__bindings.setdefault(variable_name, []).append(symbol)
         return True
 
     def get(self, identifier: str) -> Optional[T]:
-        idx = len(self.__frames) - 1
-        while idx >= 0:
-            frame = self.__frames[idx]
-            for symbol in frame:
-                if symbol.key == identifier:
-                    return symbol.val
-            idx -= 1
-
-        return None
+        bindings = self.__bindings.get(identifier)
+        if bindings is None:
+            return None
+        return bindings[-1].val
 
     def reassign(self, identifier: str, new_value: T) -> None:
-        idx = len(self.__frames) - 1
-        while idx >= 0:
-            frame = self.__frames[idx]
-            for j in range(len(frame)):
-                if frame[j].key == identifier:
-                    frame[j].val = new_value
-                    return
-            idx -= 1
-
-        raise NameError(f"{identifier} not defined in scope")
+        bindings = self.__bindings.get(identifier)
+        if bindings is None:
+            raise NameError(f"{identifier} not defined in scope")
+        bindings[-1].val = new_value
 
     def __enter__(self):
         """
@@ -9,16 +9,18 @@ void chunk_init(Chunk *chunk) {
   chunk->count = 0;
   chunk->code = NULL;
   chunk->count = 0;
+  chunk->param_count = 0;
+  chunk->param_types = NULL;
   value_array_init(&chunk->constants);
 }
 
-void chunk_free(Chunk *chunk) {
-  FREE_ARRAY(uint8_t, chunk->code, chunk->count);
-  value_array_free(&chunk->constants);
+void chunk_free(VM *vm, Chunk *chunk) {
+  FREE_ARRAY(vm, uint8_t, chunk->code, chunk->count);
+  value_array_free(vm, &chunk->constants);
   chunk_init(chunk);
 }
 
-int chunk_const_add(Chunk *chunk, Value constant) {
-  value_array_write(&chunk->constants, constant);
+int chunk_const_add(VM *vm, Chunk *chunk, Value constant) {
+  value_array_write(vm, &chunk->constants, constant);
   return chunk->constants.count;
 }
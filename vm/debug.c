@@ -4,54 +4,123 @@
 
 #ifndef NDEBUG
 
-void debug_stack_print(char *str) {
+void debug_stack_print(VM *vm, char *str) {
   DEBUG_PRINT("%s\n" CYAN, str);
-  Frame *frame = &vm.frame_stacks[vm.depth];
-  if (vm.depth > 0)
-    assert(frame->locals <= vm.stack_top);
-  assert(&frame->locals[frame->locals_count] <= vm.stack_top);
-  for (Value *slot = &frame->locals[frame->locals_count]; slot < vm.stack_top;
+  Frame *frame = &vm->frame_stacks[vm->depth];
+  if (vm->depth > 0)
+    assert(frame->locals <= vm->stack_top);
+  assert(&frame->locals[frame->locals_count] <= vm->stack_top);
+  for (Value *slot = &frame->locals[frame->locals_count]; slot < vm->stack_top;
        slot++) {
-    PRINT_VALUE((*slot), stderr);
+    PRINT_VALUE(vm, (*slot), stderr);
     DEBUG_PRINT("\n")
   }
   DEBUG_PRINT(RESET "----------\n");
 }
 
-void debug_locals_print(char *str) {
+void debug_locals_print(VM *vm, char *str) {
   DEBUG_PRINT("%s :\n" GREEN, str);
-  if (vm.depth > 0) {
-    Frame *frame = &vm.frame_stacks[vm.depth];
+  if (vm->depth > 0) {
+    Frame *frame = &vm->frame_stacks[vm->depth];
     for (int i = 0; i < frame->locals_count; i++) {
       DEBUG_PRINT("local #%d: ", i);
-      PRINT_VALUE((frame->locals[i]), stderr);
+      PRINT_VALUE(vm, (frame->locals[i]), stderr);
       DEBUG_PRINT("\n")
     }
   }
   DEBUG_PRINT(RESET "----------\n");
 }
 
-void debug_local_print(char *code_str, Chunk *chunk, int offset) {
+void debug_local_print(VM *vm, char *code_str, Chunk *chunk, int offset) {
   DEBUG_PRINT_TO("%-20s", code_str);
   int local = GET_CODE_AT(chunk, offset);
   DEBUG_PRINT("#%-5d", local);
 }
 
-void debug_constant_print(char *code_str, Chunk *chunk, int offset) {
+void debug_constant_print(VM *vm, char *code_str, Chunk *chunk, int offset) {
   DEBUG_PRINT_TO("%-20s", code_str);
   int constant = GET_CODE_AT(chunk, offset);
   DEBUG_PRINT("#%-5d" GREEN "// ", constant);
-  PRINT_VALUE(chunk->constants.values[constant], stderr);
+  PRINT_VALUE(vm, chunk->constants.values[constant], stderr);
   DEBUG_PRINT(RESET);
 }
 
-void debug_jump_print(char *code_str, Chunk *chunk, int offset) {
+void debug_global_print(VM *vm, char *code_str, Chunk *chunk, int offset) {
   DEBUG_PRINT_TO("%-20s", code_str);
-  uint16_t jump = GET_CODE_AT_CAST(uint16_t, chunk, offset) + sizeof(uint16_t);
-  DEBUG_PRINT("%u", jump);
+  int slot = GET_CODE_AT(chunk, offset);
+  DEBUG_PRINT("#%-5d" GREEN "// ", slot);
+  PRINT_VALUE(vm, VAL_OBJ(vm->global_names[slot]), stderr);
+  DEBUG_PRINT(RESET);
+}
+
+void debug_jump_print(VM *vm, char *code_str, Chunk *chunk, int offset) {
+  DEBUG_PRINT_TO("%-20s", code_str);
+  uint16_t jump = GET_CODE_AT(chunk, offset) |
+                  (GET_CODE_AT(chunk, offset + 1) << 8);
+  DEBUG_PRINT("%u", jump + (unsigned)sizeof(uint16_t));
+}
+
+// Prints the local and constant operands of a superinstruction, which are
+// _operand_size_ bytes each.
+static void debug_operands_print(VM *vm, Chunk *chunk, int offset, int count,
+                                 int operand_size) {
+  for (int i = 0; i < count; i++) {
+    int operand = GET_CODE_AT(chunk, offset + i * operand_size);
+    if (operand_size == 2) {
+      operand |= GET_CODE_AT(chunk, offset + i * operand_size + 1) << 8;
+    }
+    DEBUG_PRINT("#%-5d", operand);
+  }
+}
+
+int debug_wide_print(VM *vm, Chunk *chunk, int offset) {
+  OpCode wide = GET_CODE_AT(chunk, offset);
+  DEBUG_PRINT_TO("OP_WIDE %-12d", wide);
+  switch (wide) {
+  case OP_JUMP:
+  case OP_LOOP:
+  case OP_JUMP_IF_FALSE:
+  case OP_JUMP_IF_TRUE: {
+    uint32_t jump = 0;
+    for (int i = 3; i >= 0; i--) {
+      jump = (jump << 8) | GET_CODE_AT(chunk, offset + 1 + i);
+    }
+    DEBUG_PRINT("%u", jump);
+    return 6;
+  }
+  case OP_IADD_LOCALS:
+  case OP_ISUB_LOCALS:
+  case OP_IMUL_LOCALS:
+  case OP_FADD_LOCALS:
+  case OP_FSUB_LOCALS:
+  case OP_FMUL_LOCALS:
+  case OP_INCLOCAL:
+    debug_operands_print(vm, chunk, offset + 1, 2, 2);
+    return 6;
+  case OP_JUMP_UNLESS_IEQ:
+  case OP_JUMP_UNLESS_INE:
+  case OP_JUMP_UNLESS_ILT:
+  case OP_JUMP_UNLESS_ILE:
+  case OP_JUMP_UNLESS_IGT:
+  case OP_JUMP_UNLESS_IGE: {
+    debug_operands_print(vm, chunk, offset + 1, 2, 2);
+    uint32_t jump = 0;
+    for (int i = 3; i >= 0; i--) {
+      jump = (jump << 8) | GET_CODE_AT(chunk, offset + 5 + i);
+    }
+    DEBUG_PRINT("%u", jump);
+    return 10;
+  }
+  default: {
+    int operand =
+        GET_CODE_AT(chunk, offset + 1) | (GET_CODE_AT(chunk, offset + 2) << 8);
+    DEBUG_PRINT("#%-5d", operand);
+    return 4;
+  }
+  }
 }
 
-int debug_op_print(Chunk *chunk, int offset) {
+int debug_op_print(VM *vm, Chunk *chunk, int offset) {
   switch (GET_CODE_AT(chunk, offset)) {
   case OP_RETURN:
     DEBUG_PRINT_TO("%-20s", "OP_RETURN");
@@ -62,15 +131,23 @@ int debug_op_print(Chunk *chunk, int offset) {
     return 1;
     break;
   case OP_CALL_NATIVE:
-    debug_constant_print("OP_CALL_NATIVE", chunk, offset + 1);
+    debug_constant_print(vm, "OP_CALL_NATIVE", chunk, offset + 1);
+    return 2;
+    break;
+  case OP_CALL_DIRECT:
+    debug_local_print(vm, "OP_CALL_DIRECT", chunk, offset + 1);
+    return 2;
+    break;
+  case OP_TAIL_CALL_DIRECT:
+    debug_local_print(vm, "OP_TAIL_CALL_DIRECT", chunk, offset + 1);
     return 2;
     break;
   case OP_JUMP:
-    debug_jump_print("OP_JUMP", chunk, offset + 1);
+    debug_jump_print(vm, "OP_JUMP", chunk, offset + 1);
     return 3;
     break;
   case OP_LOOP:
-    debug_jump_print("OP_LOOP", chunk, offset + 1);
+    debug_jump_print(vm, "OP_LOOP", chunk, offset + 1);
     return 3;
     break;
   case OP_POP:
@@ -86,15 +163,15 @@ int debug_op_print(Chunk *chunk, int offset) {
     return 1;
     break;
   case OP_LCONST:
-    debug_constant_print("OP_LCONST", chunk, offset + 1);
+    debug_constant_print(vm, "OP_LCONST", chunk, offset + 1);
     return 2;
     break;
   case OP_DCONST:
-    debug_constant_print("OP_DCONST", chunk, offset + 1);
+    debug_constant_print(vm, "OP_DCONST", chunk, offset + 1);
     return 2;
     break;
   case OP_STRCONST:
-    debug_constant_print("OP_STRCONST", chunk, offset + 1);
+    debug_constant_print(vm, "OP_STRCONST", chunk, offset + 1);
     return 2;
     break;
   case OP_BOOLTRUE:
@@ -118,33 +195,33 @@ int debug_op_print(Chunk *chunk, int offset) {
     return 1;
     break;
   case OP_JUMP_IF_FALSE:
-    debug_jump_print("OP_JUMP_IF_FALSE", chunk, offset + 1);
+    debug_jump_print(vm, "OP_JUMP_IF_FALSE", chunk, offset + 1);
     return 3;
     break;
   case OP_JUMP_IF_TRUE:
-    debug_jump_print("OP_JUMP_IF_TRUE", chunk, offset + 1);
+    debug_jump_print(vm, "OP_JUMP_IF_TRUE", chunk, offset + 1);
     return 3;
     break;
   case OP_DEFGLOBAL:
-    debug_constant_print("OP_DEFGLOBAL", chunk, offset + 1);
+    debug_global_print(vm, "OP_DEFGLOBAL", chunk, offset + 1);
     return 2;
     break;
   case OP_SETGLOBAL:
-    debug_constant_print("OP_SETGLOBAL", chunk, offset + 1);
+    debug_global_print(vm, "OP_SETGLOBAL", chunk, offset + 1);
     return 2;
     break;
   case OP_GETGLOBAL:
-    debug_constant_print("OP_GETGLOBAL", chunk, offset + 1);
+    debug_global_print(vm, "OP_GETGLOBAL", chunk, offset + 1);
     return 2;
     break;
   case OP_DEFLOCAL:
-    debug_local_print("OP_DEFLOCAL", chunk, offset + 1);
+    debug_local_print(vm, "OP_DEFLOCAL", chunk, offset + 1);
     return 2;
   case OP_SETLOCAL:
-    debug_local_print("OP_SETLOCAL", chunk, offset + 1);
+    debug_local_print(vm, "OP_SETLOCAL", chunk, offset + 1);
     return 2;
   case OP_GETLOCAL:
-    debug_local_print("OP_GETLOCAL", chunk, offset + 1);
+    debug_local_print(vm, "OP_GETLOCAL", chunk, offset + 1);
     return 2;
   case OP_ADD:
     DEBUG_PRINT_TO("%-20s", "OP_ADD");
@@ -196,10 +273,158 @@ int debug_op_print(Chunk *chunk, int offset) {
     DEBUG_PRINT_TO("%-20s", "OP_NEG");
     return 1;
     break;
+  case OP_IADD:
+    DEBUG_PRINT_TO("%-20s", "OP_IADD");
+    return 1;
+  case OP_ISUB:
+    DEBUG_PRINT_TO("%-20s", "OP_ISUB");
+    return 1;
+  case OP_IMUL:
+    DEBUG_PRINT_TO("%-20s", "OP_IMUL");
+    return 1;
+  case OP_IDIV:
+    DEBUG_PRINT_TO("%-20s", "OP_IDIV");
+    return 1;
+  case OP_INEG:
+    DEBUG_PRINT_TO("%-20s", "OP_INEG");
+    return 1;
+  case OP_FADD:
+    DEBUG_PRINT_TO("%-20s", "OP_FADD");
+    return 1;
+  case OP_FSUB:
+    DEBUG_PRINT_TO("%-20s", "OP_FSUB");
+    return 1;
+  case OP_FMUL:
+    DEBUG_PRINT_TO("%-20s", "OP_FMUL");
+    return 1;
+  case OP_FDIV:
+    DEBUG_PRINT_TO("%-20s", "OP_FDIV");
+    return 1;
+  case OP_FNEG:
+    DEBUG_PRINT_TO("%-20s", "OP_FNEG");
+    return 1;
+  case OP_STRCONCAT:
+    DEBUG_PRINT_TO("%-20s", "OP_STRCONCAT");
+    return 1;
+  case OP_IEQ:
+    DEBUG_PRINT_TO("%-20s", "OP_IEQ");
+    return 1;
+  case OP_INE:
+    DEBUG_PRINT_TO("%-20s", "OP_INE");
+    return 1;
+  case OP_ILT:
+    DEBUG_PRINT_TO("%-20s", "OP_ILT");
+    return 1;
+  case OP_ILE:
+    DEBUG_PRINT_TO("%-20s", "OP_ILE");
+    return 1;
+  case OP_IGT:
+    DEBUG_PRINT_TO("%-20s", "OP_IGT");
+    return 1;
+  case OP_IGE:
+    DEBUG_PRINT_TO("%-20s", "OP_IGE");
+    return 1;
+  case OP_FEQ:
+    DEBUG_PRINT_TO("%-20s", "OP_FEQ");
+    return 1;
+  case OP_FNE:
+    DEBUG_PRINT_TO("%-20s", "OP_FNE");
+    return 1;
+  case OP_FLT:
+    DEBUG_PRINT_TO("%-20s", "OP_FLT");
+    return 1;
+  case OP_FLE:
+    DEBUG_PRINT_TO("%-20s", "OP_FLE");
+    return 1;
+  case OP_FGT:
+    DEBUG_PRINT_TO("%-20s", "OP_FGT");
+    return 1;
+  case OP_FGE:
+    DEBUG_PRINT_TO("%-20s", "OP_FGE");
+    return 1;
+  case OP_ITOF:
+    DEBUG_PRINT_TO("%-20s", "OP_ITOF");
+    return 1;
+  case OP_FTOI:
+    DEBUG_PRINT_TO("%-20s", "OP_FTOI");
+    return 1;
+  case OP_IADD_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_IADD_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_ISUB_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_ISUB_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_IMUL_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_IMUL_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_FADD_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_FADD_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_FSUB_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_FSUB_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_FMUL_LOCALS:
+    DEBUG_PRINT_TO("%-20s", "OP_FMUL_LOCALS");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_INCLOCAL:
+    DEBUG_PRINT_TO("%-20s", "OP_INCLOCAL");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    return 3;
+  case OP_JUMP_UNLESS_IEQ:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_IEQ");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
+  case OP_JUMP_UNLESS_INE:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_INE");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
+  case OP_JUMP_UNLESS_ILT:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_ILT");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
+  case OP_JUMP_UNLESS_ILE:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_ILE");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
+  case OP_JUMP_UNLESS_IGT:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_IGT");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
+  case OP_JUMP_UNLESS_IGE:
+    DEBUG_PRINT_TO("%-20s", "OP_JUMP_UNLESS_IGE");
+    debug_operands_print(vm, chunk, offset + 1, 2, 1);
+    DEBUG_PRINT("%u", (GET_CODE_AT(chunk, offset + 3) |
+                       (GET_CODE_AT(chunk, offset + 4) << 8)) +
+                          (unsigned)sizeof(uint16_t));
+    return 5;
   case OP_EXITVM:
     DEBUG_PRINT_TO("%-20s", "OP_EXITVM");
     return 1;
     break;
+  case OP_WIDE:
+    return debug_wide_print(vm, chunk, offset + 1);
+    break;
   default:
     break;
   }
@@ -208,10 +433,10 @@ int debug_op_print(Chunk *chunk, int offset) {
   exit(1);
 }
 
-void debug_chunk_print(Chunk *chunk) {
+void debug_chunk_print(VM *vm, Chunk *chunk) {
   DEBUG_PRINT("/// constants ///\n");
   for (size_t i = 0; i < chunk->constants.count; i++) {
-    PRINT_VALUE(chunk->constants.values[i], stderr);
+    PRINT_VALUE(vm, chunk->constants.values[i], stderr);
     DEBUG_PRINT("\n");
   }
   DEBUG_PRINT("there are %ld ops\n", chunk->count);
@@ -226,24 +451,24 @@ void debug_chunk_print(Chunk *chunk) {
       DEBUG_PRINT("%5d  ", line);
     }
 
-    int incr = debug_op_print(chunk, offset);
+    int incr = debug_op_print(vm, chunk, offset);
     offset += incr;
     DEBUG_PRINT("\n");
   }
 }
 
-void debug_vm_dump(void) {
+void debug_vm_dump(VM *vm) {
   DEBUG_PRINT("\n");
   DEBUG_PRINT("\n");
   DEBUG_PRINT(BLUE "##### DUMP ####\n" RESET);
   DEBUG_PRINT("///  VM   ///\n");
-  DEBUG_PRINT("ip: %p\n", vm.frame_stacks[vm.depth].ip);
+  DEBUG_PRINT("ip: %p\n", vm->frame_stacks[vm->depth].ip);
   DEBUG_PRINT("/// stack ///\n");
-  DEBUG_PRINT("count: %d\n", (int)(vm.stack_top - vm.stack));
-  // debug_stack_print("values:");
-  for (size_t i = 0; i < vm.chunk_count; i++) {
+  DEBUG_PRINT("count: %d\n", (int)(vm->stack_top - vm->stack));
+  // debug_stack_print(vm, "values:");
+  for (size_t i = 0; i < vm->chunk_count; i++) {
     DEBUG_PRINT("/// Chunk %ld ///\n", i);
-    debug_chunk_print(vm.chunks[i]);
+    debug_chunk_print(vm, vm->chunks[i]);
     DEBUG_PRINT(NEWLINE);
   }
   DEBUG_PRINT(BLUE "/////////////\n" RESET);
@@ -4,7 +4,7 @@
 #include <stdio.h>
 #include <string.h>
 
-bool stop_interpreting = false;
+volatile bool stop_interpreting = false;
 
 #if defined(_WIN32) || defined(WIN32)
 #include <windows.h>
@@ -24,12 +24,7 @@ static void sigint_handler(int sig) {
 }
 #endif
 
-#if defined(_WIN32) || defined(WIN32)
-__declspec(dllexport)
-#endif
-int run_vm(int byte_count, char* code) {
-  program_bytes_t program = {byte_count, (uint8_t *)code};
-
+static void interrupt_handler_set(void) {
 #if defined(_WIN32) || defined(WIN32)
   if (!SetConsoleCtrlHandler(CtrlHandler, TRUE)) {
     fprintf(stderr, "Error setting control handler.\n");
@@ -37,18 +32,130 @@ int run_vm(int byte_count, char* code) {
 #else
   signal(SIGINT, sigint_handler);
 #endif
+}
 
-  vm_init(&program);
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+// Runs a program in a VM of its own, programs can run concurrently on
+// different threads. The garbage collector statistics of the run are copied to
+// _gc_stats_ if it is not NULL. The frame stack is sampled into _profile_ if
+// it is not NULL, its samples are then freed with vm_profile_free. The
+// executed instructions are counted in _op_stats_ if it is not NULL, its chunk
+// counts are then freed with vm_op_stats_free.
+int run_vm(int byte_count, char* code, uint32_t max_frames,
+           size_t gc_initial_heap, double gc_growth_factor,
+           GCStats *gc_stats, Profile *profile, OpStats *op_stats) {
+  program_bytes_t program = {byte_count, (uint8_t *)code};
+  VMOptions options = {max_frames, gc_initial_heap, gc_growth_factor};
+
+  interrupt_handler_set();
+  VM *vm = vm_new(&program, &options);
+  if (profile != NULL && profile->interval > 0) {
+    profile->countdown = profile->interval;
+    vm->profile = profile;
+  }
+  if (op_stats != NULL) {
+    op_stats->chunk_count = vm->chunk_count;
+    op_stats->chunks = calloc(vm->chunk_count, sizeof(uint64_t));
+    if (op_stats->chunks == NULL) {
+      PRINT_ERR("Could not allocate the op stats. Exiting...");
+      exit(1);
+    }
+    vm->op_stats = op_stats;
+  }
 
 #ifdef DEBUG_DUMP_VM
-  debug_vm_dump();
-  int res = interpret();
-  debug_vm_dump();
+  debug_vm_dump(vm);
+  int res = interpret(vm);
+  debug_vm_dump(vm);
 #else
-  int res = interpret();
+  int res = interpret(vm);
 #endif
-  vm_free();
+  if (gc_stats != NULL) {
+    *gc_stats = vm->gc_stats;
+  }
+  vm_free(vm);
   // fflush(stdout);
   // fflush(stderr);
   return res;
 }
+
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+void vm_profile_free(Profile *profile) {
+  free(profile->samples);
+  profile->samples = NULL;
+  profile->count = 0;
+  profile->capacity = 0;
+}
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+void vm_op_stats_free(OpStats *op_stats) {
+  free(op_stats->chunks);
+  op_stats->chunks = NULL;
+  op_stats->chunk_count = 0;
+}
+
+// A loaded program whose functions are called many times, the VM is created
+// and its natives and constants loaded only once
+typedef struct {
+  VM *vm;
+  uint8_t *code; // copy of the program bytes, the chunks point into it
+} VMHandle;
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+// Loads a program in a new VM, vm_handle_run then runs its top level.
+VMHandle *vm_handle_new(int byte_count, const char *code, uint32_t max_frames,
+                        size_t gc_initial_heap, double gc_growth_factor) {
+  VMHandle *handle = malloc(sizeof(VMHandle));
+  uint8_t *code_copy = malloc(byte_count);
+  if (handle == NULL || code_copy == NULL) {
+    PRINT_ERR("Could not allocate the VM. Exiting...");
+    exit(1);
+  }
+  memcpy(code_copy, code, byte_count);
+  program_bytes_t program = {byte_count, code_copy};
+  VMOptions options = {max_frames, gc_initial_heap, gc_growth_factor};
+  handle->code = code_copy;
+  handle->vm = vm_new(&program, &options);
+  return handle;
+}
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+int vm_handle_run(VMHandle *handle) {
+  interrupt_handler_set();
+  return interpret(handle->vm);
+}
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+int vm_handle_call(VMHandle *handle, const char *name, int arg_count,
+                   const HostValue *args, HostValue *result) {
+  return vm_call(handle->vm, name, arg_count, args, result);
+}
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+void vm_handle_gc_stats(VMHandle *handle, GCStats *gc_stats) {
+  *gc_stats = handle->vm->gc_stats;
+}
+
+#if defined(_WIN32) || defined(WIN32)
+__declspec(dllexport)
+#endif
+void vm_handle_free(VMHandle *handle) {
+  vm_free(handle->vm);
+  free(handle->code);
+  free(handle);
+}
@@ -1,13 +1,19 @@
+from __future__ import annotations
 import ctypes
-import importlib.resources
+from functools import cache
 from os.path import dirname, join
 import sys
-import importlib
+import threading
+from typing import TYPE_CHECKING
 
-from uzac.bytecode import ByteCodeProgramSerializer
+if TYPE_CHECKING:
+    from uzac.bytecode import ByteCodeProgramSerializer
 
 LIB_NAME = "vm"
 
+VM_CALL_TYPE_MISMATCH = 3
+"vm_handle_call status of arguments that do not have their parameter types"
+
 
 def load_shared_library(directory, lib_name):
     if sys.platform.startswith("win"):
@@ -25,36 +31,439 @@ def load_shared_library(directory, lib_name):
         return ctypes.CDLL(local_build_path)
 
 
-vm_ = load_shared_library("", LIB_NAME)
-vm_.run_vm.argtypes = (ctypes.c_int, ctypes.c_char_p)
+class GCStats(ctypes.Structure):
+    """
+    Garbage collector statistics of a VM run, mirrors GCStats in vm.h. Pauses
+    are in nanoseconds.
+    """
+
+    _fields_ = [
+        ("minor_collections", ctypes.c_uint64),
+        ("major_collections", ctypes.c_uint64),
+        ("minor_pause_ns", ctypes.c_uint64),
+        ("major_pause_ns", ctypes.c_uint64),
+        ("total_pause_ns", ctypes.c_uint64),
+        ("max_pause_ns", ctypes.c_uint64),
+        ("objects_promoted", ctypes.c_uint64),
+        ("objects_freed", ctypes.c_uint64),
+        ("bytes_freed", ctypes.c_uint64),
+        ("live_bytes", ctypes.c_uint64),
+    ]
+
+    @property
+    def collections(self) -> int:
+        return self.minor_collections + self.major_collections
+
+    def __str__(self) -> str:
+        mean = self.total_pause_ns / self.collections if self.collections else 0
+        return (
+            f"minor collections: {self.minor_collections} "
+            f"({self.minor_pause_ns / 1e6:.3f} ms)\n"
+            f"major collections: {self.major_collections} "
+            f"({self.major_pause_ns / 1e6:.3f} ms)\n"
+            f"mean pause: {mean / 1e3:.1f} us, "
+            f"max pause: {self.max_pause_ns / 1e3:.1f} us\n"
+            f"objects promoted: {self.objects_promoted}, "
+            f"freed: {self.objects_freed} ({self.bytes_freed} bytes)\n"
+            f"live bytes after the last collection: {self.live_bytes}"
+        )
+
+
+class Profile(ctypes.Structure):
+    """
+    Frame stack samples of a profiled run, mirrors Profile in vm.h.
+    """
+
+    _fields_ = [
+        ("interval", ctypes.c_uint32),
+        ("countdown", ctypes.c_uint32),
+        ("samples", ctypes.POINTER(ctypes.c_uint32)),
+        ("count", ctypes.c_size_t),
+        ("capacity", ctypes.c_size_t),
+    ]
+
+    def stacks(self) -> list[tuple[tuple[int, int], ...]]:
+        """
+        Returns the sampled stacks, from the global frame to the innermost
+        one, as (chunk index, code offset) pairs.
+        """
+        samples = self.samples[: self.count]
+        stacks = []
+        i = 0
+        while i < len(samples):
+            depth = samples[i]
+            frames = samples[i + 1 : i + 1 + 2 * depth]
+            stacks.append(tuple(zip(frames[::2], frames[1::2])))
+            i += 1 + 2 * depth
+        return stacks
+
+
+class OpStats(ctypes.Structure):
+    """
+    Instructions executed by a counted run, mirrors OpStats in vm.h. Opcodes
+    are the values of uzac.bytecode.OPCODE, _chunk_counts_ the number of
+    instructions executed in each chunk.
+    """
+
+    chunk_counts: list[int]
+
+    _fields_ = [
+        ("ops_", ctypes.c_uint64 * 256),
+        ("pairs_", (ctypes.c_uint64 * 256) * 256),
+        ("chunks_", ctypes.POINTER(ctypes.c_uint64)),
+        ("chunk_count", ctypes.c_size_t),
+        ("previous", ctypes.c_uint8),
+        ("started", ctypes.c_bool),
+    ]
+
+    def ops(self) -> dict[int, int]:
+        """
+        Returns the number of executions of each executed opcode.
+        """
+        return {op: count for op, count in enumerate(self.ops_) if count}
+
+    def pairs(self) -> dict[tuple[int, int], int]:
+        """
+        Returns the number of executions of each pair of opcodes executed one
+        after the other.
+        """
+        return {
+            (first, second): count
+            for first, row in enumerate(self.pairs_)
+            if self.ops_[first]
+            for second, count in enumerate(row)
+            if count
+        }
+
+
+class HostValue(ctypes.Structure):
+    """
+    Argument or result of a call to a uza function, mirrors HostValue in vm.h.
+    """
+
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("integer", ctypes.c_int64),
+        ("fp", ctypes.c_double),
+        ("boolean", ctypes.c_bool),
+        ("chars", ctypes.c_void_p),
+        ("length", ctypes.c_int),
+    ]
+
+    # ValueType in value.h, strings are objects
+    NIL, INT, BOOL, FLOAT, STRING = range(5)
+
+    @staticmethod
+    def from_python(value, keep_alive: list) -> "HostValue":
+        """
+        Converts _value_ to a HostValue, the buffers of strings are appended to
+        _keep_alive_ and must outlive the call.
+        """
+        res = HostValue()
+        if value is None:
+            res.type = HostValue.NIL
+        elif type(value) is bool:
+            res.type = HostValue.BOOL
+            res.boolean = value
+        elif type(value) is int:
+            if not -(2**63) <= value < 2**63:
+                raise OverflowError(f"{value} does not fit in a 64 bit int")
+            res.type = HostValue.INT
+            res.integer = value
+        elif type(value) is float:
+            res.type = HostValue.FLOAT
+            res.fp = value
+        elif type(value) is str:
+            chars = ctypes.create_string_buffer(value.encode("ascii"), len(value))
+            keep_alive.append(chars)
+            res.type = HostValue.STRING
+            res.chars = ctypes.addressof(chars)
+            res.length = len(value)
+        else:
+            raise TypeError(f"cannot pass a {type(value).__name__} to the VM")
+        return res
+
+    def to_python(self):
+        if self.type == HostValue.INT:
+            return self.integer
+        if self.type == HostValue.FLOAT:
+            return self.fp
+        if self.type == HostValue.BOOL:
+            return self.boolean
+        if self.type == HostValue.STRING:
+            return ctypes.string_at(self.chars, self.length).decode("ascii")
+        return None
+
+
+@cache
+def _library() -> ctypes.CDLL:
+    """
+    Loads the VM library the first time a program runs, so that importing this
+    module, or running the compiler alone, does not load it.
+    """
+    vm_ = load_shared_library("", LIB_NAME)
+    vm_.run_vm.argtypes = (
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint32,
+        ctypes.c_size_t,
+        ctypes.c_double,
+        ctypes.POINTER(GCStats),
+        ctypes.POINTER(Profile),
+        ctypes.POINTER(OpStats),
+    )
+    vm_.vm_profile_free.argtypes = (ctypes.POINTER(Profile),)
+    vm_.vm_profile_free.restype = None
+    vm_.vm_op_stats_free.argtypes = (ctypes.POINTER(OpStats),)
+    vm_.vm_op_stats_free.restype = None
+    vm_.vm_handle_new.argtypes = (
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint32,
+        ctypes.c_size_t,
+        ctypes.c_double,
+    )
+    vm_.vm_handle_new.restype = ctypes.c_void_p
+    vm_.vm_handle_run.argtypes = (ctypes.c_void_p,)
+    vm_.vm_handle_call.argtypes = (
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.POINTER(HostValue),
+        ctypes.POINTER(HostValue),
+    )
+    vm_.vm_handle_gc_stats.argtypes = (ctypes.c_void_p, ctypes.POINTER(GCStats))
+    vm_.vm_handle_gc_stats.restype = None
+    vm_.vm_handle_free.argtypes = (ctypes.c_void_p,)
+    vm_.vm_handle_free.restype = None
+    return vm_
+
+
+# each VM run is independent, the statistics are kept for the calling thread
+_last_run = threading.local()
 
 
-def run_vm(program: ByteCodeProgramSerializer):
+def run_vm(
+    program: ByteCodeProgramSerializer,
+    max_frames: int = 0,
+    gc_initial_heap: int = 0,
+    gc_growth_factor: float = 0.0,
+    profile_interval: int = 0,
+    count_ops: bool = False,
+):
     """
     Runs the vm with the given bytecode program.
 
     Args:
-        num_bytes (int): size of bytes
         program (ByteCodeProgramSerializer): bytecode program
+        max_frames (int): call depth limit, 0 for the VM default
+        gc_initial_heap (int): heap size in bytes of the first full
+            collection, 0 for the VM default
+        gc_growth_factor (float): heap growth between full collections, 0
+            for the VM default
+        profile_interval (int): sample the frame stack every N instructions,
+            0 disables profiling
+        count_ops (bool): count the executed instructions
 
     Returns:
         int: vm return code
     """
-    code = program.get_bytes()
-    byte_buff = ctypes.create_string_buffer(code)
-    return vm_.run_vm(ctypes.c_int(len(code)), byte_buff)
+    return run_vm_code(
+        program.get_bytes(),
+        max_frames,
+        gc_initial_heap,
+        gc_growth_factor,
+        profile_interval,
+        count_ops,
+    )
 
 
-def run_vm_code(code: bytes):
+def run_vm_code(
+    code: bytes,
+    max_frames: int = 0,
+    gc_initial_heap: int = 0,
+    gc_growth_factor: float = 0.0,
+    profile_interval: int = 0,
+    count_ops: bool = False,
+):
     """
     Runs the vm with the given bytecode.
 
     Args:
-        num_bytes (int): size of bytes
         code (bytes): bytecode
+        max_frames (int): call depth limit, 0 for the VM default. Deeper calls
+            stop the program with a stack overflow error.
+        gc_initial_heap (int): heap size in bytes of the first full
+            collection, 0 for the VM default (1MiB)
+        gc_growth_factor (float): the next full collection runs once the heap
+            grows to this factor times the bytes left live by the last one, 0
+            for the VM default (2.0)
+        profile_interval (int): sample the frame stack every N executed
+            instructions, see profile_stacks. 0 disables profiling.
+        count_ops (bool): count the executed instructions, see op_stats
 
     Returns:
         int: vm return code
     """
     byte_buff = ctypes.create_string_buffer(code)
-    return vm_.run_vm(ctypes.c_int(len(code)), byte_buff)
+    stats = GCStats()
+    profile = Profile(interval=profile_interval)
+    counts = OpStats() if count_ops else None
+    # ctypes releases the GIL during the call, programs can run in parallel
+    # from several threads
+    res = _library().run_vm(
+        ctypes.c_int(len(code)),
+        byte_buff,
+        ctypes.c_uint32(max_frames),
+        ctypes.c_size_t(gc_initial_heap),
+        ctypes.c_double(gc_growth_factor),
+        ctypes.byref(stats),
+        ctypes.byref(profile) if profile_interval > 0 else None,
+        ctypes.byref(counts) if count_ops else None,
+    )
+    _last_run.gc_stats = stats
+    _last_run.profile_stacks = profile.stacks()
+    _library().vm_profile_free(ctypes.byref(profile))
+    if count_ops:
+        counts.chunk_counts = counts.chunks_[: counts.chunk_count]
+        _library().vm_op_stats_free(ctypes.byref(counts))
+    _last_run.op_stats = counts
+    return res
+
+
+def gc_stats() -> GCStats:
+    """
+    Returns the garbage collector statistics of the last VM run of the calling
+    thread.
+    """
+    return getattr(_last_run, "gc_stats", GCStats())
+
+
+def profile_stacks() -> list[tuple[tuple[int, int], ...]]:
+    """
+    Returns the frame stacks sampled by the last profiled VM run of the calling
+    thread, see Profile.stacks.
+    """
+    return getattr(_last_run, "profile_stacks", [])
+
+
+def op_stats() -> OpStats | None:
+    """
+    Returns the instructions executed by the last VM run of the calling
+    thread, None if it did not count them.
+    """
+    return getattr(_last_run, "op_stats", None)
+
+
+class VMError(Exception):
+    """
+    A program run by a VMHandle stopped with an error or one of its functions
+    could not be called, the VM prints the cause on stderr.
+    """
+
+
+class VMHandle:
+    """
+    A program loaded once in a VM of its own, whose functions are then called
+    many times without reloading the bytecode, the constants and the natives.
+    The top level runs when the handle is created and its globals are kept
+    between calls.
+
+    Arguments and results are None, bool, int, float or str. The bytecode
+    records the parameter types of each function and a call whose arguments
+    do not have them is refused, ints are not converted to floats. A handle can
+    be used from any thread, the calls are serialized.
+
+        with VMHandle(serializer.get_bytes()) as vm:
+            vm.call("score", 3, 1.5, True)
+    """
+
+    def __init__(
+        self,
+        code: bytes,
+        max_frames: int = 0,
+        gc_initial_heap: int = 0,
+        gc_growth_factor: float = 0.0,
+    ) -> None:
+        """
+        Loads _code_ and runs its top level, the VM options are the ones of
+        run_vm_code.
+
+        Raises:
+            VMError: if the top level stops with an error
+        """
+        self.__lock = threading.Lock()
+        self.__handle = _library().vm_handle_new(
+            ctypes.c_int(len(code)),
+            code,
+            ctypes.c_uint32(max_frames),
+            ctypes.c_size_t(gc_initial_heap),
+            ctypes.c_double(gc_growth_factor),
+        )
+        res = _library().vm_handle_run(self.__handle)
+        if res != 0:
+            self.close()
+            raise VMError(f"the top level stopped with code {res}")
+
+    def call(self, name: str, *args):
+        """
+        Calls the uza function _name_ with _args_ and returns its result.
+
+        Raises:
+            TypeError: if an argument does not have the type of its parameter
+            VMError: if the function does not exist, takes another number of
+                arguments or stops with an error. The globals keep the values
+                set before the error.
+        """
+        keep_alive = []
+        c_args = (HostValue * len(args))(
+            *(HostValue.from_python(arg, keep_alive) for arg in args)
+        )
+        result = HostValue()
+        with self.__lock:
+            if self.__handle is None:
+                raise VMError("the VM is closed")
+            res = _library().vm_handle_call(
+                self.__handle,
+                name.encode("ascii"),
+                len(args),
+                c_args,
+                ctypes.byref(result),
+            )
+            # a string result lives in the VM until the next call
+            value = result.to_python()
+        if res == VM_CALL_TYPE_MISMATCH:
+            raise TypeError(f"arguments of the wrong type passed to '{name}'")
+        if res != 0:
+            raise VMError(f"call to '{name}' failed with code {res}")
+        return value
+
+    def gc_stats(self) -> GCStats:
+        """
+        Returns the garbage collector statistics since the handle was created.
+        """
+        stats = GCStats()
+        with self.__lock:
+            if self.__handle is None:
+                raise VMError("the VM is closed")
+            _library().vm_handle_gc_stats(self.__handle, ctypes.byref(stats))
+        return stats
+
+    def close(self) -> None:
+        """
+        Frees the VM, the handle cannot be called anymore.
+        """
+        with self.__lock:
+            if self.__handle is not None:
+                _library().vm_handle_free(self.__handle)
+                self.__handle = None
+
+    def __enter__(self) -> "VMHandle":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "_VMHandle__handle", None) is not None:
+            self.close()
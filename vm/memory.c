@@ -8,16 +8,16 @@
 #include "debug.h"
 #endif
 
-void *reallocate(void *ptr, size_t old_size, size_t new_size) {
-  vm.bytesAllocated += new_size - old_size;
+void *reallocate(VM *vm, void *ptr, size_t old_size, size_t new_size) {
+  vm->bytesAllocated += new_size - old_size;
+  // only growing allocations collect, frees happen during sweeps
   if (new_size > old_size) {
 #ifdef DEBUG_STRESS_GC
-    collectGarbage();
+    collectGarbage(vm);
 #endif
-  }
-
-  if (vm.bytesAllocated > vm.nextGC) {
-    collectGarbage();
+    if (vm->bytesAllocated > vm->nextGC) {
+      collectGarbage(vm);
+    }
   }
 
   if (new_size == 0) {
@@ -33,131 +33,279 @@ void *reallocate(void *ptr, size_t old_size, size_t new_size) {
   return new_ptr;
 }
 
-void object_free(Obj *obj) {
+size_t object_free(VM *vm, Obj *obj) {
   switch (obj->type) {
   case OBJ_STRING:
-    object_string_free((ObjectString *)obj);
-    break;
-  default:
-    break;
+    return object_string_free(vm, (ObjectString *)obj);
+  case OBJ_FUNCTION_NATIVE:
+  case OBJ_FUNCTION:
+    return object_function_free(vm, (ObjectFunction *)obj);
+  case OBJ_LIST:
+    return object_list_free(vm, (ObjectList *)obj);
   }
+  return 0;
 }
 
-void markValue(Value value) {
+void markValue(VM *vm, Value value) {
   if (IS_OBJECT(value))
-    markObject(AS_OBJECT(value));
+    markObject(vm, AS_OBJECT(value));
 }
 
-void markObject(Obj *object) {
+void markObject(VM *vm, Obj *object) {
   if (object == NULL)
     return;
   if (object->is_marked)
     return;
+  // minor collections assume the old generation is live
+  if (vm->gc_minor && object->is_old)
+    return;
   object->is_marked = true;
 
-  if (vm.gray_capacity < vm.gray_count + 1) {
-    vm.gray_capacity = GROW_CAPACITY(vm.gray_capacity);
-    vm.gray_stack =
-        (Obj **)realloc(vm.gray_stack, sizeof(Obj *) * vm.gray_capacity);
+  if (vm->gray_capacity < vm->gray_count + 1) {
+    vm->gray_capacity = GROW_CAPACITY(vm->gray_capacity);
+    vm->gray_stack =
+        (Obj **)realloc(vm->gray_stack, sizeof(Obj *) * vm->gray_capacity);
   }
 
-  vm.gray_stack[vm.gray_count++] = object;
-  if (vm.gray_stack == NULL)
+  vm->gray_stack[vm->gray_count++] = object;
+  if (vm->gray_stack == NULL)
     exit(1);
 }
 
-static void markArray(ValueArray *array) {
+static void markArray(VM *vm, ValueArray *array) {
   for (int i = 0; i < array->count; i++) {
-    markValue(array->values[i]);
+    markValue(vm, array->values[i]);
   }
 }
 
-static void blackenObject(Obj *object) {
+static void blackenObject(VM *vm, Obj *object) {
 #ifdef DEBUG_LOG_GC
   DEBUG_PRINT("%p blacken ", (void *)object);
-  PRINT_VALUE(VAL_OBJ(object), stderr);
+  PRINT_VALUE(vm, VAL_OBJ(object), stderr);
   DEBUG_PRINT(NEWLINE);
 #endif
   switch (object->type) {
   case OBJ_FUNCTION_NATIVE: {
     ObjectFunction *func = (ObjectFunction *)object;
-    markObject((Obj *)func->name);
+    markObject(vm, (Obj *)func->name);
     break;
   }
   case OBJ_FUNCTION: {
     ObjectFunction *func = (ObjectFunction *)object;
-    markObject((Obj *)func->name);
-    markArray(&func->chunk->constants);
+    markObject(vm, (Obj *)func->name);
+    markArray(vm, &func->chunk->constants);
     break;
   }
   case OBJ_LIST: {
     ObjectList *list = (ObjectList *)object;
-    markObject(&list->obj);
-    markArray(&list->list);
+    markObject(vm, &list->obj);
+    markArray(vm, &list->list);
+    break;
   }
-  case OBJ_STRING:
+  case OBJ_STRING: {
+    ObjectString *string = (ObjectString *)object;
+    markObject(vm, (Obj *)string->left);
+    markObject(vm, (Obj *)string->right);
     break;
   }
+  }
 }
 
-static void traceReferences() {
-  while (vm.gray_count > 0) {
-    Obj *object = vm.gray_stack[--vm.gray_count];
-    blackenObject(object);
+static void traceReferences(VM *vm) {
+  while (vm->gray_count > 0) {
+    Obj *object = vm->gray_stack[--vm->gray_count];
+    blackenObject(vm, object);
   }
 }
 
-static void markRoots() {
-  for (Value *slot = vm.stack; slot < vm.stack_top; slot++) {
-    markValue(*slot);
+static void markRoots(VM *vm) {
+  for (Value *slot = vm->stack; slot < vm->stack_top; slot++) {
+    markValue(vm, *slot);
   }
 
-  for (int i = 0; i <= vm.depth; i++) {
-    markObject((Obj *)vm.frame_stacks[i].function);
+  for (int i = 0; i <= vm->depth; i++) {
+    markObject(vm, (Obj *)vm->frame_stacks[i].function);
+  }
+  for (size_t i = 0; i < vm->chunk_count; i++) {
+    markObject(vm, (Obj *)vm->functions[i]);
+  }
+  markTable(vm, &vm->globals);
+  for (uint32_t i = 0; i < vm->global_count; i++) {
+    markValue(vm, vm->global_slots[i]);
+    markObject(vm, (Obj *)vm->global_names[i]);
+  }
+  if (vm->gc_minor) {
+    for (int i = 0; i < vm->remembered_count; i++) {
+      blackenObject(vm, vm->remembered[i]);
+    }
+  } else {
+    // constants are loaded with the program, in the old generation
+    for (size_t i = 0; i < vm->chunk_count; i++) {
+      markArray(vm, &vm->chunks[i]->constants);
+    }
   }
-  markTable(&vm.globals);
 }
 
-void sweep() {
+static void forgetRemembered(VM *vm) {
+  for (int i = 0; i < vm->remembered_count; i++) {
+    vm->remembered[i]->is_remembered = false;
+  }
+  vm->remembered_count = 0;
+}
+
+static void freeObject(VM *vm, Obj *object) {
+#ifdef DEBUG_LOG_GC
+  // the contents of a list may already be freed, do not print them
+  DEBUG_PRINT("%p free type %d" NEWLINE, (void *)object, object->type);
+#endif // DEBUG_LOG_GC
+  vm->gc_stats.bytes_freed += object_free(vm, object);
+  vm->gc_stats.objects_freed++;
+}
+
+void sweep(VM *vm) {
   Obj *previous = NULL;
-  Obj *object = vm.objects;
+  Obj *object = vm->objects;
   while (object != NULL) {
     if (object->is_marked) {
       object->is_marked = false;
       previous = object;
       object = object->next;
     } else {
-#ifdef DEBUG_LOG_GC
-      DEBUG_PRINT("freeing object: ");
-      PRINT_VALUE(VAL_OBJ(object), stderr);
-      DEBUG_PRINT(NEWLINE);
-#endif // DEBUG_LOG_GC
-
       Obj *unreached = object;
       object = object->next;
       if (previous != NULL) {
         previous->next = object;
       } else {
-        vm.objects = object;
+        vm->objects = object;
       }
 
-      free(unreached);
+      freeObject(vm, unreached);
     }
   }
 }
 
-void collectGarbage() {
-  if (!vm.enable_GC)
+// Empties the nursery, reached objects are promoted to the old generation.
+// Unreached strings are removed from the interned strings if _unintern_, a
+// major collection already did it for the whole table.
+static void sweepYoung(VM *vm, bool unintern) {
+  Obj *object = vm->young_objects;
+  while (object != NULL) {
+    Obj *next = object->next;
+    if (object->is_marked) {
+      object->is_marked = false;
+      object->is_old = true;
+      object->next = vm->objects;
+      vm->objects = object;
+      vm->gc_stats.objects_promoted++;
+    } else {
+      if (unintern && object->type == OBJ_STRING &&
+          ((ObjectString *)object)->is_interned) {
+        tableDelete(&vm->strings, (ObjectString *)object);
+      }
+      freeObject(vm, object);
+    }
+    object = next;
+  }
+  vm->young_objects = NULL;
+  vm->young_bytes = 0;
+}
+
+static void recordPause(VM *vm, uint64_t start, uint64_t *total) {
+  uint64_t pause = native_clock_ns() - start;
+  *total += pause;
+  vm->gc_stats.total_pause_ns += pause;
+  vm->gc_stats.live_bytes = vm->bytesAllocated;
+  if (pause > vm->gc_stats.max_pause_ns) {
+    vm->gc_stats.max_pause_ns = pause;
+  }
+}
+
+void collectGarbage(VM *vm) {
+  if (!vm->enable_GC)
     return;
 #ifdef DEBUG_LOG_GC
   DEBUG_PRINT(BRIGHT_YELLOW "-- GC BEGIN --\n" RESET);
 #endif
-  markRoots();
-  traceReferences();
-  tableRemoveWhite(&vm.strings);
-  sweep();
+  uint64_t start = native_clock_ns();
+  vm->gc_minor = false;
+  markRoots(vm);
+  traceReferences(vm);
+  tableRemoveWhite(&vm->strings);
+  sweep(vm);
+  sweepYoung(vm, false);
+  forgetRemembered(vm);
+  // pace the next full collection on what survived this one
+  vm->nextGC = MAX((size_t)(vm->bytesAllocated * vm->gc_growth_factor),
+                   vm->gc_initial_heap);
+  vm->gc_stats.major_collections++;
+  recordPause(vm, start, &vm->gc_stats.major_pause_ns);
 
 #ifdef DEBUG_LOG_GC
   DEBUG_PRINT(BRIGHT_YELLOW "-- GC END --\n" RESET);
 #endif
 }
+
+// Minor collection: only the nursery is traced and swept, the old generation
+// is assumed live and the remembered set holds its references to young
+// objects.
+void collectYoung(VM *vm) {
+  if (!vm->enable_GC)
+    return;
+#ifdef DEBUG_LOG_GC
+  DEBUG_PRINT(BRIGHT_YELLOW "-- MINOR GC BEGIN --\n" RESET);
+#endif
+  uint64_t start = native_clock_ns();
+  vm->gc_minor = true;
+  markRoots(vm);
+  traceReferences(vm);
+  sweepYoung(vm, true);
+  forgetRemembered(vm);
+  vm->gc_minor = false;
+  vm->gc_stats.minor_collections++;
+  recordPause(vm, start, &vm->gc_stats.minor_pause_ns);
+
+#ifdef DEBUG_LOG_GC
+  DEBUG_PRINT(BRIGHT_YELLOW "-- MINOR GC END --\n" RESET);
+#endif
+}
+
+void gc_nursery_reserve(VM *vm, size_t size) {
+  vm->young_bytes += size;
+#ifdef DEBUG_STRESS_GC
+  collectYoung(vm);
+#endif
+  if (vm->young_bytes > GC_NURSERY_SIZE) {
+    collectYoung(vm);
+  }
+}
+
+void gc_nursery_link(VM *vm, Obj *object) {
+  object->is_old = false;
+  object->next = vm->young_objects;
+  vm->young_objects = object;
+}
+
+// Moves the whole nursery to the old generation without collecting it, used
+// once the program is loaded.
+void gc_promote_nursery(VM *vm) {
+  while (vm->young_objects != NULL) {
+    Obj *object = vm->young_objects;
+    vm->young_objects = object->next;
+    object->is_old = true;
+    object->next = vm->objects;
+    vm->objects = object;
+  }
+  vm->young_bytes = 0;
+}
+
+void gc_remember(VM *vm, Obj *object) {
+  if (vm->remembered_capacity < vm->remembered_count + 1) {
+    vm->remembered_capacity = GROW_CAPACITY(vm->remembered_capacity);
+    vm->remembered = (Obj **)realloc(
+        vm->remembered, sizeof(Obj *) * vm->remembered_capacity);
+    if (vm->remembered == NULL)
+      exit(1);
+  }
+  object->is_remembered = true;
+  vm->remembered[vm->remembered_count++] = object;
+}
@@ -3,6 +3,7 @@
 #include <stdlib.h>
 #include <time.h>
 
+#include "memory.h"
 #include "native.h"
 #include "value.h"
 #include "vm.h"
@@ -14,60 +15,61 @@ static LARGE_INTEGER frequency = {.QuadPart = -1LL};
 
 static bool rand_seed_set = false;
 
-void native_println(void) {
-  Value val = pop();
+void native_println(VM *vm) {
+  Value val = pop(vm);
 #ifndef NDEBUG
   fflush(stdout);
   DEBUG_PRINT(BRIGHT_RED "STDOUT PRINTLN:`" RESET);
   fflush(stderr);
 #endif
 
-  PRINT_VALUE(val, stdout);
+  PRINT_VALUE(vm, val, stdout);
   printf(NEWLINE);
 
 #ifndef NDEBUG
   fflush(stdout);
   DEBUG_PRINT(BRIGHT_RED "`" RESET NEWLINE);
 #endif
-  push(VAL_NIL);
+  push(vm, VAL_NIL);
 }
 
-void native_print(void) {
-  Value val = pop();
+void native_print(VM *vm) {
+  Value val = pop(vm);
 #ifndef NDEBUG
   fflush(stdout);
   DEBUG_PRINT(BRIGHT_RED "STDOUT PRINTLN:`" RESET);
   fflush(stderr);
 #endif
 
-  PRINT_VALUE(val, stdout);
+  PRINT_VALUE(vm, val, stdout);
 
 #ifndef NDEBUG
   fflush(stdout);
   DEBUG_PRINT(BRIGHT_RED "`" RESET NEWLINE);
 #endif
-  push(VAL_NIL);
+  push(vm, VAL_NIL);
 }
 
-void native_flush(void) {
+void native_flush(VM *vm) {
   fflush(stdout);
-  push(VAL_NIL);
+  push(vm, VAL_NIL);
 }
 
-void native_list_construct(void) {
-  ObjectList *list = object_list_allocate();
-  push(VAL_OBJ(list));
+void native_list_construct(VM *vm) {
+  ObjectList *list = object_list_allocate(vm);
+  push(vm, VAL_OBJ(list));
 }
 
-void native_list_append(void) {
-  Value val = PEEK_AT(0);
-  Value list = PEEK_AT(1);
-  value_array_write(&AS_LIST(list)->list, val);
-  POP_COUNT(2);
-  push(VAL_NIL);
+void native_list_append(VM *vm) {
+  Value val = PEEK_AT(vm, 0);
+  Value list = PEEK_AT(vm, 1);
+  value_array_write(vm, &AS_LIST(list)->list, val);
+  gc_write_barrier(vm, AS_OBJECT(list), val);
+  POP_COUNT(vm, 2);
+  push(vm, VAL_NIL);
 }
 
-void native_len(void) {
+void native_len(VM *vm) {
   Value res = VAL_NIL;
 
   Value val = PEEK(vm);
@@ -79,16 +81,16 @@ void native_len(void) {
     PRINT_ERR("Called len on invalid value.");
     exit(1);
   }
-  POP_COUNT(1);
-  push(res);
+  POP_COUNT(vm, 1);
+  push(vm, res);
 }
 
-void native_get(void) {
+void native_get(VM *vm) {
   Value res = VAL_NIL;
 
-  Value index = PEEK_AT(0);
-  int i = index.as.integer;
-  Value val = PEEK_AT(1);
+  Value index = PEEK_AT(vm, 0);
+  int i = AS_INTEGER(index);
+  Value val = PEEK_AT(vm, 1);
   if (IS_LIST(val)) {
     int list_count = AS_LIST(val)->list.count;
     if (i >= list_count) {
@@ -110,22 +112,22 @@ void native_get(void) {
     if (i < 0) {
       i = (i % string_len + string_len) % string_len;
     }
-    ObjectString *character =
-        object_string_allocate(&vm.strings, &AS_STRING(val)->chars[i], 1);
+    const char *chars = object_string_chars(vm, AS_STRING(val));
+    ObjectString *character = object_string_allocate(vm, &chars[i], 1);
     res = (VAL_OBJ(character));
   } else {
     PRINT_ERR("Called get on invalid value.");
     exit(1);
   }
-  POP_COUNT(2);
-  push(res);
+  POP_COUNT(vm, 2);
+  push(vm, res);
 }
 
-void native_set(void) {
-  Value new_val = PEEK_AT(0);
-  Value index = PEEK_AT(1);
-  int i = index.as.integer;
-  Value val = PEEK_AT(2);
+void native_set(VM *vm) {
+  Value new_val = PEEK_AT(vm, 0);
+  Value index = PEEK_AT(vm, 1);
+  int i = AS_INTEGER(index);
+  Value val = PEEK_AT(vm, 2);
   if (IS_LIST(val)) {
     if (i >= AS_LIST(val)->list.count) {
       PRINT_ERR_ARGS("Index out of bounds: %d for list of size %d.", i,
@@ -134,22 +136,23 @@ void native_set(void) {
     }
 
     AS_LIST(val)->list.values[i] = new_val;
+    gc_write_barrier(vm, AS_OBJECT(val), new_val);
   } else {
     PRINT_ERR("Called set on invalid value.");
     exit(1);
   }
-  POP_COUNT(3);
-  push(VAL_NIL);
+  POP_COUNT(vm, 3);
+  push(vm, VAL_NIL);
 }
 
-void native_substring(void) {
+void native_substring(VM *vm) {
   Value res = VAL_NIL;
 
-  Value end_val = PEEK_AT(0);
-  Value start_val = PEEK_AT(1);
-  Value val = PEEK_AT(2);
-  int start = start_val.as.integer;
-  int end = end_val.as.integer;
+  Value end_val = PEEK_AT(vm, 0);
+  Value start_val = PEEK_AT(vm, 1);
+  Value val = PEEK_AT(vm, 2);
+  int start = AS_INTEGER(start_val);
+  int end = AS_INTEGER(end_val);
   if (IS_STRING(val)) {
     if (end > AS_STRING(val)->length) {
       PRINT_ERR_ARGS("Index out of bounds: %d for string of length %d.", end,
@@ -161,15 +164,16 @@ void native_substring(void) {
                      AS_STRING(val)->length);
       exit(1);
     }
-    ObjectString *character = object_string_allocate(
-        &vm.strings, &AS_STRING(val)->chars[start], end - start);
+    const char *chars = object_string_chars(vm, AS_STRING(val));
+    ObjectString *character =
+        object_string_allocate(vm, &chars[start], end - start);
     res = (VAL_OBJ(character));
   } else {
     PRINT_ERR("Called do substring on invalid value.");
     exit(1);
   }
-  POP_COUNT(3);
-  push(res);
+  POP_COUNT(vm, 3);
+  push(vm, res);
 }
 
 static int asc_cmp(const void *a, const void *b) {
@@ -200,40 +204,43 @@ static int desc_cmp(const void *a, const void *b) {
   }
 }
 
-void native_sort(void) {
-  Value desc = pop();
-  Value list = pop();
-  if (desc.as.boolean) {
+void native_sort(VM *vm) {
+  Value desc = pop(vm);
+  Value list = pop(vm);
+  if (AS_BOOL(desc)) {
     qsort(AS_LIST(list)->list.values, AS_LIST(list)->list.count, sizeof(Value),
           desc_cmp);
   } else {
     qsort(AS_LIST(list)->list.values, AS_LIST(list)->list.count, sizeof(Value),
           asc_cmp);
   }
-  push(VAL_NIL);
+  push(vm, VAL_NIL);
 }
 
-void native_time_ns() {
-  Value ret;
+uint64_t native_clock_ns(void) {
 #ifdef _WIN32
   LARGE_INTEGER ticks;
   if (frequency.QuadPart == -1)
     QueryPerformanceFrequency(&frequency);
 
   QueryPerformanceCounter(&ticks);
-  ret = VAL_INT(
-      (uint64_t)((ticks.QuadPart * 1000000000ULL) / frequency.QuadPart));
+  // ticks * 1e9 overflows after a few minutes of uptime, split off the
+  // whole seconds first
+  uint64_t count = (uint64_t)ticks.QuadPart;
+  uint64_t freq = (uint64_t)frequency.QuadPart;
+  return (count / freq) * 1000000000ULL + (count % freq) * 1000000000ULL / freq;
 #elif defined(__MACH__)
-  ret = VAL_INT((uint64_t)clock_gettime_nsec_np(CLOCK_MONOTONIC_RAW));
+  return (uint64_t)clock_gettime_nsec_np(CLOCK_MONOTONIC_RAW);
 #else
   struct timespec ts;
   clock_gettime(CLOCK_MONOTONIC_RAW, &ts);
-  ret = VAL_INT((uint64_t)(ts.tv_sec * 1000000000ULL + ts.tv_nsec));
+  return (uint64_t)(ts.tv_sec * 1000000000ULL + ts.tv_nsec);
 #endif
-  push(ret);
 }
 
-void native_time_ms() {
+void native_time_ns(VM *vm) { push(vm, VAL_INT(native_clock_ns())); }
+
+void native_time_ms(VM *vm) {
   Value ret;
 #ifdef _WIN32
   LARGE_INTEGER ticks;
@@ -247,32 +254,32 @@ void native_time_ms() {
   clock_gettime(CLOCK_MONOTONIC_RAW, &ts);
   ret = VAL_INT((uint64_t)(ts.tv_sec * 1000ULL + ts.tv_nsec / 1000000ULL));
 #endif
-  push(ret);
+  push(vm, ret);
 }
 
-void native_abs() {
-  Value a = pop();
+void native_abs(VM *vm) {
+  Value a = pop(vm);
   if (IS_INTEGER(a)) {
-    push(VAL_INT(llabs(a.as.integer)));
+    push(vm, VAL_INT(llabs(AS_INTEGER(a))));
   } else {
-    push(VAL_FLOAT(fabs(a.as.fp)));
+    push(vm, VAL_FLOAT(fabs(AS_DOUBLE(a))));
   }
 }
 
-void native_rand_int() {
-  Value a = pop();
+void native_rand_int(VM *vm) {
+  Value a = pop(vm);
   if (!rand_seed_set) {
     srand(time(NULL));
     rand_seed_set = true;
   }
   int val = rand();
   val = (val * AS_INTEGER(a)) / RAND_MAX;
-  push(VAL_INT(val));
+  push(vm, VAL_INT(val));
 }
 
-void native_sleep(void) {
-  Value a = pop();
-  int milliseconds = a.as.integer;
+void native_sleep(VM *vm) {
+  Value a = pop(vm);
+  int milliseconds = AS_INTEGER(a);
 #ifdef WIN32
   Sleep(milliseconds);
 #else
@@ -281,7 +288,7 @@ void native_sleep(void) {
   ts.tv_nsec = (milliseconds % 1000) * 1000000;
   nanosleep(&ts, NULL);
 #endif
-  push(VAL_NIL);
+  push(vm, VAL_NIL);
 }
 
 const NativeFunction native_builtins[] = {
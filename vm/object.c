@@ -14,102 +14,195 @@ static uint32_t hash_string(const char *key, int length) {
   return hash;
 }
 
-ObjectString *object_string_allocate(Table *strings, const char *chars,
+// Allocates a zeroed object of _size_ bytes in the nursery, the allocation is
+// accounted like any other and may collect first.
+static Obj *object_allocate(VM *vm, size_t size, ObjectType type) {
+  gc_nursery_reserve(vm, size);
+  Obj *object = reallocate(vm, NULL, 0, size);
+  memset(object, 0, size);
+  object->type = type;
+  gc_nursery_link(vm, object);
+  return object;
+}
+
+static ObjectString *string_allocate(VM *vm, const char *chars,
+                                     const int string_length) {
+  ObjectString *str = (ObjectString *)object_allocate(
+      vm, sizeof(ObjectString) + string_length + 1, OBJ_STRING);
+  str->length = string_length;
+  str->chars = str->data;
+  memcpy(str->chars, chars, string_length);
+  str->chars[string_length] = 0;
+  return str;
+}
+
+ObjectString *object_string_allocate(VM *vm, const char *chars,
                                      const int string_length) {
   uint32_t hash = hash_string(chars, string_length);
-  ObjectString *res = tableFindString(strings, chars, string_length, hash);
+  ObjectString *res = tableFindString(&vm->strings, chars, string_length, hash);
   if (res != NULL) {
     return res;
   }
 
-  size_t alloc_size = sizeof(Obj) + sizeof(int) + sizeof(ObjectFunction *) +
-                      sizeof(uint32_t) + string_length + 1;
-
-  vm.bytesAllocated += alloc_size;
-#ifdef DEBUG_STRESS_GC
-  collectGarbage();
-#endif
-  if (vm.bytesAllocated > vm.nextGC) {
-    collectGarbage();
-  }
-  vm.nextGC = vm.bytesAllocated * GC_HEAP_GROW_FACTOR;
-
-  ObjectString *str = calloc(1, alloc_size);
-  str->length = string_length;
-  memcpy(str->chars, chars, string_length);
-  str->chars[string_length] = 0;
-  str->obj.type = OBJ_STRING;
-  str->obj.next = NULL;
+  ObjectString *str = string_allocate(vm, chars, string_length);
   str->hash = hash;
-  tableSet(strings, str, VAL_NIL);
-  str->obj.next = vm.objects;
-  vm.objects = (Obj *)str;
+  str->is_interned = true;
+  // growing the table may collect, keep the new string reachable
+  push(vm, VAL_OBJ(str));
+  tableSet(vm, &vm->strings, str, VAL_NIL);
+  pop(vm);
   return str;
 }
 
+ObjectString *object_string_transient(VM *vm, const char *chars,
+                                      const int string_length) {
+  return string_allocate(vm, chars, string_length);
+}
+
 void object_string_hash(struct ObjectString *string) {
   assert(string->hash == 0);
   string->hash = hash_string(string->chars, string->length);
 }
 
-ObjectString *object_string_concat(Table *strings, const ObjectString *lhs,
-                                   const ObjectString *rhs) {
-  char static_buff[STRING_STACK_BUFF_LEN];
+// _lhs_ and _rhs_ must be reachable, the new string may collect.
+ObjectString *object_string_concat(VM *vm, ObjectString *lhs,
+                                   ObjectString *rhs) {
+  if (lhs->length == 0) {
+    return rhs;
+  }
+  if (rhs->length == 0) {
+    return lhs;
+  }
+
   int new_len = lhs->length + rhs->length;
-  char *buff = static_buff;
-  if (new_len + 1 > STRING_STACK_BUFF_LEN) {
-    buff = calloc(new_len + 1, sizeof(char));
-    if (buff == NULL) {
-      fprintf(stderr, "error: couldn't allocate to concat string\n");
-      exit(1);
+  if (new_len >= STRING_ROPE_MIN_LENGTH) {
+    ObjectString *rope =
+        (ObjectString *)object_allocate(vm, sizeof(ObjectString), OBJ_STRING);
+    rope->length = new_len;
+    rope->left = lhs;
+    rope->right = rhs;
+    return rope;
+  }
+
+  const char *lhs_chars = object_string_chars(vm, lhs);
+  const char *rhs_chars = object_string_chars(vm, rhs);
+  ObjectString *str = (ObjectString *)object_allocate(
+      vm, sizeof(ObjectString) + new_len + 1, OBJ_STRING);
+  str->length = new_len;
+  str->chars = str->data;
+  memcpy(str->chars, lhs_chars, lhs->length);
+  memcpy(str->chars + lhs->length, rhs_chars, rhs->length);
+  str->chars[new_len] = 0;
+  return str;
+}
+
+// Copies the leaves of _rope_ in order to _out_. Ropes built in a loop are
+// as deep as the number of concatenations, the nodes left to visit are kept
+// on the heap rather than the C stack.
+static void rope_flatten(ObjectString *rope, char *out) {
+  int capacity = MIN_ARRAY_CAP;
+  int count = 0;
+  ObjectString **pending = malloc(sizeof(ObjectString *) * capacity);
+  if (pending == NULL) {
+    PRINT_ERR("Could not allocate to flatten a string. Exiting...");
+    exit(1);
+  }
+
+  pending[count++] = rope;
+  while (count > 0) {
+    ObjectString *node = pending[--count];
+    if (node->chars != NULL) {
+      memcpy(out, node->chars, node->length);
+      out += node->length;
+      continue;
     }
+    if (count + 2 > capacity) {
+      capacity = GROW_CAPACITY(capacity);
+      pending = realloc(pending, sizeof(ObjectString *) * capacity);
+      if (pending == NULL) {
+        PRINT_ERR("Could not allocate to flatten a string. Exiting...");
+        exit(1);
+      }
+    }
+    pending[count++] = node->right;
+    pending[count++] = node->left;
   }
-  buff[0] = 0;
-  strncpy(buff, lhs->chars, lhs->length + 1);
-  strncat(buff, rhs->chars, new_len);
+  free(pending);
+}
 
-  ObjectString *new_str = object_string_allocate(strings, buff, new_len);
-  if (new_len > STRING_STACK_BUFF_LEN) {
-    free(buff);
+const char *object_string_chars(VM *vm, ObjectString *string) {
+  if (string->chars != NULL) {
+    return string->chars;
   }
-  return new_str;
+
+  // counted but never collects: the string may be held by a popped value
+  char *chars = malloc(string->length + 1);
+  if (chars == NULL) {
+    PRINT_ERR("Could not allocate to flatten a string. Exiting...");
+    exit(1);
+  }
+  vm->bytesAllocated += string->length + 1;
+  rope_flatten(string, chars);
+  chars[string->length] = 0;
+  string->chars = chars;
+  // the leaves can now be collected
+  string->left = NULL;
+  string->right = NULL;
+  return chars;
 }
 
-ObjectFunction *object_function_allocate() {
-  size_t alloc_size = sizeof(ObjectFunction);
-  vm.bytesAllocated += alloc_size;
-#ifdef DEBUG_STRESS_GC
-  collectGarbage();
-#endif
-  if (vm.bytesAllocated > vm.nextGC) {
-    collectGarbage();
+bool object_string_equal(VM *vm, ObjectString *lhs, ObjectString *rhs) {
+  if (lhs == rhs) {
+    return true;
+  }
+  if ((lhs->is_interned && rhs->is_interned) || lhs->length != rhs->length) {
+    return false;
   }
-  vm.nextGC = vm.bytesAllocated * GC_HEAP_GROW_FACTOR;
+  return memcmp(object_string_chars(vm, lhs), object_string_chars(vm, rhs),
+                lhs->length) == 0;
+}
 
-  ObjectFunction *function = (ObjectFunction *)calloc(1, alloc_size);
-  function->obj.next = vm.objects;
-  vm.objects = (Obj *)function;
-  function->obj.type = OBJ_FUNCTION;
+ObjectFunction *object_function_allocate(VM *vm) {
+  ObjectFunction *function = (ObjectFunction *)object_allocate(
+      vm, sizeof(ObjectFunction), OBJ_FUNCTION);
   function->arity = 0;
   function->name = NULL;
   // chunk_init(&function->chunk);
   return function;
 }
 
-void object_string_free(ObjectString *obj_string) { free(obj_string); }
+// The free functions return the number of bytes they released.
 
-ObjectList *object_list_allocate(void) {
-  ObjectList *list = ALLOCATE(ObjectList, 1);
-  value_array_init(&list->list);
+size_t object_function_free(VM *vm, ObjectFunction *function) {
+  reallocate(vm, function, sizeof(ObjectFunction), 0);
+  return sizeof(ObjectFunction);
+}
 
-  list->obj.type = OBJ_LIST;
-  list->obj.next = vm.objects;
-  vm.objects = &list->obj;
+size_t object_string_free(VM *vm, ObjectString *obj_string) {
+  size_t chars_size = obj_string->length + 1;
+  size_t object_size = sizeof(ObjectString);
+  size_t freed = 0;
+  if (obj_string->chars == obj_string->data) {
+    object_size += chars_size;
+  } else if (obj_string->chars != NULL) {
+    // the characters of a flattened rope are allocated on their own
+    reallocate(vm, obj_string->chars, chars_size, 0);
+    freed += chars_size;
+  }
+  reallocate(vm, obj_string, object_size, 0);
+  return freed + object_size;
+}
 
+ObjectList *object_list_allocate(VM *vm) {
+  ObjectList *list =
+      (ObjectList *)object_allocate(vm, sizeof(ObjectList), OBJ_LIST);
+  value_array_init(&list->list);
   return list;
 }
 
-void object_list_free(ObjectList *list) {
-  value_array_free(&list->list);
-  free(list);
+size_t object_list_free(VM *vm, ObjectList *list) {
+  size_t size = sizeof(ObjectList) + sizeof(Value) * list->list.capacity;
+  value_array_free(vm, &list->list);
+  reallocate(vm, list, sizeof(ObjectList), 0);
+  return size;
 }
@@ -9,6 +9,9 @@
 static bool system_is_little_endian;
 
 #define REV_U16(value) (((line << 8) & 0xFF00) | ((line >> 8) & 0x00FF))
+#define REV_U32(value)                                                         \
+  ((((value) >> 24) & 0x000000FFU) | (((value) >> 8) & 0x0000FF00U) |          \
+   (((value) << 8) & 0x00FF0000U) | (((value) << 24) & 0xFF000000U))
 
 // Convert little endian to big endian. Use memcpy for double before passing.
 // Check for asm output, on clang any setting above -O1 outputs "rev". Otherwise
@@ -41,7 +44,7 @@ void read_program_version(uint8_t *buff, program_bytes_t *program) {
   prog_read_bytes(buff, program, sizeof(uint8_t), 3);
 }
 
-void read_program(program_bytes_t *program) {
+void read_program(VM *vm, program_bytes_t *program) {
   int endian_test = 1;
   system_is_little_endian = endian_test == ((char *)&endian_test)[0];
   uint8_t version[3] = {0};
@@ -49,28 +52,110 @@ void read_program(program_bytes_t *program) {
   uint32_t chunk_count = 0;
   PROG_CPY(chunk_count, program, uint32_t);
 
-  vm.chunk_count = chunk_count;
-  vm.chunks = calloc(chunk_count, sizeof(Chunk *));
+  vm->chunk_count = chunk_count;
+  vm->chunks = calloc(chunk_count, sizeof(Chunk *));
+  vm->functions = calloc(chunk_count, sizeof(ObjectFunction *));
 
+  StringTable string_table = load_strings(vm, program);
+  load_globals(vm, program, &string_table);
   for (size_t i = 0; i < chunk_count; i++) {
-    load_chunk(i, program);
+    load_chunk(vm, i, program, &string_table);
   }
+  // the strings are referenced by the constant pools from now on
+  free(string_table.strings);
 }
 
-void load_chunk(size_t chunk_idx, program_bytes_t *program) {
-  vm.chunks[chunk_idx] = calloc(1, sizeof(Chunk));
-  Chunk *chunk = vm.chunks[chunk_idx];
+StringTable load_strings(VM *vm, program_bytes_t *program) {
+  // 4 bytes: the number of strings
+  StringTable table = {0};
+  PROG_CPY(table.count, program, uint32_t);
+  if (!system_is_little_endian) {
+    table.count = REV_U32(table.count);
+  }
+  table.strings = calloc(table.count, sizeof(ObjectString *));
+  if (table.count > 0 && table.strings == NULL) {
+    fprintf(stderr, "error: couldn't allocate the program string table\n");
+    exit(1);
+  }
+
+  for (size_t i = 0; i < table.count; i++) {
+    char buff[STRING_STACK_BUFF_LEN];
+    char *string = buff;
+    // TODO: lower, have to make REV for that size
+    //  8 bytes: string length
+    uint64_t string_length = 0;
+    PROG_CPY(string_length, program, int64_t);
+    if (!system_is_little_endian) {
+      string_length = REV_U64(string_length);
+    }
+    if (string_length > STRING_STACK_BUFF_LEN) {
+      string = calloc(string_length + 1, sizeof(char));
+      if (string == NULL) {
+        fprintf(stderr, "error: couldn't allocate to read program string\n");
+        exit(1);
+      }
+    }
+
+    prog_read_bytes(string, program, sizeof(char), string_length);
+    table.strings[i] = object_string_allocate(vm, string, string_length);
+    if (string_length > STRING_STACK_BUFF_LEN) {
+      free(string);
+    }
+  }
+  return table;
+}
+
+void load_globals(VM *vm, program_bytes_t *program, StringTable *string_table) {
+  // 4 bytes: the number of global slots
+  uint32_t count = 0;
+  PROG_CPY(count, program, uint32_t);
+  if (!system_is_little_endian) {
+    count = REV_U32(count);
+  }
+  vm->global_count = count;
+  vm->global_slots = malloc(count * sizeof(Value));
+  vm->global_names = calloc(count, sizeof(ObjectString *));
+  if (count > 0 && (vm->global_slots == NULL || vm->global_names == NULL)) {
+    fprintf(stderr, "error: couldn't allocate the global slots\n");
+    exit(1);
+  }
+
+  for (size_t i = 0; i < count; i++) {
+    // 4 bytes: index of the name in the string table
+    uint32_t name_idx = 0;
+    PROG_CPY(name_idx, program, uint32_t);
+    if (!system_is_little_endian) {
+      name_idx = REV_U32(name_idx);
+    }
+    if (name_idx >= string_table->count) {
+      PRINT_ERR_ARGS("string index out of bounds : %u", name_idx);
+      exit(1);
+    }
+    vm->global_slots[i] = VAL_NIL;
+    vm->global_names[i] = string_table->strings[name_idx];
+  }
+}
+
+void load_chunk(VM *vm, size_t chunk_idx, program_bytes_t *program,
+                StringTable *string_table) {
+  vm->chunks[chunk_idx] = calloc(1, sizeof(Chunk));
+  Chunk *chunk = vm->chunks[chunk_idx];
   chunk_init(chunk);
+  chunk->index = chunk_idx;
 
-  load_constants(&chunk->constants, program, &vm.strings);
-  uint8_t locals_count = 0;
-  PROG_CPY(locals_count, program, uint8_t);
+  load_constants(vm, &chunk->constants, program, string_table);
+  uint16_t locals_count = 0;
+  PROG_CPY(locals_count, program, uint16_t);
   chunk->local_count = locals_count;
 
   uint32_t ops_count = 0;
   PROG_CPY(ops_count, program, uint32_t);
   uint32_t ops_length = 0;
   PROG_CPY(ops_length, program, uint32_t);
+  PROG_CPY(chunk->param_count, program, uint8_t);
+  chunk->param_types = program->bytes;
+  program->bytes += chunk->param_count;
+  program->count -= chunk->param_count;
   chunk->code = program->bytes;
   DEBUG_PRINT("chunk count is %d\n", ops_count);
   chunk->count = ops_count;
@@ -88,71 +173,62 @@ void load_chunk(size_t chunk_idx, program_bytes_t *program) {
   // }
 }
 
-void load_constants(ValueArray *array, program_bytes_t *program,
-                    Table *strings) {
-  // 1 byte: the number of constants
-  uint8_t constants_count = 0;
-  PROG_CPY(constants_count, program, uint8_t);
+void load_constants(VM *vm, ValueArray *array, program_bytes_t *program,
+                    StringTable *string_table) {
+  // 2 bytes: the number of constants
+  uint16_t constants_count = 0;
+  PROG_CPY(constants_count, program, uint16_t);
   for (size_t i = 0; i < constants_count; i++) {
     // 1 byte: the ValueType
     uint8_t type_byte = 0;
     PROG_CPY(type_byte, program, uint8_t);
     ValueType type = (ValueType)type_byte;
 
-    Value constant = {.type = type, .as.integer = 0};
+    Value constant = VAL_NIL;
     switch (type) {
-    case TYPE_LONG:
+    case TYPE_LONG: {
       // 8 bytes: the int64 value
-      PROG_CPY(constant.as.integer, program, int64_t);
+      int64_t integer = 0;
+      PROG_CPY(integer, program, int64_t);
       if (!system_is_little_endian) {
-        constant.as.integer = REV_U64(constant.as.integer);
+        integer = REV_U64(integer);
       }
-      break;
-    case TYPE_DOUBLE:
+      constant = VAL_INT(integer);
+    } break;
+    case TYPE_DOUBLE: {
       // 8 bytes: the float value
-      prog_read_bytes(&(constant.as.fp), program, sizeof(double), 1);
+      double fp = 0;
+      prog_read_bytes(&fp, program, sizeof(double), 1);
       if (!system_is_little_endian) {
         uint64_t temp = 0;
-        memcpy(&temp, &constant.as.fp, sizeof(double));
+        memcpy(&temp, &fp, sizeof(double));
         temp = REV_U64(temp);
-        memcpy(&constant.as.fp, &temp, sizeof(double));
+        memcpy(&fp, &temp, sizeof(double));
       }
-      break;
-    case TYPE_BOOL:
-      PROG_CPY(constant.as.boolean, program, bool);
-      break;
+      constant = VAL_FLOAT(fp);
+    } break;
+    case TYPE_BOOL: {
+      bool boolean = false;
+      PROG_CPY(boolean, program, bool);
+      constant = VAL_BOOL(boolean);
+    } break;
     case TYPE_OBJ: {
       // 1 byte : object type
       uint8_t obj_type = 0;
       PROG_CPY(obj_type, program, uint8_t);
 
       if (((ObjectType)obj_type) == OBJ_STRING) {
-        char buff[STRING_STACK_BUFF_LEN];
-        char *string = buff;
-        // TODO: lower, have to make REV for that size
-        //  8 bytes: string length
-        uint64_t string_length = 0;
-        PROG_CPY(string_length, program, int64_t);
+        // 4 bytes: index in the program string table
+        uint32_t string_idx = 0;
+        PROG_CPY(string_idx, program, uint32_t);
         if (!system_is_little_endian) {
-          string_length = REV_U64(string_length);
-        }
-        if (string_length > STRING_STACK_BUFF_LEN) {
-          string = calloc(string_length + 1, sizeof(char));
-          if (string == NULL) {
-            fprintf(stderr,
-                    "error: couldn't allocate to read program string\n");
-            exit(1);
-          }
+          string_idx = REV_U32(string_idx);
         }
-
-        prog_read_bytes(string, program, sizeof(char), string_length);
-        ObjectString *const_pool_string =
-            object_string_allocate(strings, string, string_length);
-        constant.type = TYPE_OBJ;
-        constant.as.object = (Obj *)const_pool_string;
-        if (string_length > STRING_STACK_BUFF_LEN) {
-          free(string);
+        if (string_idx >= string_table->count) {
+          PRINT_ERR_ARGS("string index out of bounds : %u", string_idx);
+          exit(1);
         }
+        constant = VAL_OBJ(string_table->strings[string_idx]);
       } else {
         PRINT_ERR_ARGS("unrecognized object type : %d", obj_type);
         exit(1);
@@ -163,13 +239,14 @@ void load_constants(ValueArray *array, program_bytes_t *program,
       break;
     }
 
-    value_array_write(array, constant);
+    value_array_write(vm, array, constant);
   }
 }
-void load_op(size_t chunk_idx, uint16_t line, program_bytes_t *program) {
+void load_op(VM *vm, size_t chunk_idx, uint16_t line,
+             program_bytes_t *program) {
   // OpCode opcode = 0;
   // PROG_CPY(opcode, program, uint8_t);
-  // Chunk *chunk = vm.chunks[chunk_idx];
+  // Chunk *chunk = vm->chunks[chunk_idx];
   // switch (opcode) {
   //     case OP_DCONST:
   //     case OP_CALL:
@@ -37,8 +37,8 @@ void initTable(Table *table) {
   table->entries = NULL;
 }
 //> free-table
-void freeTable(Table *table) {
-  FREE_ARRAY(Entry, table->entries, table->capacity);
+void freeTable(VM *vm, Table *table) {
+  FREE_ARRAY(vm, Entry, table->entries, table->capacity);
   initTable(table);
 }
 //< free-table
@@ -104,8 +104,8 @@ bool tableGet(Table *table, ObjectString *key, Value *value) {
 }
 //< table-get
 //> table-adjust-capacity
-static void adjustCapacity(Table *table, int capacity) {
-  Entry *entries = ALLOCATE(Entry, capacity);
+static void adjustCapacity(VM *vm, Table *table, int capacity) {
+  Entry *entries = ALLOCATE(vm, Entry, capacity);
   for (int i = 0; i < capacity; i++) {
     entries[i].key = NULL;
     entries[i].value = VAL_NIL;
@@ -130,18 +130,18 @@ static void adjustCapacity(Table *table, int capacity) {
   //< re-hash
 
   //> Hash Tables free-old-array
-  FREE_ARRAY(Entry, table->entries, table->capacity);
+  FREE_ARRAY(vm, Entry, table->entries, table->capacity);
   //< Hash Tables free-old-array
   table->entries = entries;
   table->capacity = capacity;
 }
 //< table-adjust-capacity
 //> table-set
-bool tableSet(Table *table, ObjectString *key, Value value) {
+bool tableSet(VM *vm, Table *table, ObjectString *key, Value value) {
   //> table-set-grow
   if (table->count + 1 > table->capacity * TABLE_MAX_LOAD) {
     int capacity = GROW_CAPACITY(table->capacity);
-    adjustCapacity(table, capacity);
+    adjustCapacity(vm, table, capacity);
   }
 
   //< table-set-grow
@@ -177,11 +177,11 @@ bool tableDelete(Table *table, ObjectString *key) {
 }
 //< table-delete
 //> table-add-all
-void tableAddAll(Table *from, Table *to) {
+void tableAddAll(VM *vm, Table *from, Table *to) {
   for (int i = 0; i < from->capacity; i++) {
     Entry *entry = &from->entries[i];
     if (entry->key != NULL) {
-      tableSet(to, entry->key, entry->value);
+      tableSet(vm, to, entry->key, entry->value);
     }
   }
 }
@@ -231,11 +231,11 @@ void tableRemoveWhite(Table *table) {
 }
 //< Garbage Collection table-remove-white
 //> Garbage Collection mark-table
-void markTable(Table *table) {
+void markTable(VM *vm, Table *table) {
   for (int i = 0; i < table->capacity; i++) {
     Entry *entry = &table->entries[i];
-    markObject((Obj *)entry->key);
-    markValue(entry->value);
+    markObject(vm, (Obj *)entry->key);
+    markValue(vm, entry->value);
   }
 }
 //< Garbage Collection mark-table
@@ -1,18 +1,44 @@
 #include "value.h"
 #include "memory.h"
 
+bool values_equal(VM *vm, Value a, Value b) {
+  if (IS_DOUBLE(a) || IS_DOUBLE(b)) {
+    bool both_numbers = (IS_DOUBLE(a) || IS_INTEGER(a)) &&
+                        (IS_DOUBLE(b) || IS_INTEGER(b));
+    return both_numbers && AS_NUMBER(a) == AS_NUMBER(b);
+  }
+  if (VALUE_TYPE(a) != VALUE_TYPE(b)) {
+    return false;
+  }
+  switch (VALUE_TYPE(a)) {
+  case TYPE_NIL:
+    return true;
+  case TYPE_LONG:
+    return AS_INTEGER(a) == AS_INTEGER(b);
+  case TYPE_BOOL:
+    return AS_BOOL(a) == AS_BOOL(b);
+  case TYPE_OBJ:
+    if (IS_STRING(a) && IS_STRING(b)) {
+      return object_string_equal(vm, AS_STRING(a), AS_STRING(b));
+    }
+    return AS_OBJECT(a) == AS_OBJECT(b);
+  default:
+    return false;
+  }
+}
+
 void value_array_init(ValueArray *array) {
   array->capacity = 0;
   array->count = 0;
   array->values = NULL;
 }
 
-void value_array_write(ValueArray *array, Value value) {
+void value_array_write(VM *vm, ValueArray *array, Value value) {
   size_t capacity_new = 0;
   if (array->count + 1 > array->capacity) {
     capacity_new = GROW_CAPACITY(array->capacity);
     Value *values_new =
-        GROW_ARRAY(Value, array->values, array->capacity, capacity_new);
+        GROW_ARRAY(vm, Value, array->values, array->capacity, capacity_new);
     array->values = values_new;
     array->capacity = capacity_new;
   }
@@ -21,21 +47,21 @@ void value_array_write(ValueArray *array, Value value) {
   array->count += 1;
 }
 
-void value_array_free(ValueArray *array) {
-  FREE_ARRAY(Value, array->values, array->capacity);
+void value_array_free(VM *vm, ValueArray *array) {
+  FREE_ARRAY(vm, Value, array->values, array->capacity);
   value_array_init(array);
 }
 
-void value_array_print(ValueArray *array, FILE *out) {
+void value_array_print(VM *vm, ValueArray *array, FILE *out) {
   fprintf(out, "[");
   int i;
   for (i = 0; i < array->count - 1; i++) {
-    PRINT_VALUE(array->values[i], out);
+    PRINT_VALUE(vm, array->values[i], out);
     fprintf(out, ", ");
   }
 
   if (i < array->count) {
-    PRINT_VALUE(array->values[i], out);
+    PRINT_VALUE(vm, array->values[i], out);
   }
   fprintf(out, "]");
 }
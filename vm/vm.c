@@ -17,160 +17,467 @@
 #include "debug.h"
 #endif
 
-#define SET_STACK_VALUE_TO_BOOL (vm.stack_top[-1].type = TYPE_BOOL)
-
-#define GET_FRAME(up_count) (&vm.frame_stacks[vm.depth - up_count])
+#define GET_FRAME(up_count) (&vm->frame_stacks[vm->depth - up_count])
 
 #define IP_FETCH_INCR (*(frame->ip++))
+// Multi-byte operands are little endian and not aligned
+#define READ_U16(ptr) ((uint16_t)((ptr)[0] | ((ptr)[1] << 8)))
+#define READ_U32(ptr)                                                          \
+  ((uint32_t)(ptr)[0] | ((uint32_t)(ptr)[1] << 8) |                            \
+   ((uint32_t)(ptr)[2] << 16) | ((uint32_t)(ptr)[3] << 24))
+#define IP_FETCH_U16_INCR (frame->ip += 2, READ_U16(frame->ip - 2))
 #define CURR_FRAME ()
 
 #define CONSTANT(constant_offset) (chunk->constants.values[constant_offset])
+#define GLOBAL(slot) (vm->global_slots[slot])
 
 #define BINARY_OP(op)                                                          \
   do {                                                                         \
-    Value rhs = pop();                                                         \
-    Value lhs = pop();                                                         \
+    Value rhs = pop(vm);                                                       \
+    Value lhs = pop(vm);                                                       \
     if (IS_DOUBLE(lhs) || IS_DOUBLE(rhs)) {                                    \
-      if (IS_INTEGER(lhs)) {                                                   \
-        I2D(lhs);                                                              \
-      } else if (IS_INTEGER(rhs)) {                                            \
-        I2D(rhs);                                                              \
-      }                                                                        \
-      (lhs).as.fp = (lhs).as.fp op(rhs).as.fp;                                 \
+      push(vm, VAL_FLOAT(AS_NUMBER(lhs) op AS_NUMBER(rhs)));                   \
     } else {                                                                   \
-      (lhs).as.integer = (lhs).as.integer op(rhs).as.integer;                  \
+      push(vm, VAL_INT(AS_INTEGER(lhs) op AS_INTEGER(rhs)));                   \
     }                                                                          \
-    push(lhs);                                                                 \
   } while (false);
 
 #define BOOLEAN_BINARY_OP(op)                                                  \
   do {                                                                         \
-    Value rhs = pop();                                                         \
-    Value lhs = pop();                                                         \
+    Value rhs = pop(vm);                                                       \
+    Value lhs = pop(vm);                                                       \
     if (IS_DOUBLE(lhs) || IS_DOUBLE(rhs)) {                                    \
-      if (IS_INTEGER(lhs)) {                                                   \
-        I2D(lhs);                                                              \
-      } else if (IS_INTEGER(rhs)) {                                            \
-        I2D(rhs);                                                              \
-      }                                                                        \
-      lhs.as.boolean = (lhs).as.fp op(rhs).as.fp;                              \
+      push(vm, VAL_BOOL(AS_NUMBER(lhs) op AS_NUMBER(rhs)));                    \
     } else {                                                                   \
-      lhs.as.boolean = (lhs).as.integer op(rhs).as.integer;                    \
+      push(vm, VAL_BOOL(AS_INTEGER(lhs) op AS_INTEGER(rhs)));                  \
     }                                                                          \
-    lhs.type = TYPE_BOOL;                                                      \
-    push(lhs);                                                                 \
   } while (false);
 
-#define JUMP_IF(value)                                                         \
+// Typed operations, the compiler guarantees the operand types so no tag checks
+// are needed. The result overwrites the lhs slot.
+#define INT_BINARY_OP(op)                                                      \
+  do {                                                                         \
+    Value rhs = pop(vm);                                                       \
+    PEEK(vm) = VAL_INT(AS_INTEGER(PEEK(vm)) op AS_INTEGER(rhs));               \
+  } while (false);
+
+#define FLOAT_BINARY_OP(op)                                                    \
+  do {                                                                         \
+    Value rhs = pop(vm);                                                       \
+    PEEK(vm) = VAL_FLOAT(AS_DOUBLE(PEEK(vm)) op AS_DOUBLE(rhs));               \
+  } while (false);
+
+#define INT_COMPARE_OP(op)                                                     \
+  do {                                                                         \
+    Value rhs = pop(vm);                                                       \
+    PEEK(vm) = VAL_BOOL(AS_INTEGER(PEEK(vm)) op AS_INTEGER(rhs));              \
+  } while (false);
+
+#define FLOAT_COMPARE_OP(op)                                                   \
+  do {                                                                         \
+    Value rhs = pop(vm);                                                       \
+    PEEK(vm) = VAL_BOOL(AS_DOUBLE(PEEK(vm)) op AS_DOUBLE(rhs));                \
+  } while (false);
+
+// Forward jump offsets are relative to the end of the instruction.
+#define JUMP_IF(value, read_offset, offset_size)                               \
   do {                                                                         \
     if (value) {                                                               \
-      int offset = ((uint16_t)*(frame->ip)) + sizeof(uint16_t);                \
-      frame->ip += offset;                                                     \
+      frame->ip += read_offset(frame->ip) + (offset_size);                     \
     } else {                                                                   \
-      frame->ip += sizeof(uint16_t);                                           \
+      frame->ip += (offset_size);                                              \
     }                                                                          \
   } while (0);
 
-extern bool stop_interpreting;
-VM vm = {0};
+// Superinstructions, _fetch_ reads the next local or constant operand: 1 byte,
+// or 2 bytes after OP_WIDE.
+#define LOCALS_BINARY_OP(fetch, as_type, val_type, op)                         \
+  do {                                                                         \
+    Value lhs = frame->locals[fetch];                                          \
+    Value rhs = frame->locals[fetch];                                          \
+    push(vm, val_type(as_type(lhs) op as_type(rhs)));                          \
+  } while (false);
+
+// Compare and branch, the condition is never pushed.
+#define JUMP_UNLESS_LOCAL_CONST(op, fetch, read_offset, offset_size)           \
+  do {                                                                         \
+    Value local = frame->locals[fetch];                                        \
+    Value constant = CONSTANT(fetch);                                          \
+    JUMP_IF(!(AS_INTEGER(local) op AS_INTEGER(constant)), read_offset,         \
+            offset_size);                                                      \
+  } while (false);
+
+#define INC_LOCAL(fetch)                                                       \
+  do {                                                                         \
+    Value *local = &frame->locals[fetch];                                      \
+    *local = VAL_INT(AS_INTEGER(*local) + AS_INTEGER(CONSTANT(fetch)));        \
+  } while (false);
+
+// Direct threaded dispatch using labels as values when the compiler supports
+// it, otherwise a switch. The execution traces need the switch loop.
+#if (defined(__GNUC__) || defined(__clang__)) &&                               \
+    !defined(UZA_NO_COMPUTED_GOTO) && !defined(DEBUG_TRACE_EXECUTION_OP) &&    \
+    !defined(DEBUG_TRACE_EXECUTION_STACK)
+#define UZA_COMPUTED_GOTO
+#endif
+
+#ifdef UZA_COMPUTED_GOTO
+#define TARGET(op)                                                             \
+  case op:                                                                     \
+  TARGET_##op
+#define DISPATCH() goto *dispatch[IP_FETCH_INCR]
+#else
+#define TARGET(op) case op
+#define DISPATCH() break
+#endif
+
+// Only checked on backward jumps and calls, every other instruction makes
+// progress towards one of these or the end of the program.
+#define CHECK_INTERRUPT()                                                      \
+  do {                                                                         \
+    if (stop_interpreting)                                                     \
+      return 1;                                                                \
+  } while (0)
+
+extern volatile bool stop_interpreting;
 
-inline void vm_stack_reset(void) { stack_top_set(vm.stack); }
+inline void vm_stack_reset(VM *vm) { stack_top_set(vm, vm->stack); }
 
 // Dynamically load all native funcs, TODO: could be done lazily
 // MUST BE CALLED AFTER LOADING THE PROGRAM (stack/constants corruption
 // otherwise sometimes)
-static void vm_load_global_funcs(void) {
+static void vm_load_global_funcs(VM *vm) {
   size_t count;
   const NativeFunction *natives = native_functions_get(&count);
   for (size_t i = 0; i < count; i++) {
     const NativeFunction *func = &natives[i];
     ObjectString *func_name =
-        object_string_allocate(&vm.strings, func->name, func->name_len);
-    ObjectFunction *func_obj = object_function_allocate();
+        object_string_allocate(vm, func->name, func->name_len);
+    ObjectFunction *func_obj = object_function_allocate(vm);
     func_obj->arity = func->arity;
     func_obj->function = func->function;
-    func_obj->obj = (Obj){OBJ_FUNCTION_NATIVE, NULL};
+    func_obj->obj.type = OBJ_FUNCTION_NATIVE;
     func_obj->name = func_name;
-    tableSet(&vm.globals, func_name, VAL_OBJ(func_obj));
+    tableSet(vm, &vm->globals, func_name, VAL_OBJ(func_obj));
   }
 }
 
 // Init the global Frame
-void vm_init_global_scope(void) {
-  vm.depth = 0;
-  Frame *global_frame = &vm.frame_stacks[vm.depth];
-  global_frame->function = object_function_allocate();
+void vm_init_global_scope(VM *vm) {
+  vm->depth = 0;
+  Frame *global_frame = &vm->frame_stacks[vm->depth];
+  global_frame->function = object_function_allocate(vm);
   global_frame->function->chunk =
-      vm.chunks[0]; // first chunk should always be global scope
+      vm->chunks[0]; // first chunk should always be global scope
   global_frame->function->name =
-      object_string_allocate(&vm.strings, "__global__", sizeof("__global__"));
+      object_string_allocate(vm, "__global__", sizeof("__global__"));
   global_frame->ip = global_frame->function->chunk->code;
   global_frame->locals_count = global_frame->function->chunk->local_count;
-  global_frame->locals = vm.stack;
-  stack_top_set(vm.stack_top + global_frame->locals_count);
+  global_frame->locals = vm->stack;
+  stack_top_set(vm, vm->stack_top + global_frame->locals_count);
 }
 
-void vm_init(program_bytes_t *program) {
-  vm = (VM){0};
-  vm.nextGC = GC_DEFAULT_THRESHOLD;
-  vm.enable_GC = false;
+// Loads _program_ in a new VM, ready to interpret. The program bytes must
+// outlive the VM, the chunks point into them.
+VM *vm_new(program_bytes_t *program, const VMOptions *options) {
+  // zeroed on the heap, the value stack is too large for a thread's stack
+  VM *vm = calloc(1, sizeof(VM));
+  if (vm == NULL) {
+    PRINT_ERR("Could not allocate the VM. Exiting...");
+    exit(1);
+  }
+  vm->gc_initial_heap = options->gc_initial_heap > 0
+                            ? options->gc_initial_heap
+                            : GC_DEFAULT_INITIAL_HEAP;
+  vm->gc_growth_factor = options->gc_growth_factor > 1.0
+                             ? options->gc_growth_factor
+                             : GC_DEFAULT_GROWTH_FACTOR;
+  vm->nextGC = vm->gc_initial_heap;
+  vm->enable_GC = false;
+  vm->max_frames =
+      options->max_frames > 0 ? options->max_frames : FRAMES_DEFAULT_MAX;
+  vm->frame_capacity = FRAMES_INITIAL_CAPACITY < vm->max_frames
+                           ? FRAMES_INITIAL_CAPACITY
+                           : vm->max_frames;
+  vm->frame_stacks = malloc(vm->frame_capacity * sizeof(Frame));
+  if (vm->frame_stacks == NULL) {
+    PRINT_ERR("Could not allocate the frame stack. Exiting...");
+    exit(1);
+  }
+
+  // allocations root new objects on the stack while loading
+  vm_stack_reset(vm);
+  initTable(&vm->strings);
+  initTable(&vm->globals);
+  read_program(vm, program);
 
-  initTable(&vm.strings);
-  initTable(&vm.globals);
-  read_program(program);
+  vm_load_global_funcs(vm);
 
-  vm_load_global_funcs();
+  vm_stack_reset(vm);
+  vm_init_global_scope(vm);
+  // the program and the natives live as long as the VM
+  gc_promote_nursery(vm);
+  return vm;
+}
 
-  vm_stack_reset();
-  vm_init_global_scope();
+static void objects_free(VM *vm, Obj *object) {
+  while (object != NULL) {
+    Obj *next = object->next;
+    object_free(vm, object);
+    object = next;
+  }
 }
 
-void vm_free(void) {
-  freeTable(&vm.strings);
-  freeTable(&vm.globals);
-  // chunk_free(vm.chunks);
-  if (vm.gray_stack)
-    free(vm.gray_stack);
+void vm_free(VM *vm) {
+  objects_free(vm, vm->objects);
+  objects_free(vm, vm->young_objects);
+  freeTable(vm, &vm->strings);
+  freeTable(vm, &vm->globals);
+  free(vm->global_slots);
+  free(vm->global_names);
+  free(vm->functions);
+  free(vm->frame_stacks);
+  free(vm->remembered);
+  for (size_t i = 0; i < vm->chunk_count; i++) {
+    // the code and lines point into the program bytes
+    value_array_free(vm, &vm->chunks[i]->constants);
+    free(vm->chunks[i]);
+  }
+  free(vm->chunks);
+  if (vm->gray_stack)
+    free(vm->gray_stack);
+  free(vm);
 }
 
-int interpret(void) {
-  vm.enable_GC = true;
+static inline void call_native(VM *vm, Value *func_ptr) {
+  if (IS_STRING(*func_ptr)) {
+    ObjectFunction *func_obj = AS_STRING(*func_ptr)->cached_function;
+    if (func_obj != NULL) {
+      func_obj->function(vm);
+    } else {
+      Value func_val = VAL_NIL;
+      if (!tableGet(&vm->globals, AS_STRING(*func_ptr), &func_val)) {
+        PRINT_ERR("Could not find function: ");
+        PRINT_VALUE(vm, *func_ptr, stderr);
+        fprintf(stderr, NEWLINE);
+        exit(1);
+      }
+
+      func_obj = AS_FUNCTION(func_val);
+      AS_STRING(*func_ptr)->cached_function = func_obj;
+      func_obj->function(vm);
+    }
+  }
+}
+
+static inline void define_function(VM *vm, Value idx) {
+  pop(vm); // unused local_count, update lfunc call
+  Value arity = pop(vm);
+  ObjectFunction *func = object_function_allocate(vm);
+  func->chunk = vm->chunks[AS_INTEGER(idx)];
+  func->chunk->local_count = func->chunk->local_count;
+  func->name = AS_STRING(pop(vm));
+  func->arity = AS_INTEGER(arity);
+  push(vm, VAL_OBJ(func)); // avoid free(func)
+  tableSet(vm, &vm->globals, func->name, VAL_OBJ(func));
+  vm->functions[AS_INTEGER(idx)] = func;
+  pop(vm);
+}
+
+// Sets up _frame_ to run _func_, whose arguments start at _locals_.
+static inline void frame_init(VM *vm, Frame *frame, ObjectFunction *func,
+                              Value *locals) {
+  frame->function = func;
+  frame->locals_count = func->chunk->local_count;
+  frame->locals = locals;
+  frame->ip = func->chunk->code;
+  stack_top_set(vm, &frame->locals[frame->locals_count]);
+
+#ifndef NDEBUG
+  // set non initialized local to NIL
+  for (Value *local = frame->locals + func->arity; local != vm->stack_top;
+       local += 1) {
+    *local = VAL_NIL;
+  }
+#endif
+  assert(vm->stack_top >= &frame->locals[frame->locals_count]);
+}
+
+// Returns true, after printing the error, if the locals of _func_ starting at
+// _locals_ and the stack space its frame needs overflow the value stack.
+static inline bool value_stack_exhausted(VM *vm, ObjectFunction *func,
+                                         Value *locals, uint32_t depth) {
+  if (locals + func->chunk->local_count + FRAME_STACK_RESERVE <
+      &vm->stack[STACK_MAX]) {
+    return false;
+  }
+  PRINT_ERR_ARGS("stack overflow: value stack exhausted at call depth %u in "
+                 "'%s'\n",
+                 depth, func->name->chars);
+  return true;
+}
+
+// Pushes the call frame of _func_, its arguments are on top of the stack.
+// Returns NULL if the call depth limit is reached. The frame stack may move,
+// frame pointers are invalidated by every push.
+static inline Frame *frame_push(VM *vm, ObjectFunction *func) {
+  if (vm->depth + 1 >= vm->frame_capacity) {
+    if (vm->frame_capacity >= vm->max_frames) {
+      PRINT_ERR_ARGS("stack overflow: maximum call depth of %u exceeded in "
+                     "'%s'\n",
+                     vm->max_frames, func->name->chars);
+      return NULL;
+    }
+    uint32_t capacity = vm->frame_capacity * 2 < vm->max_frames
+                            ? vm->frame_capacity * 2
+                            : vm->max_frames;
+    Frame *frames = realloc(vm->frame_stacks, capacity * sizeof(Frame));
+    if (frames == NULL) {
+      PRINT_ERR("Could not grow the frame stack. Exiting...");
+      exit(1);
+    }
+    vm->frame_stacks = frames;
+    vm->frame_capacity = capacity;
+  }
+  Value *locals = vm->stack_top - func->arity; // args are in the stack
+  if (value_stack_exhausted(vm, func, locals, vm->depth + 1)) {
+    return NULL;
+  }
+  vm->depth++;
+  Frame *curr = GET_FRAME(0);
+  frame_init(vm, curr, func, locals);
+  return curr;
+}
+
+// Replaces the function of _frame_ by _func_, for a call in tail position. The
+// arguments on top of the stack become the first locals. Returns false if the
+// locals of _func_ do not fit on the value stack.
+static inline bool frame_reuse(VM *vm, Frame *frame, ObjectFunction *func) {
+  if (value_stack_exhausted(vm, func, frame->locals, vm->depth)) {
+    return false;
+  }
+  memmove(frame->locals, vm->stack_top - func->arity,
+          func->arity * sizeof(Value));
+  frame_init(vm, frame, func, frame->locals);
+  return true;
+}
+
+// Returns the function defined by OP_LFUNC from the chunk _chunk_idx_.
+static inline ObjectFunction *function_get(VM *vm, size_t chunk_idx) {
+  ObjectFunction *func = vm->functions[chunk_idx];
+  if (func == NULL) {
+    PRINT_ERR_ARGS("function in chunk %zu called before its definition\n",
+                   chunk_idx);
+    exit(1);
+  }
+  return func;
+}
+
+// Records the frame stack of a profiled run, the ip of each frame is past the
+// opcode it is running or the call of the frame above.
+static void profile_sample(VM *vm) {
+  Profile *profile = vm->profile;
+  profile->countdown = profile->interval;
+  size_t sample_size = 1 + 2 * ((size_t)vm->depth + 1);
+  if (profile->count + sample_size > profile->capacity) {
+    size_t capacity = GROW_CAPACITY(profile->capacity);
+    while (capacity < profile->count + sample_size)
+      capacity *= 2;
+    uint32_t *samples =
+        realloc(profile->samples, capacity * sizeof(uint32_t));
+    if (samples == NULL) {
+      PRINT_ERR("Could not grow the profile samples. Exiting...");
+      exit(1);
+    }
+    profile->samples = samples;
+    profile->capacity = capacity;
+  }
+  uint32_t *sample = &profile->samples[profile->count];
+  *sample++ = vm->depth + 1;
+  for (uint32_t i = 0; i <= vm->depth; i++) {
+    Frame *frame = &vm->frame_stacks[i];
+    Chunk *chunk = frame->function->chunk;
+    *sample++ = (uint32_t)chunk->index;
+    *sample++ = (uint32_t)(frame->ip - 1 - chunk->code);
+  }
+  profile->count += sample_size;
+}
+
+// Counts the instruction whose opcode is at _ip_ in _chunk_.
+static void op_stats_count(OpStats *stats, Chunk *chunk, const uint8_t *ip) {
+  uint8_t op = ip[0] == OP_WIDE ? ip[1] : ip[0];
+  stats->ops[op]++;
+  if (stats->started)
+    stats->pairs[stats->previous][op]++;
+  stats->previous = op;
+  stats->started = true;
+  stats->chunks[chunk->index]++;
+}
+
+// Runs before each instruction of a profiled or counted run, _ip_ is past its
+// opcode.
+static void instrument(VM *vm, Chunk *chunk, const uint8_t *ip) {
+  if (vm->op_stats != NULL)
+    op_stats_count(vm->op_stats, chunk, ip - 1);
+  if (vm->profile != NULL && --vm->profile->countdown == 0)
+    profile_sample(vm);
+}
+
+int interpret(VM *vm) {
+  vm->enable_GC = true;
 
   // update these two when calling/returning
-  Frame *frame = &vm.frame_stacks[vm.depth];
+  Frame *frame = &vm->frame_stacks[vm->depth];
   Chunk *chunk = frame->function->chunk;
+  const bool instrumented = vm->profile != NULL || vm->op_stats != NULL;
 
-  while (!stop_interpreting) {
+#ifdef UZA_COMPUTED_GOTO
+  static void *dispatch_table[256] = {
+      [0 ... 255] = &&TARGET_OP_UNKNOWN,
+#define OPCODE_TARGET(op) [op] = &&TARGET_##op,
+      FOR_EACH_OPCODE(OPCODE_TARGET)
+#undef OPCODE_TARGET
+  };
+  // profiled and counted runs go through TARGET_INSTRUMENT before each
+  // instruction, the others dispatch directly
+  static void *instrumented_table[256] = {[0 ... 255] = &&TARGET_INSTRUMENT};
+  void **dispatch = instrumented ? instrumented_table : dispatch_table;
+#endif
+
+  for (;;) {
 
 #ifdef DEBUG_TRACE_EXECUTION_OP
     DEBUG_PRINT(PURPLE "running op\n  " RESET);
-    debug_op_print(chunk, (int)(frame->ip - chunk->code));
+    debug_op_print(vm, chunk, (int)(frame->ip - chunk->code));
     fprintf(stderr, "\n");
     // DEBUG_PRINT("----------\n");
 
 #endif // #define DEBUG_TRACE_EXECUTION_OP
 #ifdef DEBUG_TRACE_EXECUTION_STACK
-    debug_locals_print("locals");
-    debug_stack_print("before");
+    debug_locals_print(vm, "locals");
+    debug_stack_print(vm, "before");
 #endif // #define DEBUG_TRACE_EXECUTION_STACK
 
     OpCode instruction = IP_FETCH_INCR;
+    if (instrumented)
+      instrument(vm, chunk, frame->ip);
 
     switch (instruction) {
-    case OP_RETURN: {
-      Value ret_val = PEEK_AT(0);
-      Value *old_stack_top = vm.stack_top;
+    TARGET(OP_RETURN): {
+      Value ret_val = PEEK_AT(vm, 0);
+      Value *old_stack_top = vm->stack_top;
       Value *old_locals = GET_FRAME(0)->locals;
-      stack_top_set(GET_FRAME(0)->locals);
-      assert(old_stack_top >= vm.stack_top);
-      vm.depth--;
+      stack_top_set(vm, GET_FRAME(0)->locals);
+      assert(old_stack_top >= vm->stack_top);
+      vm->depth--;
       frame = GET_FRAME(0);
       chunk = frame->function->chunk;
 
-      assert(vm.stack_top >= &frame->locals[frame->locals_count]);
-      push(ret_val);
-    } break;
-    case OP_CALL: {
+      assert(vm->stack_top >= &frame->locals[frame->locals_count]);
+      push(vm, ret_val);
+    } DISPATCH();
+    TARGET(OP_CALL): {
+      CHECK_INTERRUPT();
       Value *func_name = &PEEK(vm);
       ObjectFunction *func;
 
@@ -180,9 +487,9 @@ int interpret(void) {
           func = func_obj;
         } else {
           Value func_val = VAL_NIL;
-          if (!tableGet(&vm.globals, AS_STRING(*func_name), &func_val)) {
+          if (!tableGet(&vm->globals, AS_STRING(*func_name), &func_val)) {
             PRINT_ERR("Could not find function: ");
-            PRINT_VALUE(*func_name, stderr);
+            PRINT_VALUE(vm, *func_name, stderr);
             fprintf(stderr, NEWLINE);
             exit(1);
           }
@@ -192,279 +499,595 @@ int interpret(void) {
           func = func_obj;
         }
       }
-      pop();
-      vm.depth++;
-      Frame *curr = GET_FRAME(0);
-      frame = curr;
-      curr->function = func;
-      chunk = frame->function->chunk;
-      curr->locals_count = func->chunk->local_count;
-      curr->locals = vm.stack_top - func->arity; // args are in the stack
-      curr->ip = func->chunk->code;
-      stack_top_set(&curr->locals[curr->locals_count]);
-
+      pop(vm);
+      frame = frame_push(vm, func);
+      if (frame == NULL)
+        return 1;
       chunk = func->chunk;
-
-#ifndef NDEBUG
-      // set non initialized local to NIL
-      for (Value *local = curr->locals + func->arity; local != vm.stack_top;
-           local += 1) {
-        *local = VAL_NIL;
-      }
-#endif
-      assert(vm.stack_top >= &curr->locals[curr->locals_count]);
-    }; break;
-    case OP_CALL_NATIVE: {
-      uint8_t offset = IP_FETCH_INCR;
-      Value *func_ptr = &(CONSTANT(offset));
-
-      if (IS_STRING(*func_ptr)) {
-        ObjectFunction *func_obj = AS_STRING(*func_ptr)->cached_function;
-        if (func_obj != NULL) {
-          func_obj->function();
-        } else {
-          Value func_val = VAL_NIL;
-          if (!tableGet(&vm.globals, AS_STRING(*func_ptr), &func_val)) {
-            PRINT_ERR("Could not find function: ");
-            PRINT_VALUE(*func_ptr, stderr);
-            fprintf(stderr, NEWLINE);
-            exit(1);
-          }
-
-          func_obj = AS_FUNCTION(func_val);
-          AS_STRING(*func_ptr)->cached_function = func_obj;
-          func_obj->function();
-        }
-      }
-    } break;
-    case OP_JUMP: {
-      int offset = ((uint16_t)*(frame->ip)) + sizeof(uint16_t);
-      frame->ip += offset;
-    } break;
-    case OP_LOOP: {
-      int offset = ((uint16_t)*(frame->ip)) + 1;
-      frame->ip -= offset;
-    } break;
-    case OP_POP:
-      pop();
-      break;
-    case OP_LFUNC: {
-      Value idx = CONSTANT(IP_FETCH_INCR);
-      pop(); // unused local_count, update lfunc call
-      Value arity = pop();
-      ObjectFunction *func = object_function_allocate();
-      func->chunk = vm.chunks[idx.as.integer];
-      func->chunk->local_count = func->chunk->local_count;
-      func->name = AS_STRING(pop());
-      func->arity = arity.as.integer;
-      push(VAL_OBJ(func)); // avoid free(func)
-      tableSet(&vm.globals, func->name,
-               (Value){TYPE_OBJ, .as.object = (Obj *)func});
-      pop();
-    } break;
-    case OP_LNIL: {
-      push(VAL_NIL);
-    } break;
-    case OP_STRCONST:
-    case OP_DCONST:
-    case OP_LCONST:
-      push(CONSTANT(IP_FETCH_INCR));
-      break;
-    case OP_BOOLTRUE:
-      push(VAL_BOOL(true));
-      break;
-    case OP_BOOLFALSE:
-      push(VAL_BOOL(false));
-      break;
-    case OP_JUMP_IF_FALSE: {
+    }
+      DISPATCH();
+    TARGET(OP_CALL_DIRECT): {
+      CHECK_INTERRUPT();
+      ObjectFunction *func = function_get(vm, IP_FETCH_INCR);
+      frame = frame_push(vm, func);
+      if (frame == NULL)
+        return 1;
+      chunk = func->chunk;
+    }
+      DISPATCH();
+    TARGET(OP_TAIL_CALL_DIRECT): {
+      CHECK_INTERRUPT();
+      ObjectFunction *func = function_get(vm, IP_FETCH_INCR);
+      if (!frame_reuse(vm, frame, func))
+        return 1;
+      chunk = func->chunk;
+    }
+      DISPATCH();
+    TARGET(OP_CALL_NATIVE):
+      call_native(vm, &CONSTANT(IP_FETCH_INCR));
+      DISPATCH();
+    TARGET(OP_JUMP):
+      frame->ip += READ_U16(frame->ip) + sizeof(uint16_t);
+      DISPATCH();
+    TARGET(OP_LOOP):
+      // backward offsets are relative to the start of the instruction
+      frame->ip -= READ_U16(frame->ip) + 1;
+      CHECK_INTERRUPT();
+      DISPATCH();
+    TARGET(OP_POP):
+      pop(vm);
+      DISPATCH();
+    TARGET(OP_LFUNC):
+      define_function(vm, CONSTANT(IP_FETCH_INCR));
+      DISPATCH();
+    TARGET(OP_LNIL): {
+      push(vm, VAL_NIL);
+    } DISPATCH();
+    TARGET(OP_STRCONST):
+    TARGET(OP_DCONST):
+    TARGET(OP_LCONST):
+      push(vm, CONSTANT(IP_FETCH_INCR));
+      DISPATCH();
+    TARGET(OP_BOOLTRUE):
+      push(vm, VAL_BOOL(true));
+      DISPATCH();
+    TARGET(OP_BOOLFALSE):
+      push(vm, VAL_BOOL(false));
+      DISPATCH();
+    TARGET(OP_JUMP_IF_FALSE): {
       Value val = PEEK(vm);
-      JUMP_IF(!val.as.boolean);
-    } break;
-    case OP_JUMP_IF_TRUE: {
+      JUMP_IF(!AS_BOOL(val), READ_U16, sizeof(uint16_t));
+    } DISPATCH();
+    TARGET(OP_JUMP_IF_TRUE): {
       Value val = PEEK(vm);
-      JUMP_IF(val.as.boolean);
-    } break;
-    case OP_ADD: {
+      JUMP_IF(AS_BOOL(val), READ_U16, sizeof(uint16_t));
+    } DISPATCH();
+    TARGET(OP_ADD): {
       Value top = PEEK(vm);
       if (IS_STRING(top)) {
-        Value rhs = pop();
-        Value lhs = pop();
-        ObjectString *new_object_string =
-            object_string_concat(&vm.strings, AS_STRING(lhs), AS_STRING(rhs));
-        Value new_object_value = {.type = TYPE_OBJ,
-                                  .as.object = (Obj *)new_object_string};
-        push(new_object_value);
+        ObjectString *new_object_string = object_string_concat(
+            vm, AS_STRING(PEEK_AT(vm, 1)), AS_STRING(PEEK_AT(vm, 0)));
+        POP_COUNT(vm, 2);
+        push(vm, VAL_OBJ(new_object_string));
       } else {
         BINARY_OP(+);
       }
-    } break;
-    case OP_SUB: {
+    } DISPATCH();
+    TARGET(OP_SUB): {
       BINARY_OP(-);
-    } break;
-    case OP_MUL: {
+    } DISPATCH();
+    TARGET(OP_MUL): {
       BINARY_OP(*);
-    } break;
-    case OP_DIV: {
+    } DISPATCH();
+    TARGET(OP_DIV): {
       BINARY_OP(/);
-    } break;
-    case OP_MOD: {
-      Value rhs = pop();
-      Value lhs = pop();
-      int64_t res = (lhs).as.integer % (rhs).as.integer;
-      push(VAL_INT(res));
-    } break;
-    case OP_NEG: {
+    } DISPATCH();
+    TARGET(OP_MOD): {
+      Value rhs = pop(vm);
+      Value lhs = pop(vm);
+      int64_t res = AS_INTEGER(lhs) % AS_INTEGER(rhs);
+      push(vm, VAL_INT(res));
+    } DISPATCH();
+    TARGET(OP_NEG): {
       Value *val = &PEEK(vm);
-      if (val->type == TYPE_DOUBLE) {
-        val->as.fp = -val->as.fp;
-      } else if (val->type == TYPE_LONG) {
-        val->as.integer = -val->as.integer;
+      if (IS_DOUBLE(*val)) {
+        *val = VAL_FLOAT(-AS_DOUBLE(*val));
+      } else if (IS_INTEGER(*val)) {
+        *val = VAL_INT(-AS_INTEGER(*val));
       } else {
         PRINT_ERR_ARGS("at %s:%d cannot neg type : %d\n\n", __FILE__, __LINE__,
-                       val->type);
+                       VALUE_TYPE(*val));
         return 1;
       }
-    } break;
-    case OP_EQ: {
-      BOOLEAN_BINARY_OP(==);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_NE: {
-      BOOLEAN_BINARY_OP(!=);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_LT: {
+    } DISPATCH();
+    TARGET(OP_EQ): {
+      Value rhs = pop(vm);
+      PEEK(vm) = VAL_BOOL(values_equal(vm, PEEK(vm), rhs));
+    } DISPATCH();
+    TARGET(OP_NE): {
+      Value rhs = pop(vm);
+      PEEK(vm) = VAL_BOOL(!values_equal(vm, PEEK(vm), rhs));
+    } DISPATCH();
+    TARGET(OP_LT): {
       BOOLEAN_BINARY_OP(<);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_LE: {
+    } DISPATCH();
+    TARGET(OP_LE): {
       BOOLEAN_BINARY_OP(<=);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_GT: {
+    } DISPATCH();
+    TARGET(OP_GT): {
       BOOLEAN_BINARY_OP(>);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_GE: {
+    } DISPATCH();
+    TARGET(OP_GE): {
       BOOLEAN_BINARY_OP(>=);
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_NOT: {
-      PEEK(vm).as.boolean = !PEEK(vm).as.boolean;
-      PEEK(vm).type = TYPE_BOOL;
-      SET_STACK_VALUE_TO_BOOL;
-    } break;
-    case OP_TOSTRING: {
+    } DISPATCH();
+    TARGET(OP_NOT): {
+      PEEK(vm) = VAL_BOOL(!AS_BOOL(PEEK(vm)));
+    } DISPATCH();
+    TARGET(OP_TOSTRING): {
       if (IS_STRING(PEEK(vm))) {
-        break;
+        DISPATCH();
       }
 
-      Value val = pop();
+      Value val = pop(vm);
       ObjectString *res;
       char buff[512] = {0};
       if (IS_INTEGER(val)) {
-        int char_count = sprintf(buff, "%lld", val.as.integer);
-        res = object_string_allocate(&vm.strings, buff, char_count);
+        int char_count = sprintf(buff, "%lld", (long long)AS_INTEGER(val));
+        res = object_string_transient(vm, buff, char_count);
       } else if (IS_DOUBLE(val)) {
-        int char_count = sprintf(buff, "%lf", val.as.fp);
-        res = object_string_allocate(&vm.strings, buff, char_count);
+        int char_count = sprintf(buff, "%lf", AS_DOUBLE(val));
+        res = object_string_transient(vm, buff, char_count);
       } else {
         PRINT_ERR_ARGS("ERROR: Invalid invalid type conversion for type %d\n",
-                       val.type);
+                       VALUE_TYPE(val));
       }
 
-      push(VAL_OBJ(res));
-    } break;
-    case OP_TOFLOAT: {
+      push(vm, VAL_OBJ(res));
+    } DISPATCH();
+    TARGET(OP_TOFLOAT): {
       if (IS_DOUBLE(PEEK(vm))) {
-        break;
+        DISPATCH();
       }
       Value *val = &PEEK(vm);
       if (IS_STRING(*val)) {
         ObjectString *str = AS_STRING(*val);
         errno = 0;
         char *endptr = NULL;
-        double res = strtod(str->chars, &endptr);
-        if (endptr == str->chars) {
+        const char *chars = object_string_chars(vm, str);
+        double res = strtod(chars, &endptr);
+        if (endptr == chars) {
           PRINT_ERR("Could not parse float for: ");
-          PRINT_VALUE(*val, stderr);
+          PRINT_VALUE(vm, *val, stderr);
           fprintf(stderr, NEWLINE);
           return 1;
         } else if (errno == ERANGE) {
           PRINT_ERR("Float out of range for: ");
-          PRINT_VALUE(*val, stderr);
+          PRINT_VALUE(vm, *val, stderr);
           fprintf(stderr, NEWLINE);
           return 1;
         } else if (*endptr != '\0') {
           PRINT_ERR("Could only partially parse float for: ");
-          PRINT_VALUE(*val, stderr);
+          PRINT_VALUE(vm, *val, stderr);
           fprintf(stderr, NEWLINE);
           return 1;
         }
-        push(VAL_FLOAT(res));
+        push(vm, VAL_FLOAT(res));
       } else if (IS_INTEGER(*val)) {
-        val->as.fp = (double)val->as.integer;
-        val->type = TYPE_DOUBLE;
+        *val = VAL_FLOAT((double)AS_INTEGER(*val));
       }
-    } break;
-    case OP_TOINT: {
+    } DISPATCH();
+    TARGET(OP_TOINT): {
       if (IS_INTEGER(PEEK(vm))) {
-        break;
+        DISPATCH();
       }
       if (IS_STRING(PEEK(vm))) {
-        int64_t num = atoll(AS_STRING(pop())->chars);
-        push(VAL_INT(num));
+        int64_t num = atoll(object_string_chars(vm, AS_STRING(pop(vm))));
+        push(vm, VAL_INT(num));
       }
 
       Value *val = &PEEK(vm);
       if (IS_DOUBLE(*val)) {
-        val->as.integer = (int64_t)val->as.fp;
-        val->type = TYPE_LONG;
+        *val = VAL_INT((int64_t)AS_DOUBLE(*val));
       }
-    } break;
-    case OP_DEFGLOBAL: {
-      int constant = IP_FETCH_INCR;
-      ObjectString *identifier = AS_STRING(CONSTANT(constant));
-      tableSet(&vm.globals, identifier, PEEK(vm));
-      pop();
-    } break;
-    case OP_GETGLOBAL: {
-      int constant = IP_FETCH_INCR;
-      ObjectString *identifier = AS_STRING(CONSTANT(constant));
-      Value val = {0};
-      tableGet(&vm.globals, identifier, &val);
-      push(val);
-    } break;
-    case OP_SETGLOBAL: {
-      int constant = IP_FETCH_INCR;
-      ObjectString *identifier = AS_STRING(CONSTANT(constant));
-      Value val = PEEK(vm);
-      tableSet(&vm.globals, identifier, val);
-      pop();
-    } break;
-    case OP_DEFLOCAL: {
-      Value val = pop();
+    } DISPATCH();
+    TARGET(OP_IADD):
+      INT_BINARY_OP(+);
+      DISPATCH();
+    TARGET(OP_ISUB):
+      INT_BINARY_OP(-);
+      DISPATCH();
+    TARGET(OP_IMUL):
+      INT_BINARY_OP(*);
+      DISPATCH();
+    TARGET(OP_IDIV):
+      INT_BINARY_OP(/);
+      DISPATCH();
+    TARGET(OP_INEG):
+      PEEK(vm) = VAL_INT(-AS_INTEGER(PEEK(vm)));
+      DISPATCH();
+    TARGET(OP_FADD):
+      FLOAT_BINARY_OP(+);
+      DISPATCH();
+    TARGET(OP_FSUB):
+      FLOAT_BINARY_OP(-);
+      DISPATCH();
+    TARGET(OP_FMUL):
+      FLOAT_BINARY_OP(*);
+      DISPATCH();
+    TARGET(OP_FDIV):
+      FLOAT_BINARY_OP(/);
+      DISPATCH();
+    TARGET(OP_FNEG):
+      PEEK(vm) = VAL_FLOAT(-AS_DOUBLE(PEEK(vm)));
+      DISPATCH();
+    TARGET(OP_STRCONCAT): {
+      ObjectString *new_object_string = object_string_concat(
+          vm, AS_STRING(PEEK_AT(vm, 1)), AS_STRING(PEEK_AT(vm, 0)));
+      POP_COUNT(vm, 2);
+      push(vm, VAL_OBJ(new_object_string));
+    } DISPATCH();
+    TARGET(OP_IEQ):
+      INT_COMPARE_OP(==);
+      DISPATCH();
+    TARGET(OP_INE):
+      INT_COMPARE_OP(!=);
+      DISPATCH();
+    TARGET(OP_ILT):
+      INT_COMPARE_OP(<);
+      DISPATCH();
+    TARGET(OP_ILE):
+      INT_COMPARE_OP(<=);
+      DISPATCH();
+    TARGET(OP_IGT):
+      INT_COMPARE_OP(>);
+      DISPATCH();
+    TARGET(OP_IGE):
+      INT_COMPARE_OP(>=);
+      DISPATCH();
+    TARGET(OP_FEQ):
+      FLOAT_COMPARE_OP(==);
+      DISPATCH();
+    TARGET(OP_FNE):
+      FLOAT_COMPARE_OP(!=);
+      DISPATCH();
+    TARGET(OP_FLT):
+      FLOAT_COMPARE_OP(<);
+      DISPATCH();
+    TARGET(OP_FLE):
+      FLOAT_COMPARE_OP(<=);
+      DISPATCH();
+    TARGET(OP_FGT):
+      FLOAT_COMPARE_OP(>);
+      DISPATCH();
+    TARGET(OP_FGE):
+      FLOAT_COMPARE_OP(>=);
+      DISPATCH();
+    TARGET(OP_ITOF):
+      PEEK(vm) = VAL_FLOAT((double)AS_INTEGER(PEEK(vm)));
+      DISPATCH();
+    TARGET(OP_FTOI):
+      PEEK(vm) = VAL_INT((int64_t)AS_DOUBLE(PEEK(vm)));
+      DISPATCH();
+    TARGET(OP_DEFGLOBAL):
+    TARGET(OP_SETGLOBAL): {
+      Value val = pop(vm);
+      GLOBAL(IP_FETCH_INCR) = val;
+    } DISPATCH();
+    TARGET(OP_GETGLOBAL):
+      push(vm, GLOBAL(IP_FETCH_INCR));
+      DISPATCH();
+    TARGET(OP_DEFLOCAL): {
+      Value val = pop(vm);
       frame->locals[IP_FETCH_INCR] = val;
-    } break;
-    case OP_GETLOCAL: {
-      push(frame->locals[IP_FETCH_INCR]);
-    } break;
-    case OP_SETLOCAL: {
-      frame->locals[IP_FETCH_INCR] = pop();
-    } break;
-    case OP_EXITVM:
+    } DISPATCH();
+    TARGET(OP_GETLOCAL): {
+      push(vm, frame->locals[IP_FETCH_INCR]);
+    } DISPATCH();
+    TARGET(OP_SETLOCAL): {
+      frame->locals[IP_FETCH_INCR] = pop(vm);
+    } DISPATCH();
+    TARGET(OP_IADD_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_INTEGER, VAL_INT, +);
+      DISPATCH();
+    TARGET(OP_ISUB_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_INTEGER, VAL_INT, -);
+      DISPATCH();
+    TARGET(OP_IMUL_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_INTEGER, VAL_INT, *);
+      DISPATCH();
+    TARGET(OP_FADD_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_DOUBLE, VAL_FLOAT, +);
+      DISPATCH();
+    TARGET(OP_FSUB_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_DOUBLE, VAL_FLOAT, -);
+      DISPATCH();
+    TARGET(OP_FMUL_LOCALS):
+      LOCALS_BINARY_OP(IP_FETCH_INCR, AS_DOUBLE, VAL_FLOAT, *);
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_IEQ):
+      JUMP_UNLESS_LOCAL_CONST(==, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_INE):
+      JUMP_UNLESS_LOCAL_CONST(!=, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_ILT):
+      JUMP_UNLESS_LOCAL_CONST(<, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_ILE):
+      JUMP_UNLESS_LOCAL_CONST(<=, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_IGT):
+      JUMP_UNLESS_LOCAL_CONST(>, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_JUMP_UNLESS_IGE):
+      JUMP_UNLESS_LOCAL_CONST(>=, IP_FETCH_INCR, READ_U16, sizeof(uint16_t));
+      DISPATCH();
+    TARGET(OP_INCLOCAL):
+      INC_LOCAL(IP_FETCH_INCR);
+      DISPATCH();
+    TARGET(OP_EXITVM):
       return 0;
-    default: {
+    TARGET(OP_WIDE): {
+      // The operands of the next instruction are 16 bit constant or local
+      // indices and a 32 bit jump offset.
+      OpCode wide = IP_FETCH_INCR;
+      switch (wide) {
+      case OP_STRCONST:
+      case OP_DCONST:
+      case OP_LCONST:
+        push(vm, CONSTANT(IP_FETCH_U16_INCR));
+        break;
+      case OP_CALL_NATIVE:
+        call_native(vm, &CONSTANT(IP_FETCH_U16_INCR));
+        break;
+      case OP_LFUNC:
+        define_function(vm, CONSTANT(IP_FETCH_U16_INCR));
+        break;
+      case OP_CALL_DIRECT: {
+        CHECK_INTERRUPT();
+        ObjectFunction *func = function_get(vm, IP_FETCH_U16_INCR);
+        frame = frame_push(vm, func);
+        if (frame == NULL)
+          return 1;
+        chunk = func->chunk;
+      } break;
+      case OP_TAIL_CALL_DIRECT: {
+        CHECK_INTERRUPT();
+        ObjectFunction *func = function_get(vm, IP_FETCH_U16_INCR);
+        if (!frame_reuse(vm, frame, func))
+          return 1;
+        chunk = func->chunk;
+      } break;
+      case OP_DEFGLOBAL:
+      case OP_SETGLOBAL: {
+        Value val = pop(vm);
+        GLOBAL(IP_FETCH_U16_INCR) = val;
+      } break;
+      case OP_GETGLOBAL:
+        push(vm, GLOBAL(IP_FETCH_U16_INCR));
+        break;
+      case OP_DEFLOCAL:
+      case OP_SETLOCAL: {
+        Value val = pop(vm);
+        frame->locals[IP_FETCH_U16_INCR] = val;
+      } break;
+      case OP_GETLOCAL:
+        push(vm, frame->locals[IP_FETCH_U16_INCR]);
+        break;
+      case OP_JUMP:
+        frame->ip += READ_U32(frame->ip) + sizeof(uint32_t);
+        break;
+      case OP_JUMP_IF_FALSE:
+        JUMP_IF(!AS_BOOL(PEEK(vm)), READ_U32, sizeof(uint32_t));
+        break;
+      case OP_JUMP_IF_TRUE:
+        JUMP_IF(AS_BOOL(PEEK(vm)), READ_U32, sizeof(uint32_t));
+        break;
+      case OP_LOOP:
+        frame->ip -= READ_U32(frame->ip) + 2;
+        CHECK_INTERRUPT();
+        break;
+      case OP_IADD_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_INTEGER, VAL_INT, +);
+        break;
+      case OP_ISUB_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_INTEGER, VAL_INT, -);
+        break;
+      case OP_IMUL_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_INTEGER, VAL_INT, *);
+        break;
+      case OP_FADD_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_DOUBLE, VAL_FLOAT, +);
+        break;
+      case OP_FSUB_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_DOUBLE, VAL_FLOAT, -);
+        break;
+      case OP_FMUL_LOCALS:
+        LOCALS_BINARY_OP(IP_FETCH_U16_INCR, AS_DOUBLE, VAL_FLOAT, *);
+        break;
+      case OP_JUMP_UNLESS_IEQ:
+        JUMP_UNLESS_LOCAL_CONST(==, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_JUMP_UNLESS_INE:
+        JUMP_UNLESS_LOCAL_CONST(!=, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_JUMP_UNLESS_ILT:
+        JUMP_UNLESS_LOCAL_CONST(<, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_JUMP_UNLESS_ILE:
+        JUMP_UNLESS_LOCAL_CONST(<=, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_JUMP_UNLESS_IGT:
+        JUMP_UNLESS_LOCAL_CONST(>, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_JUMP_UNLESS_IGE:
+        JUMP_UNLESS_LOCAL_CONST(>=, IP_FETCH_U16_INCR, READ_U32,
+                                sizeof(uint32_t));
+        break;
+      case OP_INCLOCAL:
+        INC_LOCAL(IP_FETCH_U16_INCR);
+        break;
+      default:
+        PRINT_ERR_ARGS("at %s:%d instruction %d has no wide operand\n\n",
+                       __FILE__, __LINE__, wide);
+        exit(1);
+      }
+    } DISPATCH();
+#ifdef UZA_COMPUTED_GOTO
+    TARGET_INSTRUMENT:
+      instrument(vm, chunk, frame->ip);
+      goto *dispatch_table[frame->ip[-1]];
+#endif
+    default:
+#ifdef UZA_COMPUTED_GOTO
+    TARGET_OP_UNKNOWN:
+#endif
+    {
       PRINT_ERR_ARGS("at %s:%d unknown instruction : %d\n\n", __FILE__,
-                     __LINE__, instruction);
+                     __LINE__, frame->ip[-1]);
       exit(1);
     } break;
     }
 #ifdef DEBUG_TRACE_EXECUTION_STACK
-    debug_stack_print("after");
+    debug_stack_print(vm, "after");
 #endif // #define DEBUG_TRACE_EXECUTION_STACK
   }
   return 1;
 }
 
 #undef BINARY_OP
+#undef BOOLEAN_BINARY_OP
+#undef TARGET
+#undef DISPATCH
+#undef CHECK_INTERRUPT
+#undef INT_BINARY_OP
+#undef FLOAT_BINARY_OP
+#undef INT_COMPARE_OP
+#undef FLOAT_COMPARE_OP
+#undef JUMP_IF
+#undef LOCALS_BINARY_OP
+#undef JUMP_UNLESS_LOCAL_CONST
+#undef INC_LOCAL
+#undef READ_U16
+#undef READ_U32
+#undef IP_FETCH_U16_INCR
+#undef GLOBAL
+
+// Pushes the argument _arg_ of a call from the host. Returns false if its type
+// cannot be passed to a uza function.
+static bool host_value_push(VM *vm, const HostValue *arg) {
+  switch (arg->type) {
+  case TYPE_NIL:
+    push(vm, VAL_NIL);
+    return true;
+  case TYPE_LONG:
+    push(vm, VAL_INT(arg->integer));
+    return true;
+  case TYPE_BOOL:
+    push(vm, VAL_BOOL(arg->boolean));
+    return true;
+  case TYPE_DOUBLE:
+    push(vm, VAL_FLOAT(arg->fp));
+    return true;
+  case TYPE_OBJ:
+    push(vm, VAL_OBJ(object_string_transient(vm, arg->chars, arg->length)));
+    return true;
+  default:
+    return false;
+  }
+}
+
+// Converts the result _value_ of a call from the host. Returns false for lists
+// and functions.
+static bool host_value_set(VM *vm, Value value, HostValue *result) {
+  memset(result, 0, sizeof(HostValue));
+  result->type = VALUE_TYPE(value);
+  switch (result->type) {
+  case TYPE_NIL:
+    return true;
+  case TYPE_LONG:
+    result->integer = AS_INTEGER(value);
+    return true;
+  case TYPE_BOOL:
+    result->boolean = AS_BOOL(value);
+    return true;
+  case TYPE_DOUBLE:
+    result->fp = AS_DOUBLE(value);
+    return true;
+  default:
+    if (!IS_STRING(value))
+      return false;
+    result->chars = object_string_chars(vm, AS_STRING(value));
+    result->length = AS_STRING(value)->length;
+    return true;
+  }
+}
+
+// Calls the function _name_ once the top level of the program has run, with
+// the _arg_count_ values of _args_. Returns 0 and sets _result_ if the call
+// succeeds, the status of interpret if the program stops and VM_CALL_INVALID
+// if the function cannot be called. A string result is only valid until the
+// next call.
+int vm_call(VM *vm, const char *name, int arg_count, const HostValue *args,
+            HostValue *result) {
+  assert(vm->depth == 0);
+  Value *base = vm->stack_top;
+
+  Value func_val = VAL_NIL;
+  ObjectString *func_name =
+      object_string_allocate(vm, name, (int)strlen(name));
+  if (!tableGet(&vm->globals, func_name, &func_val) ||
+      OBJ_TYPE(func_val) != OBJ_FUNCTION) {
+    PRINT_ERR_ARGS("no function named '%s'\n", name);
+    return VM_CALL_INVALID;
+  }
+  ObjectFunction *func = AS_FUNCTION(func_val);
+  if (func->arity != arg_count) {
+    PRINT_ERR_ARGS("'%s' takes %d arguments but %d were given\n", name,
+                   func->arity, arg_count);
+    return VM_CALL_INVALID;
+  }
+  // the VM trusts the typechecker, a wrongly typed argument would be read as
+  // another type by the function
+  for (int i = 0; i < arg_count; i++) {
+    if (i >= func->chunk->param_count ||
+        args[i].type != (ValueType)func->chunk->param_types[i]) {
+      PRINT_ERR_ARGS("argument %d of '%s' does not have the parameter type\n",
+                     i, name);
+      return VM_CALL_TYPE_MISMATCH;
+    }
+  }
+  for (int i = 0; i < arg_count; i++) {
+    if (!host_value_push(vm, &args[i])) {
+      PRINT_ERR_ARGS("unsupported type of argument %d of '%s'\n", i, name);
+      stack_top_set(vm, base);
+      return VM_CALL_INVALID;
+    }
+  }
+
+  // the global frame stopped after the OP_EXITVM ending the top level, it
+  // runs it again once the called function returns
+  uint8_t *exit_ip = vm->frame_stacks[0].ip - 1;
+  assert(*exit_ip == OP_EXITVM);
+  vm->frame_stacks[0].ip = exit_ip;
+  int res = frame_push(vm, func) != NULL ? interpret(vm) : 1;
+  if (res != 0) {
+    // unwind the frames left by the error, the globals are kept
+    vm->depth = 0;
+    vm->frame_stacks[0].ip = exit_ip + 1;
+    stack_top_set(vm, base);
+    return res;
+  }
+  Value ret_val = pop(vm);
+  stack_top_set(vm, base);
+  if (!host_value_set(vm, ret_val, result)) {
+    PRINT_ERR_ARGS("unsupported return type of '%s'\n", name);
+    return VM_CALL_INVALID;
+  }
+  return 0;
+}